@@ -1,9 +1,30 @@
-from .pipelines.apache_analysis import call_postgres_to_visualisation_pipeline
-from .pipelines.apache_etl import call_create_postgres_tables_pipeline, \
-    call_csv_to_postgres_pipeline, \
-    send_all_files_to_csv_postgres_pipeline
+import importlib
+
+# The pipelines (and dagster) are imported on first use, so that Apache_logs.engine and the benchmarks
+# only need pandas
+_PIPELINE_MODULES = {
+    'call_postgres_to_visualisation_pipeline': 'apache_analysis',
+    'call_postgres_to_report_pipeline': 'apache_analysis',
+    'call_backfill_csv_to_postgres_pipeline': 'apache_backfill',
+    'call_follow_csv_to_postgres_pipeline': 'apache_follow',
+    'call_create_postgres_tables_pipeline': 'apache_etl',
+    'call_csv_to_postgres_pipeline': 'apache_etl',
+    'send_all_files_to_csv_postgres_pipeline': 'apache_etl',
+    'call_retire_apache_sessions_pipeline': 'apache_etl',
+}
 
 __all__ = ['call_create_postgres_tables_pipeline',
            'call_csv_to_postgres_pipeline',
            'send_all_files_to_csv_postgres_pipeline',
-           'call_postgres_to_visualisation_pipeline']
\ No newline at end of file
+           'call_retire_apache_sessions_pipeline',
+           'call_backfill_csv_to_postgres_pipeline',
+           'call_follow_csv_to_postgres_pipeline',
+           'call_postgres_to_visualisation_pipeline',
+           'call_postgres_to_report_pipeline']
+
+
+def __getattr__(name):
+    if name in _PIPELINE_MODULES:
+        module = importlib.import_module(f'.pipelines.{_PIPELINE_MODULES[name]}', __name__)
+        return getattr(module, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
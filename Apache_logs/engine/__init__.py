@@ -0,0 +1,115 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from .sessions import DEFAULT_SESSION_COOKIE, DEFAULT_SESSION_ID_LENGTH, \
+    session_cookie_regex, unknown_session_id, extract_session_ids, sessionize_by_inactivity
+from .url_rules import URL_RULES, URL_DEFAULT, classify_url_paths
+from .reader import APACHE_CSV_COLUMNS, APACHE_CSV_DTYPES, APACHE_TIMESTAMP_FORMAT, APACHE_SCHEMA_VERSION, \
+    parse_timestamp, read_apache_csv, frame_memory_report
+from .aggregate import SESSION_KEYS, SESSION_AGGREGATES, aggregate_sessions, merge_session_aggregates, \
+    AGGREGATION_ENGINE_GROUPBY, AGGREGATION_ENGINE_REDUCEAT, AGGREGATION_ENGINES, aggregate_sessions_reduceat
+from .streaming import DEFAULT_CHUNKSIZE, DEFAULT_MERGE_CHUNKS, add_derived_columns, stream_session_aggregates
+from .finalize import SESSION_COLUMNS, add_session_duration, final_session_frame
+from .discovery import APACHE_FILENAME_PATTERN, apache_file_date, filename_log_date, discover_apache_files, \
+    fetch_loaded_files, find_pending_files
+from .postgres_load import LOAD_METHOD_COPY, LOAD_METHOD_VALUES, LOAD_METHODS, DEFAULT_BATCH_ROWS, \
+    copy_sessions, insert_sessions_values, load_sessions, SESSION_KEY_INDEX, upsert_sessions, \
+    SESSION_KEY_PARTITIONED_INDEX, prepare_partitions
+from .customer_time import DEFAULT_CUSTOMER_TIMEZONE, CUSTOMER_TIME_COLUMNS, CUSTOMER_TIMEZONE_COMMENT, \
+    CUSTOMER_TIME_INDEXES, local_time_sql, customer_time_columns_sql, check_timezone, customer_timezone, \
+    add_customer_time_columns, local_times, local_timestamp, utc_timestamp
+from .rollups import ROLLUP_TABLE, BOOKING_STEP, ROLLUP_KEYS, ROLLUP_MEASURES, \
+    CREATE_ROLLUP_TABLE_SQL, has_rollups, rollup_frame, add_rollups, rollup_sessions_sql, rebuild_rollups
+from .query_cache import QUERY_CACHE_DIR_ENV, DEFAULT_QUERY_CACHE_DIR, DEFAULT_QUERY_CACHE_MAX_BYTES, \
+    normalize_sql, data_watermark, QueryCache
+from .connection_pool import DEFAULT_POOL_SIZE, DEFAULT_POOL_TIMEOUT, HEALTH_CHECK_SQL, check_connection, \
+    pool_report, ConnectionPool, PooledConnection
+from .analysis import BUCKET_HOUR, BUCKET_DAY, BUCKET_WEEK, BUCKETS, HOUR_BUCKET_MAX_DAYS, DAY_BUCKET_MAX_DAYS, \
+    ANALYSIS_COLUMNS, ANALYSIS_GROUPING_SETS, SESSION_EXTENT_SQL, session_window_sql, rollup_window_sql, \
+    analysis_rollup_sql, visitors_by_country_sql, ANALYSIS_ROLLUP_SQL, VISITORS_BY_COUNTRY_SQL, \
+    parse_window_bound, analysis_window, window_days, choose_bucket, \
+    grouping_mask, split_grouping_sets, analysis_frames, bookings_only
+from .partitions import PARTITION_BY_DAY, PARTITION_BY_MONTH, PARTITION_GRANULARITIES, PARTITION_COMMENT, \
+    check_granularity, partition_bounds, partition_name, session_partitioning, list_session_partitions, \
+    ensure_session_partitions, drop_session_partitions
+from .frame_cache import DEFAULT_FRAME_CACHE_MAX_BYTES, FrameCache
+from .fused import FUSED_CSV_COLUMNS, fused_csv_columns, fused_session_frame, measure_run, \
+    run_summary
+from .shared_frames import DERIVATION_COLUMNS, DEFAULT_SHARED_DIR, shared_frame_path, share_columns, \
+    attach_columns, release_columns
+from .follow import DEFAULT_FOLLOW_MAX_BYTES, read_appended_lines, fetch_checkpoint, fetch_checkpoints, \
+    follow_apache_file
+from .access_log import ACCESS_LOG_FORMAT, ACCESS_LOG_FILENAME_PATTERN, LOG_FORMAT_CSV, LOG_FORMAT_ACCESS_LOG, \
+    LOG_FORMATS, GeoLookup, iter_access_log, read_access_log, read_apache_log
+from .compressed import COMPRESSION_SUFFIXES, file_compression, uncompressed_name, accept_compressed, \
+    open_apache_file, decompress_parse_split
+from .backfill import process_apache_file, process_apache_files
+
+# The figures and report modules import plotly: they are imported as Apache_logs.engine.figures and
+# Apache_logs.engine.report by the analysis solids, so that the ETL does not load plotly
+
+__all__ = ['DEFAULT_SESSION_COOKIE', 'DEFAULT_SESSION_ID_LENGTH',
+           'session_cookie_regex', 'unknown_session_id', 'extract_session_ids',
+           'sessionize_by_inactivity',
+           'URL_RULES', 'URL_DEFAULT', 'classify_url_paths',
+           'APACHE_CSV_COLUMNS', 'APACHE_CSV_DTYPES', 'APACHE_TIMESTAMP_FORMAT', 'APACHE_SCHEMA_VERSION',
+           'parse_timestamp', 'read_apache_csv', 'frame_memory_report',
+           'SESSION_KEYS', 'SESSION_AGGREGATES', 'aggregate_sessions', 'merge_session_aggregates',
+           'AGGREGATION_ENGINE_GROUPBY', 'AGGREGATION_ENGINE_REDUCEAT', 'AGGREGATION_ENGINES',
+           'aggregate_sessions_reduceat',
+           'DEFAULT_CHUNKSIZE', 'DEFAULT_MERGE_CHUNKS', 'add_derived_columns', 'stream_session_aggregates',
+           'SESSION_COLUMNS', 'add_session_duration', 'final_session_frame',
+           'APACHE_FILENAME_PATTERN', 'apache_file_date', 'filename_log_date', 'discover_apache_files',
+           'fetch_loaded_files', 'find_pending_files',
+           'LOAD_METHOD_COPY', 'LOAD_METHOD_VALUES', 'LOAD_METHODS', 'DEFAULT_BATCH_ROWS',
+           'copy_sessions', 'insert_sessions_values', 'load_sessions', 'SESSION_KEY_INDEX', 'upsert_sessions',
+           'SESSION_KEY_PARTITIONED_INDEX', 'prepare_partitions',
+           'DEFAULT_CUSTOMER_TIMEZONE', 'CUSTOMER_TIME_COLUMNS', 'CUSTOMER_TIMEZONE_COMMENT', 'CUSTOMER_TIME_INDEXES',
+           'local_time_sql', 'customer_time_columns_sql', 'check_timezone', 'customer_timezone',
+           'add_customer_time_columns', 'local_times', 'local_timestamp', 'utc_timestamp',
+           'ROLLUP_TABLE', 'BOOKING_STEP', 'ROLLUP_KEYS', 'ROLLUP_MEASURES',
+           'CREATE_ROLLUP_TABLE_SQL', 'has_rollups', 'rollup_frame', 'add_rollups', 'rollup_sessions_sql',
+           'rebuild_rollups',
+           'QUERY_CACHE_DIR_ENV', 'DEFAULT_QUERY_CACHE_DIR', 'DEFAULT_QUERY_CACHE_MAX_BYTES',
+           'normalize_sql', 'data_watermark', 'QueryCache',
+           'DEFAULT_POOL_SIZE', 'DEFAULT_POOL_TIMEOUT', 'HEALTH_CHECK_SQL', 'check_connection', 'pool_report',
+           'ConnectionPool', 'PooledConnection',
+           'BUCKET_HOUR', 'BUCKET_DAY', 'BUCKET_WEEK', 'BUCKETS', 'HOUR_BUCKET_MAX_DAYS', 'DAY_BUCKET_MAX_DAYS',
+           'ANALYSIS_COLUMNS', 'ANALYSIS_GROUPING_SETS', 'SESSION_EXTENT_SQL', 'session_window_sql',
+           'rollup_window_sql', 'analysis_rollup_sql', 'visitors_by_country_sql',
+           'ANALYSIS_ROLLUP_SQL', 'VISITORS_BY_COUNTRY_SQL',
+           'parse_window_bound', 'analysis_window', 'window_days', 'choose_bucket',
+           'grouping_mask', 'split_grouping_sets', 'analysis_frames', 'bookings_only',
+           'PARTITION_BY_DAY', 'PARTITION_BY_MONTH', 'PARTITION_GRANULARITIES', 'PARTITION_COMMENT',
+           'check_granularity', 'partition_bounds', 'partition_name', 'session_partitioning',
+           'list_session_partitions', 'ensure_session_partitions', 'drop_session_partitions',
+           'DEFAULT_FRAME_CACHE_MAX_BYTES', 'FrameCache',
+           'FUSED_CSV_COLUMNS', 'fused_csv_columns', 'fused_session_frame', 'measure_run',
+           'run_summary',
+           'DERIVATION_COLUMNS', 'DEFAULT_SHARED_DIR', 'shared_frame_path', 'share_columns',
+           'attach_columns', 'release_columns',
+           'DEFAULT_FOLLOW_MAX_BYTES', 'read_appended_lines', 'fetch_checkpoint', 'fetch_checkpoints',
+           'follow_apache_file',
+           'ACCESS_LOG_FORMAT', 'ACCESS_LOG_FILENAME_PATTERN', 'LOG_FORMAT_CSV', 'LOG_FORMAT_ACCESS_LOG',
+           'LOG_FORMATS', 'GeoLookup', 'iter_access_log', 'read_access_log', 'read_apache_log',
+           'COMPRESSION_SUFFIXES', 'file_compression', 'uncompressed_name', 'accept_compressed',
+           'open_apache_file', 'decompress_parse_split',
+           'process_apache_file', 'process_apache_files']
@@ -0,0 +1,363 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import mmap
+import re
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from .compressed import file_compression, open_apache_file
+from .reader import APACHE_CSV_COLUMNS, APACHE_CSV_DTYPES, read_apache_csv
+
+##################################################################################
+#   Parse the raw apache access logs, without the csv export
+#   The file is memory-mapped (a .gz/.zst file is streamed) and cut into batches of complete
+#   lines, each batch is matched with one compiled regex (findall runs in C) and turned into
+#   column arrays
+#   The result has the APACHE_CSV_COLUMNS columns and types of read_apache_csv
+##################################################################################
+
+# Expected apache LogFormat: the combined format, followed by the cookie and the response time
+# The two last fields are optional, so the plain combined format is accepted too
+# A missing value is logged as '-', including in the numeric %b and %D fields
+ACCESS_LOG_FORMAT = '%h %l %u %t "%r" %>s %b "%{Referer}i" "%{User-Agent}i" "%{Cookie}i" %D'
+
+# One group per field: ip, time, method, url path (without the query string), status, size,
+# referer, user agent, cookie, response time in microseconds
+# The quoted fields may contain escaped characters (\" for a quote), see unescape_field
+# Each match starts with the end of line of the previous line: findall jumps from one end of line
+# to the next one (a leading literal is searched for quickly) instead of trying every position,
+# the text of a batch is prefixed with an end of line
+ACCESS_LOG_REGEX = re.compile(r'\n(\S+) \S+ \S+ \[([^\]\n]+)\] '
+                              r'"(?:(\S+) ([^\s?"\\]*(?:\\.[^\s?"\\]*)*)|)[^"\\\n]*(?:\\.[^"\\\n]*)*" '
+                              r'(\d{3}) (\d+|-) '
+                              r'"([^"\\\n]*(?:\\.[^"\\\n]*)*)" "([^"\\\n]*(?:\\.[^"\\\n]*)*)"'
+                              r'(?: "([^"\\\n]*(?:\\.[^"\\\n]*)*)")?(?: (\d+|-))?[ \t\r]*(?=\n)')
+
+# Escapes of the quoted fields: \" and \\, the C notation of the whitespace characters, \xhh for the other bytes
+ESCAPE_REGEX = re.compile(rb'\\(x[0-9a-fA-F]{2}|.)', re.DOTALL)
+C_ESCAPES = {b'n': b'\n', b't': b'\t', b'r': b'\r', b'v': b'\v', b'f': b'\f'}
+
+ACCESS_LOG_FIELDS = ['geoip.ip', '@timestamp', 'http_method', 'url_path', 'response_code', 'response_size_bytes',
+                     'referer', 'user_agent_string', 'cookie', 'response_time_microseconds']
+
+# Format of %t, e.g. 25/Nov/2019:00:00:01 +0000
+ACCESS_LOG_TIMESTAMP_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+
+GEO_COLUMNS = ['geoip.city_name', 'geoip.country_code2', 'geoip.country_name', 'geoip.continent_code',
+               'geoip.latitude', 'geoip.longitude', 'geoip.timezone']
+
+MONTH_NUMBERS = {name.encode('ascii'): number + 1 for number, name in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'])}
+
+# Number of bytes of the file matched at a time
+DEFAULT_BATCH_BYTES = 32 * 1024 * 1024
+
+
+def _unescape(match):
+    escape = match.group(1)
+    if len(escape) == 3:
+        return bytes([int(escape[1:], 16)])
+    return C_ESCAPES.get(escape, escape)
+
+
+def unescape_field(value):
+    """
+        Undo the escaping of a quoted field by apache (mod_log_config)
+        :param value: the field, as matched between the quotes
+        :return: the unescaped text, the escaped bytes being decoded as UTF-8
+     """
+    if '\\' not in value:
+        return value
+    return ESCAPE_REGEX.sub(_unescape, value.encode('utf-8')).decode('utf-8', errors='replace')
+
+
+def ipv4_to_int(addresses):
+    """
+        Convert dotted IPv4 addresses to integers
+        :param addresses: pandas Series of strings
+        :return: numpy int64 array, -1 for the values which are not IPv4 addresses (e.g. IPv6)
+     """
+    octets = addresses.str.extract(r'^(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})$').astype('float64').to_numpy()
+    valid = ~np.isnan(octets).any(axis=1) & (np.nan_to_num(octets) < 256).all(axis=1)
+    values = np.nan_to_num(octets).astype(np.int64) @ np.array([1 << 24, 1 << 16, 1 << 8, 1], dtype=np.int64)
+    return np.where(valid, values, -1)
+
+
+class GeoLookup:
+    """
+        Geographical columns of the IPv4 addresses, from a local table of address ranges
+        The table is a csv file with the ip_from and ip_to columns (dotted IPv4, inclusive) and the
+        city_name, country_code2, country_name, continent_code, latitude, longitude and timezone columns
+        (e.g. an export of a GeoLite2 City database)
+        :param ranges: DataFrame of the table
+     """
+
+    def __init__(self, ranges):
+        ranges = ranges.assign(ip_from=ipv4_to_int(ranges['ip_from'].astype(str)),
+                               ip_to=ipv4_to_int(ranges['ip_to'].astype(str)))
+        ranges = ranges[(ranges['ip_from'] >= 0) & (ranges['ip_to'] >= 0)].sort_values('ip_from')
+        self.ip_from = ranges['ip_from'].to_numpy()
+        self.ip_to = ranges['ip_to'].to_numpy()
+        # geoip.city_name is filled from the city_name column of the table, etc.
+        self.columns = {column: ranges[column[len('geoip.'):]].to_numpy() for column in GEO_COLUMNS}
+
+    @classmethod
+    def from_csv(cls, file_path):
+        """
+            Load the table of address ranges
+            :param file_path: path of the csv file
+            :return: GeoLookup
+         """
+        return cls(pd.read_csv(file_path, dtype={'ip_from': str, 'ip_to': str}))
+
+    def lookup(self, addresses):
+        """
+            Geographical columns of IP addresses, the addresses of the same batch are looked up once
+            :param addresses: pandas Series of IP addresses
+            :return: dictionary column name -> array, NaN for the addresses outside of the table
+         """
+        codes, uniques = pd.factorize(addresses)
+        values = ipv4_to_int(pd.Series(uniques, dtype=object))
+
+        # Last range starting at or before the address, which must also end after it
+        position = np.searchsorted(self.ip_from, values, side='right') - 1
+        found = (values >= 0) & (position >= 0)
+        found[found] = values[found] <= self.ip_to[position[found]]
+        rows = np.where(found, position, -1)[codes]
+        rows[codes < 0] = -1
+
+        geo = {}
+        for column, table_values in self.columns.items():
+            column_values = np.full(len(rows), np.nan, dtype=object)
+            column_values[rows >= 0] = table_values[rows[rows >= 0]]
+            geo[column] = column_values
+        return geo
+
+
+def _stream_line_batches(stream, batch_bytes):
+    """ Read a (decompressed) stream and yield batches of complete lines, decoded """
+    rest = b''
+    while True:
+        data = stream.read(batch_bytes)
+        if not data:
+            break
+        data = rest + data
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            # A line longer than the batch: read on until its end
+            rest = data
+            continue
+        rest = data[end:]
+        yield data[:end].decode('utf-8', errors='replace')
+    if rest:
+        yield rest.decode('utf-8', errors='replace')
+
+
+def _line_batches(file_path, batch_bytes, stats=None):
+    """ Memory-map the file and yield batches of complete lines, decoded; a compressed file is streamed """
+    if file_compression(file_path) is not None:
+        with open_apache_file(file_path, stats) as stream:
+            yield from _stream_line_batches(stream, batch_bytes)
+        return
+
+    with open(file_path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return
+        with mapped:
+            start = 0
+            size = len(mapped)
+            while start < size:
+                end = size if start + batch_bytes >= size else mapped.rfind(b'\n', start, start + batch_bytes) + 1
+                if end <= start:
+                    # A line longer than the batch: extend the batch to the end of that line
+                    end = mapped.find(b'\n', start + batch_bytes) + 1 or size
+                yield mapped[start:end].decode('utf-8', errors='replace')
+                start = end
+
+
+def _parse_timestamps(timestamps):
+    """
+        Parse the %t timestamps as UTC, each distinct second once
+        The fixed-width dd/Mon/YYYY:HH:MM:SS +zzzz text is decoded with array arithmetic,
+        any other text falls back to pd.to_datetime
+     """
+    codes, uniques = pd.factorize(timestamps)
+    raw = ''.join(uniques).encode('ascii', errors='replace')
+    width = len('25/Nov/2019:00:00:01 +0000')
+    text = np.frombuffer(raw, dtype=np.uint8).reshape(-1, width) if len(raw) == width * len(uniques) else None
+
+    digit_columns = [0, 1, 7, 8, 9, 10, 12, 13, 15, 16, 18, 19, 22, 23, 24, 25]
+    separators = {2: '/', 6: '/', 11: ':', 14: ':', 17: ':', 20: ' '}
+    month = None
+    if text is not None and all((text[:, column] == ord(separator)).all() for column, separator in separators.items()):
+        digits = text.astype(np.int64) - ord('0')
+        month = pd.Series(text[:, 3:6].copy().view('S3').ravel()).map(MONTH_NUMBERS)
+    if month is None or month.isna().any() or not ((digits[:, digit_columns] >= 0)
+                                                   & (digits[:, digit_columns] <= 9)).all():
+        parsed = pd.to_datetime(pd.Series(uniques, dtype=object), format=ACCESS_LOG_TIMESTAMP_FORMAT, utc=True)
+        return parsed.take(codes).reset_index(drop=True)
+
+    def number(start, end):
+        return digits[:, start:end] @ (10 ** np.arange(end - start - 1, -1, -1))
+
+    months = (number(7, 11) - 1970) * 12 + month.to_numpy(dtype=np.int64) - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]') + (number(0, 2) - 1)
+    seconds = number(12, 14) * 3600 + number(15, 17) * 60 + number(18, 20)
+    utc_offset = (number(22, 24) * 3600 + number(24, 26) * 60) * np.where(text[:, 21] == ord('-'), -1, 1)
+    epoch = days.astype('datetime64[s]').astype(np.int64) + seconds - utc_offset
+
+    parsed = pd.Series(pd.to_datetime(epoch, unit='s', utc=True))
+    return parsed.take(codes).reset_index(drop=True)
+
+
+def _parse_numbers(values):
+    """ Parse the digits fields ('-' or empty when missing) as float64, in one pass over the joined text """
+    text = ' '.join(value if value != '' and value != '-' else 'nan' for value in values)
+    numbers = np.fromstring(text, sep=' ') if len(values) > 0 else np.empty(0)
+    if len(numbers) != len(values):
+        # Not only digits fields
+        return pd.to_numeric(pd.Series(values, dtype=object).replace(['-', ''], np.nan)).to_numpy()
+    return numbers
+
+
+def _typed_frame(fields, geo_lookup):
+    """ Build the DataFrame of the read_apache_csv schema from the column arrays """
+    numbers = ['response_code', 'response_size_bytes', 'response_time_microseconds']
+    df = pd.DataFrame({column: np.array(values, dtype=object)
+                       for column, values in fields.items() if column not in numbers}, dtype=object)
+
+    # '-' (or an empty field) stands for a missing value
+    for column in ['referer', 'user_agent_string', 'cookie', 'http_method', 'url_path']:
+        df[column] = df[column].where(~df[column].isin(['-', '']), np.nan)
+    # Only the values with a backslash are escaped
+    for column in ['referer', 'user_agent_string', 'cookie', 'url_path']:
+        escaped = df[column].str.contains('\\', regex=False, na=False).to_numpy()
+        if escaped.any():
+            df.loc[escaped, column] = df.loc[escaped, column].map(unescape_field)
+    for column in numbers:
+        df[column] = _parse_numbers(fields[column])
+
+    df['@timestamp'] = _parse_timestamps(df['@timestamp'])
+    df['_id'] = np.full(len(df), np.nan, dtype=object)
+
+    if geo_lookup is not None:
+        for column, values in geo_lookup.lookup(df['geoip.ip']).items():
+            df[column] = values
+    else:
+        for column in GEO_COLUMNS:
+            df[column] = np.full(len(df), np.nan, dtype=object)
+
+    df = df[APACHE_CSV_COLUMNS]
+    return df.astype({column: dtype for column, dtype in APACHE_CSV_DTYPES.items()})
+
+
+def _empty_fields():
+    return {column: [] for column in ACCESS_LOG_FIELDS}
+
+
+def _match_batch(text, fields, stats):
+    """ Match the lines of a batch, append the fields to the column lists, return the number of lines matched """
+    matches = ACCESS_LOG_REGEX.findall('\n' + text if text.endswith('\n') else '\n' + text + '\n')
+    if len(matches) > 0:
+        for column, values in zip(ACCESS_LOG_FIELDS, zip(*matches)):
+            fields[column].extend(values)
+    if stats is not None:
+        lines = text.count('\n') + (0 if text.endswith('\n') else 1)
+        stats['lines'] = stats.get('lines', 0) + lines
+        stats['unmatched'] = stats.get('unmatched', 0) + lines - len(matches)
+    return len(matches)
+
+
+def iter_access_log(file_path, geo_lookup=None, batch_bytes=DEFAULT_BATCH_BYTES, stats=None):
+    """
+        Parse a raw apache access log in batches
+        :param file_path: path of the log file
+        :param geo_lookup: optional GeoLookup filling the geo columns
+        :param batch_bytes: number of bytes matched at a time
+        :param stats: optional dictionary, updated with the number of lines and of lines not matched,
+                      and the decompression time and sizes of a compressed file
+        :return: iterator of DataFrames with the read_apache_csv columns and types
+     """
+    for text in _line_batches(file_path, batch_bytes, stats):
+        fields = _empty_fields()
+        if _match_batch(text, fields, stats) > 0:
+            yield _typed_frame(fields, geo_lookup)
+
+
+def read_access_log(file_path, geo_lookup=None, batch_bytes=DEFAULT_BATCH_BYTES, stats=None):
+    """
+        Parse a raw apache access log into a pandas DataFrame with the columns and types of read_apache_csv
+        The _id column (set by the csv export) is empty, the geo columns are empty without geo_lookup
+        :param file_path: path of the log file
+        :param geo_lookup: optional GeoLookup filling the geo columns
+        :param batch_bytes: number of bytes matched at a time
+        :param stats: optional dictionary, updated with the number of lines and of lines not matched,
+                      and the decompression time and sizes of a compressed file
+        :return: DataFrame
+     """
+    # Each batch is typed on its own, so only the column lists of one batch are held as Python objects
+    frames = list(iter_access_log(file_path, geo_lookup, batch_bytes, stats))
+    if len(frames) == 0:
+        return _typed_frame(_empty_fields(), geo_lookup)
+    return _concat_typed_frames(frames)
+
+
+def _concat_typed_frames(frames):
+    """ Concatenate typed batches, the categories of each categorical column are merged (and sorted, as by astype) """
+    if len(frames) == 1:
+        return frames[0]
+    categorical = [column for column, dtype in APACHE_CSV_DTYPES.items() if dtype == 'category']
+    df = pd.concat([frame.drop(columns=categorical) for frame in frames], ignore_index=True)
+    for column in categorical:
+        df[column] = union_categoricals([frame[column] for frame in frames], sort_categories=True)
+    return df[APACHE_CSV_COLUMNS]
+
+
+# Formats of the apache log files accepted by load_apache_csv
+LOG_FORMAT_CSV = 'csv'
+LOG_FORMAT_ACCESS_LOG = 'access_log'
+LOG_FORMATS = [LOG_FORMAT_CSV, LOG_FORMAT_ACCESS_LOG]
+
+# Expected format for the raw access log file names, the date is at the same place as in the csv file names
+ACCESS_LOG_FILENAME_PATTERN = r'apache_access-p-pal-\d{4}.\d{2}.\d{2}.log'
+
+
+def read_apache_log(file_path, log_format=LOG_FORMAT_CSV, geo_lookup=None, stats=None):
+    """
+        Read an apache log file, csv export or raw access log, into a DataFrame of the read_apache_csv schema
+        :param file_path: path of the file
+        :param log_format: LOG_FORMAT_CSV or LOG_FORMAT_ACCESS_LOG
+        :param geo_lookup: optional GeoLookup filling the geo columns of a raw access log
+        :param stats: optional dictionary, updated with the number of lines and of lines not matched,
+                      and the decompression time and sizes of a compressed file
+        :return: DataFrame
+     """
+    if log_format == LOG_FORMAT_CSV:
+        return read_apache_csv(file_path, stats=stats)
+    elif log_format == LOG_FORMAT_ACCESS_LOG:
+        return read_access_log(file_path, geo_lookup=geo_lookup, stats=stats)
+    raise ValueError(f'Invalid log format: {log_format}, expected one of {LOG_FORMATS}')
@@ -0,0 +1,227 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import numpy as np
+import pandas as pd
+
+##################################################################################
+#   Aggregation of the log entries by session
+##################################################################################
+
+# A session is identified by the IP address and the session ID
+SESSION_KEYS = ['geoip.ip', 'session']
+
+# Output column: (source column in the log entries, aggregation of the log entries,
+#                 aggregation used to merge partial aggregates)
+# 'first' skips missing values, so the first of the partial firsts (in file order)
+# is the first value of the whole session: every aggregate below merges exactly
+SESSION_AGGREGATES = {
+    # Keep the group by columns
+    'ip_address': ('geoip.ip', 'first', 'first'),
+    'session_id': ('session', 'first', 'first'),
+    # Get channel for each session
+    'channel': ('channel', 'first', 'first'),
+    # Get minimum and maximum session time for the session
+    'session_start_time': ('@timestamp', 'min', 'min'),
+    'session_end_time': ('@timestamp', 'max', 'max'),
+    # Get first and max step reached for the session
+    'first_step': ('accessed_step', 'min', 'min'),
+    'last_step': ('accessed_step', 'max', 'max'),
+    # Total number of pages reached for the session
+    'num_pages_accessed': ('accessed_step', 'size', 'sum'),
+    # Get geographical columns for the session
+    'continent_code': ('geoip.continent_code', 'first', 'first'),
+    'country_code': ('geoip.country_code2', 'first', 'first'),
+    'country_name': ('geoip.country_name', 'first', 'first'),
+    'city_name': ('geoip.city_name', 'first', 'first'),
+    'latitude': ('geoip.latitude', 'first', 'first'),
+    'longitude': ('geoip.longitude', 'first', 'first'),
+    'timezone': ('geoip.timezone', 'first', 'first'),
+}
+
+
+def aggregate_sessions(apache_df):
+    """
+        Aggregate the log entries (with the derived session, channel and accessed_step columns)
+        per ip_address, session_id
+        The result of a chunk of the file is a partial aggregate that can be merged
+        with merge_session_aggregates
+        :param apache_df: pandas DataFrame of log entries
+        :return: DataFrame indexed by (geoip.ip, session), one row per session
+     """
+    return apache_df.groupby(SESSION_KEYS, as_index=True).agg(
+        **{name: (column, how) for name, (column, how, _) in SESSION_AGGREGATES.items()})
+
+
+def merge_session_aggregates(partials):
+    """
+        Merge partial session aggregates, given in file order, into one aggregate per session
+        The result is identical to aggregate_sessions on the concatenated log entries
+        :param partials: list of DataFrames returned by aggregate_sessions
+        :return: DataFrame indexed by (geoip.ip, session), one row per session
+     """
+    partials = [partial for partial in partials if partial is not None and not partial.empty]
+    if len(partials) == 0:
+        return pd.DataFrame()
+    if len(partials) == 1:
+        return partials[0]
+
+    merged = pd.concat(partials).groupby(level=[0, 1]).agg(
+        {name: merge for name, (_, _, merge) in SESSION_AGGREGATES.items()})
+    merged.index.names = SESSION_KEYS
+
+    return merged
+
+
+##################################################################################
+#   NumPy engine: factorize the session key once, sort once and reduce every
+#   aggregate with ufunc.reduceat on the underlying arrays
+##################################################################################
+
+# Aggregation engines of aggregate_df_by_session
+AGGREGATION_ENGINE_GROUPBY = 'groupby'
+AGGREGATION_ENGINE_REDUCEAT = 'reduceat'
+AGGREGATION_ENGINES = [AGGREGATION_ENGINE_GROUPBY, AGGREGATION_ENGINE_REDUCEAT]
+
+
+def _reduce_first(column, order, starts, lengths, session_of_entry):
+    """
+        First valid value of each group ('first' of groupby skips the missing values)
+        Only the first entry of each session is read, the following entries are only searched
+        for the sessions whose first entry has a missing value
+        :param column: pandas Series of the log entries
+        :param order: position of the log entries sorted by session, in file order within each session
+        :param starts: position in order of the first entry of each session
+        :param lengths: number of entries of each session
+        :param session_of_entry: session number of each position in order
+        :return: array of the first valid value of each session
+     """
+    categorical = isinstance(column.dtype, pd.CategoricalDtype)
+    values = column.cat.codes.to_numpy() if categorical else column.to_numpy()
+
+    first_values = values[order[starts]]
+    missing = first_values < 0 if categorical else pd.isna(first_values)
+
+    if missing.any():
+        searched = np.flatnonzero(np.repeat(missing, lengths))
+        searched_values = values[order[searched]]
+        valid = searched[searched_values >= 0 if categorical else pd.notna(searched_values)]
+
+        # The searched positions are sorted, so the first valid entry of a session comes first
+        valid_sessions = session_of_entry[valid]
+        first_found = np.flatnonzero(np.r_[True, valid_sessions[1:] != valid_sessions[:-1]])
+        found_sessions = valid_sessions[first_found]
+        if not categorical:
+            if first_values.dtype.kind in 'iub':
+                first_values = first_values.astype('float64')
+            # groupby gives None for the object columns without any valid value, NaN otherwise
+            first_values[missing] = None if first_values.dtype == object else np.nan
+        first_values[found_sessions] = values[order[valid[first_found]]]
+
+    if categorical:
+        return pd.Categorical.from_codes(first_values, dtype=column.dtype)
+    return first_values
+
+
+def _reduce_minmax(column, ufunc, starts):
+    """
+        Minimum or maximum of each group, skipping the missing values as groupby does
+        :param column: pandas Series sorted by session
+        :param ufunc: np.minimum or np.maximum
+        :param starts: position of the first row of each group
+        :return: array (or DatetimeIndex) of the reduced value of each group
+     """
+    if isinstance(column.dtype, pd.DatetimeTZDtype) or column.dtype.kind == 'M':
+        # Reduce the int64 nanoseconds, then restore the datetime type
+        # NaT is the smallest int64: it is replaced by the neutral value of the ufunc so that it never wins,
+        # and restored for the groups whose entries are all NaT
+        values = column.to_numpy(dtype='datetime64[ns]').view('i8')
+        nat = column.isna().to_numpy()
+        if nat.any():
+            neutral = np.iinfo(np.int64).max if ufunc is np.minimum else np.iinfo(np.int64).min
+            values = np.where(nat, neutral, values)
+        reduced = ufunc.reduceat(values, starts)
+        if nat.any():
+            reduced[np.logical_and.reduceat(nat, starts)] = np.iinfo(np.int64).min
+        reduced = pd.DatetimeIndex(reduced.view('datetime64[ns]'))
+        if isinstance(column.dtype, pd.DatetimeTZDtype):
+            reduced = reduced.tz_localize('UTC').tz_convert(column.dtype.tz)
+        return reduced
+    if column.dtype.kind == 'f':
+        # fmin/fmax ignore NaN unless the whole group is NaN
+        ufunc = np.fmin if ufunc is np.minimum else np.fmax
+    return ufunc.reduceat(column.to_numpy(), starts)
+
+
+def aggregate_sessions_reduceat(apache_df, with_duration=True):
+    """
+        Aggregate the log entries per ip_address, session_id, with the result of aggregate_sessions
+        The (geoip.ip, session) key is factorized and sorted once; min/max/size/first are computed
+        with ufunc.reduceat on the sorted arrays instead of groupby
+        :param apache_df: pandas DataFrame of log entries, with the derived session columns
+        :param with_duration: also compute session_duration (in seconds) in the same pass
+        :return: DataFrame indexed by (geoip.ip, session), one row per session
+     """
+    # Factorize the key once, sorted so the groups come out in groupby order
+    # Entries without IP address (or session) are dropped, as groupby does
+    ip_codes, ips = pd.factorize(apache_df[SESSION_KEYS[0]], sort=True)
+    session_codes, sessions = pd.factorize(apache_df[SESSION_KEYS[1]], sort=True)
+    keyed = np.flatnonzero((ip_codes >= 0) & (session_codes >= 0))
+    if len(keyed) == 0:
+        return aggregate_sessions(apache_df.iloc[0:0])
+    key = ip_codes[keyed].astype(np.int64) * len(sessions) + session_codes[keyed]
+
+    # Sort once, stable so that 'first' is the first entry of the session in the file
+    sort = np.argsort(key, kind='stable')
+    order = keyed[sort]
+    sorted_key = key[sort]
+    starts = np.flatnonzero(np.r_[True, sorted_key[1:] != sorted_key[:-1]])
+    lengths = np.diff(np.r_[starts, len(sorted_key)])
+    session_of_entry = np.repeat(np.arange(len(starts)), lengths)
+
+    # The columns reduced with min/max are gathered in session order once
+    sorted_columns = {}
+    columns = {}
+    for name, (source, how, _) in SESSION_AGGREGATES.items():
+        if how == 'first':
+            columns[name] = _reduce_first(apache_df[source], order, starts, lengths, session_of_entry)
+        elif how == 'size':
+            columns[name] = lengths.astype(np.int64)
+        elif how in ['min', 'max']:
+            if source not in sorted_columns:
+                sorted_columns[source] = apache_df[source].iloc[order]
+            columns[name] = _reduce_minmax(sorted_columns[source], np.minimum if how == 'min' else np.maximum,
+                                           starts)
+        else:
+            raise ValueError(f'Unsupported aggregation: {how}')
+
+    index = pd.MultiIndex.from_arrays([ips.take(ip_codes[order[starts]]),
+                                       sessions.take(session_codes[order[starts]])],
+                                      names=SESSION_KEYS)
+    agg_df = pd.DataFrame(columns, index=index)
+
+    if with_duration:
+        # Whole seconds between the first and last entry, without wrapping at one day,
+        # missing (nullable Int64) for a session without any timestamp
+        duration = (agg_df['session_end_time'] - agg_df['session_start_time']) // pd.Timedelta(seconds=1)
+        agg_df['session_duration'] = duration.astype('Int64')
+
+    return agg_df
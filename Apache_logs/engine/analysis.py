@@ -0,0 +1,306 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import pandas as pd
+
+from .customer_time import DEFAULT_CUSTOMER_TIMEZONE, customer_timezone, local_timestamp, utc_timestamp
+from .query_cache import data_watermark
+from .rollups import ROLLUP_TABLE
+
+##################################################################################
+#   Analysis data layer: the datasets of all the graphs in one GROUPING SETS query
+#   over apache_session_rollup, split into named frames the graph solids slice
+#   Only the visitors by country, not in the rollup, are read from apache_session
+#   The queries are limited to a [from, to) window of session start, in customer-local
+#   time like the graphs, and the bookings over time are bucketed by hour, day or week
+#   depending on its span
+##################################################################################
+
+# Resolutions of the bookings over time
+BUCKET_HOUR = 'hour'
+BUCKET_DAY = 'day'
+BUCKET_WEEK = 'week'
+BUCKETS = [BUCKET_HOUR, BUCKET_DAY, BUCKET_WEEK]
+
+# Longest windows bucketed by hour and by day, in days; longer windows are bucketed by week
+HOUR_BUCKET_MAX_DAYS = 2
+DAY_BUCKET_MAX_DAYS = 92
+
+# Start of the bucket of a rollup row: the customer hour the session started, or the customer date it ended
+# (the booking date), truncated to the week; the rollup has no end hour
+_bucket_sql = {
+    BUCKET_HOUR: "session_date + session_hour * interval '1 hour'",
+    BUCKET_DAY: 'end_date::timestamp',
+    BUCKET_WEEK: "date_trunc('week', end_date::timestamp)",
+}
+
+# Columns of the rollup query, in the order of the GROUPING() arguments
+ANALYSIS_COLUMNS = ['session_hour', 'channel', 'last_step', 'step_name', 'bucket_start']
+
+# Grouping set of each named frame
+ANALYSIS_GROUPING_SETS = {
+    'by_hour': ['session_hour'],
+    'by_channel': ['channel'],
+    'by_channel_step': ['channel', 'last_step', 'step_name'],
+    'by_bucket_channel': ['bucket_start', 'channel'],
+    'by_step': ['last_step', 'step_name'],
+}
+
+_column_sql = {'session_hour': 'r.session_hour', 'channel': 'r.channel', 'last_step': 'r.last_step',
+               'step_name': 'b.step_name', 'bucket_start': 'r.bucket_start'}
+
+# First and last session start, read from the ends of idx_apache_session_start
+SESSION_EXTENT_SQL = 'SELECT min(session_start_time) AS first_start, max(session_start_time) AS last_start ' \
+                     'FROM apache_session'
+
+
+def _timestamp_sql(timestamp):
+    return f"'{timestamp:%Y-%m-%d %H:%M:%S}'::timestamp"
+
+
+def session_window_sql(window, timezone=DEFAULT_CUSTOMER_TIMEZONE):
+    """
+        Condition of the sessions started in the window: the local bounds are moved to UTC, so that the condition
+        is on session_start_time, idx_apache_session_start is used and the partitions outside the window are pruned
+        :param window: tuple of (from, to) customer-local Timestamps, either may be None
+        :param timezone: customer timezone of the window
+        :return: SQL condition
+     """
+    conditions = ['TRUE']
+    if window[0] is not None:
+        conditions.append(f'session_start_time >= {_timestamp_sql(utc_timestamp(window[0], timezone))}')
+    if window[1] is not None:
+        conditions.append(f'session_start_time < {_timestamp_sql(utc_timestamp(window[1], timezone))}')
+    return ' AND '.join(conditions)
+
+
+def rollup_window_sql(window):
+    """
+        Condition of the rollup rows of the sessions started in the window, on session_date (the leading column
+        of the rollup key) then on the customer hour
+        The rollup is by customer hour: the window bounds are expected on the hour, and a bound in the hour
+        repeated when daylight saving time ends takes both hours
+        :param window: tuple of (from, to) customer-local Timestamps, either may be None
+        :return: SQL condition
+     """
+    local_start = _bucket_sql[BUCKET_HOUR]
+    conditions = ['TRUE']
+    if window[0] is not None:
+        conditions.append(f"session_date >= '{window[0]:%Y-%m-%d}'::date")
+        conditions.append(f'{local_start} >= {_timestamp_sql(window[0])}')
+    if window[1] is not None:
+        conditions.append(f"session_date <= '{window[1]:%Y-%m-%d}'::date")
+        conditions.append(f'{local_start} < {_timestamp_sql(window[1])}')
+    return ' AND '.join(conditions)
+
+
+def analysis_rollup_sql(window=(None, None), bucket=BUCKET_DAY):
+    """
+        GROUPING SETS query of the datasets of the graphs over the rollup
+        :param window: tuple of (from, to) customer-local Timestamps of the session start, either may be None
+        :param bucket: resolution of the bookings over time, one of BUCKETS
+        :return: SQL query
+     """
+    if bucket not in BUCKETS:
+        raise ValueError(f'Invalid bucket: {bucket}, expected one of {", ".join(BUCKETS)}')
+    return f'''SELECT {", ".join(f"{_column_sql[c]} AS {c}" for c in ANALYSIS_COLUMNS)},
+           GROUPING({", ".join(_column_sql[c] for c in ANALYSIS_COLUMNS)}) AS grouping_set,
+           sum(r.sessions)::bigint AS sessions,
+           sum(r.bookings)::bigint AS bookings,
+           sum(r.session_duration_sum)::bigint AS session_duration_sum
+    FROM (SELECT *, {_bucket_sql[bucket]} AS bucket_start
+          FROM {ROLLUP_TABLE}
+          WHERE {rollup_window_sql(window)}) r
+    LEFT JOIN booking_step b ON r.last_step = b.step_number
+    GROUP BY GROUPING SETS ({", ".join("(" + ", ".join(_column_sql[c] for c in columns) + ")"
+                                       for columns in ANALYSIS_GROUPING_SETS.values())})'''
+
+
+def visitors_by_country_sql(window=(None, None), timezone=DEFAULT_CUSTOMER_TIMEZONE):
+    """
+        Visitors of the Asian and Oceanian countries (graph7)
+        :param window: tuple of (from, to) customer-local Timestamps of the session start, either may be None
+        :param timezone: customer timezone of the window
+        :return: SQL query
+     """
+    return f'''SELECT country_code, country_name, count(*) number_of_visitors
+    FROM apache_session
+    WHERE {session_window_sql(window, timezone)}
+    AND continent_code IN ('AS', 'OC')
+    AND country_code != 'NaN'
+    GROUP BY country_code, country_name
+    ORDER BY count(*) DESC'''
+
+
+# Queries of all of history
+ANALYSIS_ROLLUP_SQL = analysis_rollup_sql()
+VISITORS_BY_COUNTRY_SQL = visitors_by_country_sql()
+
+
+def parse_window_bound(value):
+    """
+        Parse a bound of the analysis window, YYYY-MM-DD or YYYY.MM.DD with an optional HH:MM time,
+        in customer-local time
+        :param value: the date string, may be empty
+        :return: local Timestamp without time zone, None if value is empty
+     """
+    if value is None or value == '':
+        return None
+    date, _, time = value.strip().partition(' ')
+    return pd.Timestamp(f'{date.replace(".", "-")} {time}'.strip())
+
+
+def analysis_window(date_from=None, date_to=None, extent=None, timezone=DEFAULT_CUSTOMER_TIMEZONE):
+    """
+        The [from, to) window of session start in customer-local time, on the hour, an open bound being the
+        extent of the data
+        :param date_from: first session start, local Timestamp or string for parse_window_bound, may be empty
+        :param date_to: end of the window (excluded), local Timestamp or string for parse_window_bound, may be empty
+        :param extent: tuple of the first and last session_start_time (UTC) in the data, for the open bounds
+        :param timezone: customer timezone of the window
+        :return: tuple of (from, to) local Timestamps, None if open and no data
+     """
+    date_from = date_from if isinstance(date_from, pd.Timestamp) else parse_window_bound(date_from)
+    date_to = date_to if isinstance(date_to, pd.Timestamp) else parse_window_bound(date_to)
+    if extent is not None:
+        if date_from is None and not pd.isnull(extent[0]):
+            date_from = local_timestamp(extent[0], timezone)
+        if date_to is None and not pd.isnull(extent[1]):
+            # the hour of the last session is included
+            date_to = local_timestamp(extent[1], timezone).floor('h') + pd.Timedelta(hours=1)
+
+    date_from = None if date_from is None else date_from.floor('h')
+    date_to = None if date_to is None else date_to.ceil('h')
+    if date_from is not None and date_to is not None and date_from >= date_to:
+        raise ValueError(f'Invalid analysis window: [{date_from}, {date_to})')
+    return date_from, date_to
+
+
+def window_days(window):
+    """
+        Number of days in the window, the divisor of the daily averages
+        :param window: tuple of (from, to) Timestamps
+        :return: float, 0.0 if the window is open
+     """
+    if window[0] is None or window[1] is None:
+        return 0.0
+    return (window[1] - window[0]) / pd.Timedelta(days=1)
+
+
+def choose_bucket(days):
+    """
+        Resolution of the bookings over time for a window, so that the graphs have a readable number of bars
+        :param days: number of days in the window
+        :return: one of BUCKETS
+     """
+    if days <= HOUR_BUCKET_MAX_DAYS:
+        return BUCKET_HOUR
+    if days <= DAY_BUCKET_MAX_DAYS:
+        return BUCKET_DAY
+    return BUCKET_WEEK
+
+
+def grouping_mask(columns):
+    """
+        Value of GROUPING() for the rows of a grouping set: a bit set for each column not grouped,
+        the first column being the most significant bit
+        :param columns: columns of the grouping set
+        :return: integer
+     """
+    n = len(ANALYSIS_COLUMNS)
+    return sum(1 << (n - 1 - i) for i, column in enumerate(ANALYSIS_COLUMNS) if column not in columns)
+
+
+def split_grouping_sets(rollup_df):
+    """
+        Split the result of ANALYSIS_ROLLUP_SQL into one frame per grouping set
+        :param rollup_df: DataFrame returned by ANALYSIS_ROLLUP_SQL
+        :return: dictionary of DataFrames with the grouping set columns and the measures, by frame name
+     """
+    measures = ['sessions', 'bookings', 'session_duration_sum']
+    frames = {}
+    for name, columns in ANALYSIS_GROUPING_SETS.items():
+        rows = rollup_df[rollup_df['grouping_set'] == grouping_mask(columns)]
+        rows = rows[columns + measures].sort_values(columns).reset_index(drop=True)
+        # The integer keys are read as floats, being NULL in the rows of the other grouping sets
+        frames[name] = rows.astype({column: 'int64' for column in ['session_hour', 'last_step'] if column in columns})
+    return frames
+
+
+def analysis_frames(connection, log=None, cache=None, stats=None, date_from=None, date_to=None, bucket=None):
+    """
+        Compute the datasets of the graphs: one GROUPING SETS query over the rollup, one query for the countries
+        With a query cache, only the data watermark is read from postgres when the data did not change
+        :param connection: postgres connection
+        :param log: optional logger (e.g. context.log)
+        :param cache: optional QueryCache of the query results
+        :param stats: optional dictionary, updated with the number of cache hits and misses
+        :param date_from: first session start of the window, customer-local, see analysis_window;
+                          default: the first session
+        :param date_to: end of the window (excluded), customer-local, see analysis_window;
+                        default: after the last session
+        :param bucket: resolution of the bookings over time, one of BUCKETS; default: chosen by the window span
+        :return: dictionary of DataFrames by name: by_hour, by_channel, by_channel_step, by_bucket_channel, by_step
+                 and by_country, and 'window': dictionary of the window from, to (customer-local), days and bucket
+     """
+    cursor = connection.cursor()
+    try:
+        timezone = customer_timezone(cursor) or DEFAULT_CUSTOMER_TIMEZONE
+        watermark = data_watermark(cursor) if cache is not None else None
+    finally:
+        cursor.close()
+
+    if cache is None:
+        def read_sql(sql):
+            return pd.read_sql(sql, connection)
+    else:
+
+        def read_sql(sql):
+            return cache.read_sql(sql, connection, watermark, stats)
+
+    extent = None
+    if date_from is None or date_from == '' or date_to is None or date_to == '':
+        extent_df = read_sql(SESSION_EXTENT_SQL)
+        extent = (extent_df.at[0, 'first_start'], extent_df.at[0, 'last_start'])
+    window = analysis_window(date_from, date_to, extent, timezone)
+    days = window_days(window)
+    if bucket is None or bucket == '':
+        bucket = choose_bucket(days)
+
+    rollup_df = read_sql(analysis_rollup_sql(window, bucket))
+    frames = split_grouping_sets(rollup_df)
+    frames['by_country'] = read_sql(visitors_by_country_sql(window, timezone))
+
+    if log is not None:
+        log.info(f'Computed {len(frames)} analysis frames: ' +
+                 ', '.join(f'{name} ({len(df)} rows)' for name, df in frames.items()))
+        log.info(f'Analysis window [{window[0]}, {window[1]}) {timezone}: {days:.1f} days, bookings by {bucket}')
+    frames['window'] = {'from': window[0], 'to': window[1], 'days': days, 'bucket': bucket}
+    return frames
+
+
+def bookings_only(df):
+    """
+        Keep the rows of a frame with bookings, as a query filtered on the booking step would
+        :param df: frame of analysis_frames
+        :return: DataFrame
+     """
+    return df[df['bookings'] > 0].reset_index(drop=True)
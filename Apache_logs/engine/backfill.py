@@ -0,0 +1,90 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .compressed import decompress_parse_split
+from .finalize import add_session_duration, final_session_frame
+from .sessions import DEFAULT_SESSION_COOKIE, DEFAULT_SESSION_ID_LENGTH
+from .streaming import DEFAULT_CHUNKSIZE, stream_session_aggregates
+
+##################################################################################
+#   Backfill: parse and aggregate many apache csv files in a process pool
+##################################################################################
+
+
+def process_apache_file(apache_file, staging_dir, chunksize=DEFAULT_CHUNKSIZE,
+                        cookie_name=DEFAULT_SESSION_COOKIE, id_length=DEFAULT_SESSION_ID_LENGTH, idle_timeout=None):
+    """
+        Parse and aggregate one apache csv file into the final apache_session frame
+        The frame is staged as a pickle file, so only a small result travels back to the parent process
+        A compressed file is decompressed in the worker, so the files decompress in parallel
+        :param apache_file: dictionary returned by discover_apache_files
+        :param staging_dir: directory where the final frame is staged
+        :param chunksize: number of log entries read at a time
+        :param cookie_name: name of the cookie holding the session ID
+        :param id_length: number of word characters in the session ID
+        :param idle_timeout: if set, inactivity gap (in seconds) splitting the cookie-less entries into sessions
+        :return: dictionary describing the outcome for this file
+     """
+    start = time.perf_counter()
+    result = {'name': apache_file['name'], 'log_date': apache_file['log_date'],
+              'staged_path': None, 'rows': 0, 'sessions': 0, 'error': None, 'split': ''}
+    stats = {}
+    try:
+        agg_df, rows = stream_session_aggregates(apache_file['path'], apache_file['file_date'],
+                                                 chunksize=chunksize, cookie_name=cookie_name,
+                                                 id_length=id_length, idle_timeout=idle_timeout, stats=stats)
+        result['rows'] = rows
+        result['split'] = decompress_parse_split(stats, time.perf_counter() - start)
+        if not agg_df.empty:
+            final_df = final_session_frame(add_session_duration(agg_df))
+            result['sessions'] = len(final_df)
+            staged_path = os.path.join(staging_dir, apache_file['name'] + '.pkl')
+            final_df.to_pickle(staged_path)
+            result['staged_path'] = staged_path
+    except Exception as exc:
+        result['error'] = f'{type(exc).__name__}: {exc}'
+    result['seconds'] = time.perf_counter() - start
+
+    return result
+
+
+def process_apache_files(apache_files, staging_dir, workers=None, **kwargs):
+    """
+        Parse and aggregate apache csv files in a process pool
+        :param apache_files: list of dictionaries returned by discover_apache_files
+        :param staging_dir: directory where the final frames are staged
+        :param workers: number of worker processes, default is the number of CPUs
+        :param kwargs: chunksize, cookie_name, id_length and idle_timeout passed to process_apache_file
+        :return: generator of process_apache_file results, in completion order
+     """
+    if len(apache_files) == 0:
+        return
+
+    workers = min(workers or os.cpu_count() or 1, len(apache_files))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(process_apache_file, apache_file, staging_dir, **kwargs)
+                   for apache_file in apache_files]
+        for future in as_completed(futures):
+            yield future.result()
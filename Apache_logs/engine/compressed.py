@@ -0,0 +1,142 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import gzip
+import io
+import os
+import time
+from contextlib import contextmanager
+
+##################################################################################
+#   Compressed apache files: the rotated logs are stored gzip or zstd compressed
+#   They are decompressed as a stream straight into the parser, never to disk
+#   The time spent in the decompressor is measured, so the decompression and
+#   parse times can be reported separately
+##################################################################################
+
+# Suffix of the compressed files, after the name of the uncompressed file
+COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
+
+# Optional regex suffix of the filename patterns, accepting the compressed variants
+COMPRESSED_SUFFIX_PATTERN = r'(\.gz|\.zst)?$'
+
+
+def file_compression(file_path):
+    """
+        Compression of a file, from its suffix
+        :param file_path: path or name of the file
+        :return: 'gzip', 'zstd' or None if the file is not compressed
+     """
+    for suffix, compression in COMPRESSION_SUFFIXES.items():
+        if str(file_path).endswith(suffix):
+            return compression
+    return None
+
+
+def uncompressed_name(filename):
+    """
+        Name of a file without its compression suffix
+        :param filename: name of the file
+        :return: the name, without .gz or .zst
+     """
+    for suffix in COMPRESSION_SUFFIXES:
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+
+def accept_compressed(filename_pattern):
+    """
+        Extend a filename pattern so it also matches the compressed variants of the files
+        :param filename_pattern: regex of the uncompressed file names, e.g. APACHE_FILENAME_PATTERN
+        :return: regex matching the uncompressed, .gz and .zst file names
+     """
+    if filename_pattern.endswith(COMPRESSED_SUFFIX_PATTERN):
+        return filename_pattern
+    return filename_pattern.rstrip('$') + COMPRESSED_SUFFIX_PATTERN
+
+
+class _TimedReader(io.RawIOBase):
+    """ Raw binary stream over a decompressor, adding the seconds spent decompressing to stats """
+
+    def __init__(self, stream, stats):
+        self._stream = stream
+        self._stats = stats
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        start = time.perf_counter()
+        data = self._stream.read(len(buffer))
+        self._stats['decompress_seconds'] += time.perf_counter() - start
+        self._stats['uncompressed_bytes'] += len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _decompressor(raw, compression):
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError('Reading .zst files requires the zstandard package: pip install zstandard')
+    return zstandard.ZstdDecompressor().stream_reader(raw)
+
+
+@contextmanager
+def open_apache_file(file_path, stats=None):
+    """
+        Open an apache file for reading, decompressing it as a stream if it is compressed
+        An uncompressed file is not opened, its path is returned so the parser reads it directly
+        :param file_path: path of the file
+        :param stats: optional dictionary, updated with decompress_seconds, compressed_bytes and uncompressed_bytes
+        :return: context manager giving the path of an uncompressed file, or a binary stream
+     """
+    compression = file_compression(file_path)
+    if compression is None:
+        yield file_path
+        return
+
+    stats = stats if stats is not None else {}
+    for key in ['decompress_seconds', 'compressed_bytes', 'uncompressed_bytes']:
+        stats.setdefault(key, 0)
+    stats['compressed_bytes'] += os.path.getsize(file_path)
+    with open(file_path, 'rb') as raw:
+        with _decompressor(raw, compression) as stream:
+            yield io.BufferedReader(_TimedReader(stream, stats), buffer_size=1024 * 1024)
+
+
+def decompress_parse_split(stats, seconds):
+    """
+        Describe the split of a read between decompression and parsing
+        :param stats: dictionary updated by open_apache_file
+        :param seconds: total seconds of the read
+        :return: description, empty if the file was not compressed
+     """
+    if 'decompress_seconds' not in stats:
+        return ''
+    decompress = stats['decompress_seconds']
+    ratio = stats['uncompressed_bytes'] / stats['compressed_bytes'] if stats['compressed_bytes'] else 0
+    return (f'decompression {decompress:.2f}s, parse {max(seconds - decompress, 0):.2f}s, '
+            f'{stats["compressed_bytes"] / 1024 ** 2:.1f} MB -> {stats["uncompressed_bytes"] / 1024 ** 2:.1f} MB '
+            f'(x{ratio:.1f})')
@@ -0,0 +1,239 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import threading
+import time
+
+##################################################################################
+#   Thread safe pool of postgres connections, in the style of psycopg2.pool, over
+#   any connection factory (e.g. the postgres_warehouse resource of dagster_toolkit)
+#   A borrower waits for a returned connection when the pool is full, and an idle
+#   connection is checked (SELECT 1) before it is lent again
+##################################################################################
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_POOL_TIMEOUT = 30.0
+
+HEALTH_CHECK_SQL = 'SELECT 1'
+
+
+def check_connection(connection):
+    """
+        Health check of an idle connection: a round trip to the server
+        :param connection: postgres connection
+        :return: True if the connection answers
+     """
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(HEALTH_CHECK_SQL)
+            cursor.fetchone()
+        finally:
+            cursor.close()
+        connection.rollback()
+        return True
+    except Exception:
+        return False
+
+
+def pool_report(stats, before=None):
+    """
+        Describe the activity of a connection pool
+        :param stats: statistics of the pool, see ConnectionPool.stats
+        :param before: optional earlier statistics, to report the activity since then
+        :return: description string
+     """
+    if before is not None:
+        stats = {key: stats[key] - before.get(key, 0) for key in stats}
+    borrowed = stats['borrowed']
+    avg_wait = stats['wait_seconds'] / borrowed if borrowed else 0.0
+    report = f'{borrowed} borrows, {stats["reused"]} reused, {stats["created"]} connections opened, ' \
+             f'{stats["replaced"]} failed health checks, {stats["waited"]} waits, wait avg {avg_wait * 1000:.1f} ms'
+    if before is None:
+        # the longest wait is only known since the pool was created
+        report += f' max {stats["max_wait_seconds"] * 1000:.1f} ms'
+    return report
+
+
+class ConnectionPool(object):
+    """
+        Thread safe pool of connections
+        :param connect: function opening a connection, called with the arguments of borrow(); may return None
+        :param close: function closing a connection
+        :param size: maximum number of connections
+        :param timeout: seconds to wait for a connection when the pool is full
+        :param health_check: check an idle connection before lending it
+     """
+
+    def __init__(self, connect, close, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_POOL_TIMEOUT, health_check=True):
+        if size < 1:
+            raise ValueError(f'Invalid pool size: {size}')
+        self.connect = connect
+        self.close = close
+        self.size = size
+        self.timeout = timeout
+        self.health_check = health_check
+        self._condition = threading.Condition()
+        self._idle = []
+        self._uses = {}
+        self._opened = 0
+        self._closed = False
+        self._stats = {'borrowed': 0, 'reused': 0, 'created': 0, 'replaced': 0, 'waited': 0,
+                       'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+
+    def stats(self):
+        """
+            Statistics of the pool: borrows, reuses of idle connections, connections opened, failed health checks,
+            borrows which waited for a connection, and the total and longest wait
+            :return: dictionary of statistics
+         """
+        with self._condition:
+            return dict(self._stats)
+
+    def borrow(self, *args):
+        """
+            Lend an idle connection, or open one if the pool is not full, else wait for one to be returned
+            :param args: arguments of the connect function
+            :return: tuple of connection (None if it could not be opened) and dictionary of wait_seconds,
+                     reused and uses (number of times the connection was lent)
+         """
+        start = time.perf_counter()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('Connection pool is closed')
+            waited = False
+            while not self._idle and self._opened >= self.size:
+                waited = True
+                remaining = self.timeout - (time.perf_counter() - start)
+                if remaining <= 0 or not self._condition.wait(remaining):
+                    if not self._idle and self._opened >= self.size:
+                        raise TimeoutError(f'No connection returned to the pool of {self.size} '
+                                           f'within {self.timeout}s')
+            connection = self._idle.pop() if self._idle else None
+            if connection is None:
+                # reserve the slot, the connection is opened outside the lock
+                self._opened += 1
+            wait_seconds = time.perf_counter() - start
+            self._stats['borrowed'] += 1
+            self._stats['waited'] += waited
+            self._stats['wait_seconds'] += wait_seconds
+            self._stats['max_wait_seconds'] = max(self._stats['max_wait_seconds'], wait_seconds)
+
+        reused = connection is not None
+        if reused and self.health_check and not check_connection(connection):
+            # keep the slot for the replacement connection
+            self._discard(connection, replaced=True, release=False)
+            reused = False
+            connection = None
+        if connection is None:
+            connection = self._open(*args)
+            if connection is None:
+                return None, {'wait_seconds': wait_seconds, 'reused': False, 'uses': 0}
+
+        with self._condition:
+            self._stats['reused'] += reused
+            uses = self._uses.get(id(connection), 0) + 1
+            self._uses[id(connection)] = uses
+        return connection, {'wait_seconds': wait_seconds, 'reused': reused, 'uses': uses}
+
+    def give_back(self, connection, discard=False):
+        """
+            Return a borrowed connection; its transaction is rolled back
+            :param connection: the connection
+            :param discard: close the connection instead of keeping it
+         """
+        if not discard:
+            try:
+                connection.rollback()
+            except Exception:
+                discard = True
+        with self._condition:
+            if not discard and not self._closed:
+                self._idle.append(connection)
+                self._condition.notify()
+                return
+        self._discard(connection)
+
+    def close_all(self):
+        """
+            Close the idle connections; the borrowed ones are closed when returned
+         """
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            self._discard(connection)
+
+    def _open(self, *args):
+        try:
+            connection = self.connect(*args)
+        except Exception:
+            self._release_slot()
+            raise
+        if connection is None:
+            self._release_slot()
+        else:
+            with self._condition:
+                self._stats['created'] += 1
+        return connection
+
+    def _discard(self, connection, replaced=False, release=True):
+        try:
+            self.close(connection)
+        except Exception:
+            pass
+        with self._condition:
+            self._uses.pop(id(connection), None)
+            self._stats['replaced'] += replaced
+        if release:
+            self._release_slot()
+
+    def _release_slot(self):
+        with self._condition:
+            self._opened -= 1
+            self._condition.notify()
+
+
+class PooledConnection(object):
+    """
+        Borrowed connection, with the interface of the connection it wraps;
+        close_connection() returns it to the pool instead of closing it
+        :param pool: the ConnectionPool
+        :param connection: the borrowed connection
+     """
+
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+
+    def __getattr__(self, name):
+        connection = self.__dict__.get('_connection')
+        if connection is None:
+            raise AttributeError(f'{name}: connection already returned to the pool')
+        return getattr(connection, name)
+
+    def close_connection(self):
+        """
+            Return the connection to the pool
+         """
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            self._pool.give_back(connection)
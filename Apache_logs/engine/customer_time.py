@@ -0,0 +1,171 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import re
+
+import pandas as pd
+
+##################################################################################
+#   Customer-local time of the sessions: date and hour columns of apache_session
+#   generated from the UTC session times in an IANA timezone (daylight saving
+#   included), stored at load time and indexed for the hourly and daily groupings
+##################################################################################
+
+# Customer timezone: UTC+13 over the logged period (NZDT)
+DEFAULT_CUSTOMER_TIMEZONE = 'Pacific/Auckland'
+
+CUSTOMER_TIME_COLUMNS = ['session_local_date', 'session_local_hour', 'end_local_date']
+
+# The timezone is recorded as the comment of session_local_date
+CUSTOMER_TIMEZONE_COMMENT = 'customer timezone {timezone}'
+CUSTOMER_TIMEZONE_COMMENT_REGEX = re.compile(r'customer timezone (\S+)')
+
+# Indexes of the groupings by customer date and hour, and of the bookings by customer end date
+CUSTOMER_TIME_INDEXES = {
+    'idx_apache_session_local_start': '(session_local_date, session_local_hour, channel)',
+    'idx_apache_session_local_end': '(end_local_date, channel) WHERE last_step = 6',
+}
+
+
+def local_time_sql(column, timezone):
+    """
+        Customer-local time of a UTC timestamp column
+        :param column: column (or expression) of UTC timestamps without time zone
+        :param timezone: IANA timezone name
+        :return: SQL expression of a timestamp without time zone
+     """
+    return f"(({column} AT TIME ZONE 'UTC') AT TIME ZONE '{timezone}')"
+
+
+def customer_time_columns_sql(timezone):
+    """
+        Definitions of the customer time columns, generated from session_start_time and session_end_time
+        :param timezone: IANA timezone name
+        :return: dictionary of column definitions by column name
+     """
+    local_start = local_time_sql('session_start_time', timezone)
+    local_end = local_time_sql('session_end_time', timezone)
+    return {
+        'session_local_date': f'DATE GENERATED ALWAYS AS (({local_start})::date) STORED',
+        'session_local_hour': f'SMALLINT GENERATED ALWAYS AS (EXTRACT(HOUR FROM {local_start})) STORED',
+        'end_local_date': f'DATE GENERATED ALWAYS AS (({local_end})::date) STORED',
+    }
+
+
+def check_timezone(cursor, timezone):
+    """
+        Verify a timezone name against the timezones known to postgres
+        :param cursor: postgres cursor
+        :param timezone: IANA timezone name, e.g. Pacific/Auckland
+        :return: the timezone
+     """
+    cursor.execute('SELECT 1 FROM pg_timezone_names WHERE name = %s', (timezone,))
+    if cursor.fetchone() is None:
+        raise ValueError(f'Unknown timezone: {timezone}, expected an IANA name such as {DEFAULT_CUSTOMER_TIMEZONE}')
+    return timezone
+
+
+def customer_timezone(cursor, table='apache_session'):
+    """
+        Timezone of the customer time columns of the apache_session table
+        :param cursor: postgres cursor
+        :param table: name of the table
+        :return: IANA timezone name, None if the table has no customer time columns (or does not exist)
+     """
+    cursor.execute("SELECT col_description(a.attrelid, a.attnum) FROM pg_attribute a "
+                   "WHERE a.attrelid = to_regclass(%s) AND a.attname = %s AND NOT a.attisdropped",
+                   (table, CUSTOMER_TIME_COLUMNS[0]))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    match = CUSTOMER_TIMEZONE_COMMENT_REGEX.match(row[0] or '')
+    if match is None:
+        raise ValueError(f'The table {table} has customer time columns, but their timezone is unknown '
+                         f'(expected the comment "{CUSTOMER_TIMEZONE_COMMENT}")')
+    return match.group(1)
+
+
+def add_customer_time_columns(cursor, timezone, table='apache_session', log=None):
+    """
+        Add the customer time columns and their indexes to the apache_session table, or regenerate them
+        in a new timezone; the existing rows are computed once, here. The caller commits
+        :param cursor: postgres cursor
+        :param timezone: IANA timezone name
+        :param table: name of the table
+        :param log: optional logger (e.g. context.log)
+        :return: True if the columns were added or regenerated
+     """
+    timezone = check_timezone(cursor, timezone)
+    current = customer_timezone(cursor, table)
+    if current == timezone:
+        return False
+
+    if current is not None:
+        # The indexes are dropped with the columns
+        cursor.execute(f'ALTER TABLE {table} ' +
+                       ', '.join(f'DROP COLUMN {column}' for column in CUSTOMER_TIME_COLUMNS))
+    cursor.execute(f'ALTER TABLE {table} ' +
+                   ', '.join(f'ADD COLUMN {column} {definition}'
+                             for column, definition in customer_time_columns_sql(timezone).items()))
+    cursor.execute(f"COMMENT ON COLUMN {table}.{CUSTOMER_TIME_COLUMNS[0]} IS "
+                   f"'{CUSTOMER_TIMEZONE_COMMENT.format(timezone=timezone)}'")
+    for name, definition in CUSTOMER_TIME_INDEXES.items():
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} {definition}')
+
+    if log is not None:
+        log.info(f'Customer time columns of {table} in {timezone}' +
+                 (f', previously {current}' if current is not None else ''))
+    return True
+
+
+def local_times(times, timezone):
+    """
+        Customer-local times of UTC session times, as generated in postgres
+        :param times: Series of UTC timestamps, without time zone (or with, see postgres_load)
+        :param timezone: IANA timezone name
+        :return: Series of local timestamps without time zone
+     """
+    if getattr(times.dt, 'tz', None) is None:
+        times = times.dt.tz_localize('UTC')
+    return times.dt.tz_convert(timezone).dt.tz_localize(None)
+
+
+def local_timestamp(timestamp, timezone):
+    """
+        Customer-local time of a UTC timestamp
+        :param timestamp: Timestamp without time zone, UTC
+        :param timezone: IANA timezone name
+        :return: local Timestamp without time zone
+     """
+    return pd.Timestamp(timestamp).tz_localize('UTC').tz_convert(timezone).tz_localize(None)
+
+
+def utc_timestamp(timestamp, timezone):
+    """
+        UTC time of a customer-local timestamp
+        A local time repeated when daylight saving time ends is taken at its first occurrence, and a local time
+        skipped when it starts at the end of the gap
+        :param timestamp: local Timestamp without time zone
+        :param timezone: IANA timezone name
+        :return: Timestamp without time zone, UTC
+     """
+    return pd.Timestamp(timestamp).tz_localize(timezone, ambiguous=True, nonexistent='shift_forward') \
+        .tz_convert('UTC').tz_localize(None)
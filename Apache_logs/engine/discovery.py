@@ -0,0 +1,138 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import re
+from datetime import date
+from os import listdir
+from os.path import isfile, join
+
+from .compressed import accept_compressed, file_compression, uncompressed_name
+
+##################################################################################
+#   Discovery of the apache csv files to load
+##################################################################################
+
+# Expected format for the apache file names
+APACHE_FILENAME_PATTERN = r'apache_access-p-pal-\d{4}.\d{2}.\d{2}.csv'
+
+# Date of the logs in the file name: YYYY.MM.DD
+FILENAME_DATE_REGEX = re.compile(r'(\d{4})\D(\d{2})\D(\d{2})')
+
+
+def apache_file_date(filename):
+    """
+        Extract the date from the csv file name, as used in the Unknown_<date> session IDs
+        :param filename: name of the csv file
+        :return: the date part of the file name
+     """
+    if filename is not None:
+        return filename[20:31]
+    else:
+        return 'na'
+
+
+def filename_log_date(filename):
+    """
+        Parse the date of the logs from the csv file name
+        :param filename: name of the csv file
+        :return: datetime.date, None if the name does not contain a date
+     """
+    match = FILENAME_DATE_REGEX.search(filename)
+    if match is None:
+        return None
+    try:
+        return date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+    except ValueError:
+        return None
+
+
+def discover_apache_files(file_path, filename_pattern=APACHE_FILENAME_PATTERN, loaded_files=(),
+                          date_from=None, date_to=None):
+    """
+        List the apache csv files of a directory which are not loaded yet, oldest first
+        The .gz and .zst variants of the matching files are accepted: a file is named (and tracked)
+        without its compression suffix, so a log compressed after its load is not loaded again.
+        If both variants of a file are present, the uncompressed one is read
+        :param file_path: path to the folder containing the apache csv files
+        :param filename_pattern: the expected format for the apache file names
+        :param loaded_files: names of the files already loaded (apache_tracking.loaded_file)
+        :param date_from: if set, ignore the files of logs before this date (datetime.date)
+        :param date_to: if set, ignore the files of logs after this date (datetime.date), inclusive
+        :return: list of dictionaries with the name, path, log_date and file_date of each file
+     """
+    regex = re.compile(accept_compressed(filename_pattern))
+    loaded_files = set(loaded_files)
+
+    pending = {}
+    for filename in listdir(file_path):
+        name = uncompressed_name(filename)
+        if name in loaded_files or not regex.search(filename):
+            continue
+        if name in pending and file_compression(filename) is not None:
+            continue
+        filepath = join(file_path, filename)
+        if not isfile(filepath):
+            continue
+        log_date = filename_log_date(filename)
+        if log_date is None:
+            continue
+        if date_from is not None and log_date < date_from:
+            continue
+        if date_to is not None and log_date > date_to:
+            continue
+        pending[name] = {'name': name, 'path': filepath,
+                         'log_date': log_date, 'file_date': apache_file_date(filename)}
+
+    return sorted(pending.values(), key=lambda f: (f['log_date'], f['name']))
+
+
+def fetch_loaded_files(cursor, file_names=None):
+    """
+        Fetch the names of the loaded files from the apache_tracking table in one query
+        :param cursor: postgres cursor
+        :param file_names: if set, only look up these file names
+        :return: set of loaded file names
+     """
+    if file_names is None:
+        cursor.execute('SELECT loaded_file FROM apache_tracking')
+    else:
+        cursor.execute('SELECT loaded_file FROM apache_tracking WHERE loaded_file = ANY(%s)',
+                       (list(file_names),))
+    return {row[0] for row in cursor.fetchall()}
+
+
+def find_pending_files(cursor, file_path, filename_pattern=APACHE_FILENAME_PATTERN, date_from=None, date_to=None):
+    """
+        List the apache csv files of a directory which are not loaded yet, oldest first,
+        with a single apache_tracking lookup for all the candidate files
+        :param cursor: postgres cursor
+        :param file_path: path to the folder containing the apache csv files
+        :param filename_pattern: the expected format for the apache file names
+        :param date_from: if set, ignore the files of logs before this date (datetime.date)
+        :param date_to: if set, ignore the files of logs after this date (datetime.date), inclusive
+        :return: list of dictionaries with the name, path, log_date and file_date of each file
+     """
+    candidates = discover_apache_files(file_path, filename_pattern, date_from=date_from, date_to=date_to)
+    if len(candidates) == 0:
+        return candidates
+
+    loaded_files = fetch_loaded_files(cursor, [f['name'] for f in candidates])
+    return [f for f in candidates if f['name'] not in loaded_files]
@@ -0,0 +1,282 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import plotly.graph_objs as go
+import plotly.express as px
+from plotly.subplots import make_subplots
+import pycountry
+
+from .analysis import bookings_only
+
+##################################################################################
+#   Figures of the analysis graphs, built from the frames of analysis_frames
+#   Each builder returns a list of (figure name, figure), so the figures can be
+#   shown by the graph solids or written to a report by separate processes
+##################################################################################
+
+
+def _log_frame(log, df):
+    if log is not None:
+        log.info(f' {df} ')
+
+
+def _window_days(frames):
+    # Days of the analysis window, the divisor of the daily averages (1 if there is no data)
+    return frames['window']['days'] or 1
+
+
+###################################################
+# Sessions per hour - bar chart with heat color
+####################################################
+def avg_sessions_by_hour_figures(frames, log=None):
+    """
+        Average number of sessions by hour of the day
+        :param frames: dictionary of DataFrames returned by analysis_frames
+        :param log: optional logger (e.g. context.log)
+        :return: list of (figure name, figure)
+     """
+    # session_hour is in the customer timezone (session_local_hour)
+    df = frames['by_hour']
+    df = df.assign(session_time=df['session_hour'],
+                   avg_number_of_sessions=(df['sessions'] / _window_days(frames)).round(1))
+
+    fig = px.bar(df, x='session_time', y='avg_number_of_sessions',
+                 labels={'session_time': 'Time of day (in customer timezone)',
+                         'avg_number_of_sessions': 'Average number of sessions'},
+                 color='avg_number_of_sessions', title='Sessions by hour')
+    return [('graph1_avg_sessions_by_hour', fig)]
+
+
+###################################################
+# Bookings per hour - bar chart with heat color
+####################################################
+def avg_bookings_by_hour_figures(frames, log=None):
+    """
+        Average number of bookings by hour of the day
+        :param frames: dictionary of DataFrames returned by analysis_frames
+        :param log: optional logger (e.g. context.log)
+        :return: list of (figure name, figure)
+     """
+    # session_hour is in the customer timezone (session_local_hour)
+    df = bookings_only(frames['by_hour'])
+    df = df.assign(session_time=df['session_hour'],
+                   avg_number_of_bookings=(df['bookings'] / _window_days(frames)).round(1))
+
+    fig = px.bar(df, x='session_time', y='avg_number_of_bookings',
+                 labels={'session_time': 'Time of day (in customer timezone)',
+                         'avg_number_of_bookings': 'Average number of Bookings'},
+                 color='avg_number_of_bookings', title='Bookings by hour')
+    return [('graph2_avg_bookings_by_hour', fig)]
+
+
+################################################################
+# Pie and Stacked pie  - Visitors and Bookings  (mobile vs CUI)
+################################################################
+def visitor_bookings_pie_figures(frames, log=None):
+    """
+        Visitors and bookings by channel, pie areas proportional to the counts
+        :param frames: dictionary of DataFrames returned by analysis_frames
+        :param log: optional logger (e.g. context.log)
+        :return: list of (figure name, figure)
+     """
+    # Visitors  - mobile vs CUI
+    df1 = frames['by_channel'].rename(columns={'sessions': 'visitors'})[['channel', 'visitors']]
+    _log_frame(log, df1)
+
+    # Bookings  - mobile vs CUI, may include Unknown
+    df2 = bookings_only(frames['by_channel'])[['channel', 'bookings']]
+    _log_frame(log, df2)
+
+    fig = make_subplots(1, 2, specs=[[{'type': 'domain'}, {'type': 'domain'}]],
+                        subplot_titles=['Visitors', 'Bookings'])
+    fig.add_trace(go.Pie(labels=df1['channel'], values=df1['visitors'], scalegroup='one',
+                         name="Visitors"), 1, 1)
+    fig.add_trace(go.Pie(labels=df2['channel'], values=df2['bookings'], scalegroup='one',
+                         name="Bookings"), 1, 2)
+
+    fig.update_layout(title_text='Visitors and bookings by channel')
+    return [('graph3_visitor_bookings_pie_charts', fig)]
+
+
+def cumulated_count(count_list):
+    """
+        The initial list shows the count of users who stopped at a particular step
+        For a funnel graph, we need the total number of users who reached each step, even if they
+        continue further, so we need to cumulate counts
+        :param count_list: initial list of count
+        :return: the list with the cumulated count
+     """
+    # The value of each step is the sum of all the elements after and including the element in the initial list
+    agg_count_list = []
+    total = 0
+    for count in reversed(count_list):
+        total += count
+        agg_count_list.append(total)
+    return agg_count_list[::-1]
+
+
+###################################################
+# Conversion rate - funnels
+###################################################
+def conversion_rate_funnel_figures(frames, log=None):
+    """
+        Conversion rate funnels of the CUI and Mobile channels, and stacked by channel
+        :param frames: dictionary of DataFrames returned by analysis_frames
+        :param log: optional logger (e.g. context.log)
+        :return: list of (figure name, figure)
+     """
+    # Frame used by the 3 graphs: the steps of booking_step reached last, by channel
+    df = frames['by_channel_step']
+    df = df[df['step_name'].notna()].rename(columns={'sessions': 'count_per_step'})
+    df = df[['channel', 'last_step', 'step_name', 'count_per_step']].reset_index(drop=True)
+    if log is not None:
+        log.info(f'Conversion rate - funnels - df')
+    _log_frame(log, df)
+
+    # CUI
+    CUI_df = df[['last_step', 'step_name', 'count_per_step']][df['channel'] == 'CUI']
+    y1 = CUI_df['step_name'].tolist()
+    x1 = cumulated_count(CUI_df['count_per_step'].tolist())
+
+    cui_fig = go.Figure(go.Funnel(y=y1, x=x1, textposition="inside", textinfo="value+percent initial",
+                                  marker={"color": ["blue"]}))
+    cui_fig.update_layout(title_text='Airline website - CUI channel - Conversion rate')
+
+    # Mobile
+    Mobile_df = df[['step_name', 'count_per_step']][df['channel'] == 'Mobile']
+    y2 = Mobile_df['step_name'].tolist()
+    x2 = cumulated_count(Mobile_df['count_per_step'].tolist())
+
+    mobile_fig = go.Figure(go.Funnel(y=y2, x=x2, marker={"color": ["red"]}, textposition="inside",
+                                     textinfo="value+percent initial"))
+    mobile_fig.update_layout(title_text='Airline website - Mobile channel - Conversion rate')
+
+    # Conversion rate by channel - stacked funnel
+    # As we do not have data for the Search step for Mobile, the stacked funnel starts from the 'Selection' step
+    x1 = x1[1:len(x1) - 1]
+    y1 = y1[1:len(y1) - 1]
+
+    stacked_fig = go.Figure()
+    stacked_fig.add_trace(go.Funnel(name='CUI channel', orientation="h", y=y1, x=x1, textposition="inside",
+                                    textinfo="value+percent initial"))
+    stacked_fig.add_trace(go.Funnel(name='Mobile channel', y=y1, x=x2, textinfo="value+percent initial"))
+    stacked_fig.update_layout(title={'text': 'Airline website - Conversion Rate by channel',
+                                     'font_size': 20,
+                                     'xanchor': 'center',
+                                     'yanchor': 'top'})
+
+    return [('graph4_conversion_rate_cui', cui_fig),
+            ('graph4_conversion_rate_mobile', mobile_fig),
+            ('graph4_conversion_rate_by_channel', stacked_fig)]
+
+
+###################################################
+# Successful bookings per hour, day or week - stacked bar chart
+####################################################
+def bookings_per_day_figures(frames, log=None):
+    """
+        Bookings per hour, day or week of the analysis window, by channel
+        :param frames: dictionary of DataFrames returned by analysis_frames
+        :param log: optional logger (e.g. context.log)
+        :return: list of (figure name, figure)
+     """
+    # bucket_start is in the customer timezone: the booking date, or the hour the session started
+    bucket = frames['window']['bucket']
+    df = bookings_only(frames['by_bucket_channel'])
+    df = df.assign(booking_date=df['bucket_start'], count=df['bookings'])
+
+    fig = px.bar(df, x='booking_date', y='count',
+                 labels={'booking_date': f'Booking {bucket}', 'count': 'Number of bookings'},
+                 hover_data=['channel'], color='channel', title=f'Bookings per {bucket}, by channel')
+    return [('graph5_bookings_per_day', fig)]
+
+
+###################################################
+# Average session duration -  bar chart
+####################################################
+def session_duration_figures(frames, log=None):
+    """
+        Average session duration by last page reached
+        :param frames: dictionary of DataFrames returned by analysis_frames
+        :param log: optional logger (e.g. context.log)
+        :return: list of (figure name, figure)
+     """
+    df = frames['by_step']
+    df = df[(df['last_step'] > 0) & df['step_name'].notna()].reset_index(drop=True)
+    df = df.assign(avg_session_in_mins=(df['session_duration_sum'] / 60 / df['sessions']).round())
+    df = df[['step_name', 'last_step', 'avg_session_in_mins']]
+    _log_frame(log, df)
+
+    fig = px.bar(df,
+                 x='step_name', y='avg_session_in_mins',
+                 labels={'step_name': 'Page reached', 'avg_session_in_mins': 'Average session duration in mins'},
+                 hover_data=['avg_session_in_mins'],
+                 title='Average session duration based on last page reached')
+    return [('graph6_session_duration', fig)]
+
+
+def alpha3(alpha2):
+    """
+        Conversion of an alpha2 country code into alpha3 using pycountry
+        :param alpha2: 2 letter country code
+        :return: 3 letter country code, 'NaN' if unknown
+     """
+    country = pycountry.countries.get(alpha_2=alpha2)
+    if country is not None:
+        return country.alpha_3
+    else:
+        return 'NaN'
+
+
+###################################################
+# Geographic graph
+####################################################
+def geo_figures(frames, log=None):
+    """
+        Location of the visitors
+        :param frames: dictionary of DataFrames returned by analysis_frames
+        :param log: optional logger (e.g. context.log)
+        :return: list of (figure name, figure)
+     """
+    df = frames['by_country']
+
+    if df.empty is False:
+        # Apply the function to the country_code (2 letter code) column for each row
+        df = df.assign(alpha3_country_code=df['country_code'].map(alpha3).values)
+    _log_frame(log, df)
+
+    fig = px.scatter_geo(df, locations="alpha3_country_code", color="country_name",
+                         hover_name="country_name", size="number_of_visitors",
+                         projection="natural earth", title='Location of Asian Airline website visitors',
+                         scope='asia')
+    return [('graph7_geo', fig)]
+
+
+# Figure builders by graph solid, in the order of the report
+GRAPH_FIGURES = {
+    'graph1_avg_sessions_by_hour': avg_sessions_by_hour_figures,
+    'graph2_avg_bookings_by_hour': avg_bookings_by_hour_figures,
+    'graph3_visitor_bookings_pie_charts': visitor_bookings_pie_figures,
+    'graph4_conversion_rate_funnels': conversion_rate_funnel_figures,
+    'graph5_bookings_per_day': bookings_per_day_figures,
+    'graph6_session_duration': session_duration_figures,
+    'graph7_geo': geo_figures,
+}
@@ -0,0 +1,93 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import pandas as pd
+
+##################################################################################
+#   Prepare the aggregated sessions for the apache_session table
+##################################################################################
+
+# Columns of the apache_session table loaded by the ETL, in table order
+SESSION_COLUMNS = [
+    'ip_address',
+    'session_id',
+    'channel',
+    'session_start_time',
+    'session_end_time',
+    'session_duration',
+    'first_step',
+    'last_step',
+    'num_pages_accessed',
+    'continent_code',
+    'country_code',
+    'country_name',
+    'city_name',
+    'latitude',
+    'longitude',
+    'timezone']
+
+# Decimals of the geoip coordinates, float32 keeps them exactly (up to 180.0000)
+COORDINATE_DECIMALS = 4
+
+
+def add_session_duration(agg_df):
+    """
+        Add the session_duration column (in seconds) to the sessions
+        :param agg_df: DataFrame aggregated by session
+        :return: the DataFrame with the session_duration column
+     """
+    # Whole seconds: Timedelta.seconds would wrap the sessions longer than one day
+    # A session without any timestamp has no duration (nullable Int64)
+    duration = (agg_df['session_end_time'] - agg_df['session_start_time']) // pd.Timedelta(seconds=1)
+    return agg_df.assign(session_duration=duration.astype('Int64').values)
+
+
+def final_session_frame(agg_df):
+    """
+        Re-organise the sessions into the apache_session column order
+        The sessions without IP address or without any timestamp are dropped
+        :param agg_df: DataFrame aggregated by session, with the session_duration column
+        :return: DataFrame with the SESSION_COLUMNS columns
+     """
+    # First step, eliminate rows without an IP address as they cannot be used
+    agg_df = agg_df[agg_df['ip_address'] != 'NaN']
+
+    # Nor the sessions whose entries all lack a timestamp: session_start_time is NOT NULL in apache_session
+    agg_df = agg_df[agg_df['session_start_time'].notna()]
+
+    # If session_id is Unknown, we assume by default that all Unknown session Ids for a day
+    # are for the same IP address and correspond to the same session
+    # With the idle_timeout_seconds option, the Unknown entries are grouped by IP address, user agent
+    # and time instead (see sessions.sessionize_by_inactivity)
+
+    final_df = agg_df.reindex(columns=SESSION_COLUMNS)
+
+    # The coordinates are stored as text: go back to float64 rounded to the COORDINATE_DECIMALS of the
+    # geoip database, so 14.6 is stored as 14.6 and not as the float32 value 14.600000381469727
+    for column in ['latitude', 'longitude']:
+        if final_df[column].dtype == 'float32':
+            final_df[column] = final_df[column].astype('float64').round(COORDINATE_DECIMALS)
+
+    # Every session left has a duration
+    if final_df['session_duration'].dtype == 'Int64':
+        final_df['session_duration'] = final_df['session_duration'].astype('int64')
+
+    return final_df
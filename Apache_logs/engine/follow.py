@@ -0,0 +1,209 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import io
+import os
+import time
+from datetime import datetime
+
+from .aggregate import aggregate_sessions_reduceat
+from .finalize import final_session_frame
+from .postgres_load import LOAD_METHOD_COPY, DEFAULT_BATCH_ROWS, upsert_sessions
+from .reader import read_apache_csv
+from .sessions import DEFAULT_SESSION_COOKIE, DEFAULT_SESSION_ID_LENGTH
+from .streaming import add_derived_columns
+
+##################################################################################
+#   Follow mode: load the lines appended to a growing apache csv file
+#   The byte offset after the last complete line read is checkpointed in the
+#   apache_follow_checkpoint table, each poll only reads the bytes appended since
+##################################################################################
+
+# Maximum number of bytes read by one poll, a poll catching up on a large file reads it in several steps
+DEFAULT_FOLLOW_MAX_BYTES = 256 * 1024 * 1024
+
+FETCH_CHECKPOINT_SQL = '''SELECT byte_offset, last_line, num_lines
+                          FROM apache_follow_checkpoint
+                          WHERE loaded_file = %s
+                          FOR UPDATE'''
+
+SAVE_CHECKPOINT_SQL = '''INSERT INTO apache_follow_checkpoint
+                             (loaded_file, byte_offset, last_line, num_lines, updated_date)
+                         VALUES (%s, %s, %s, %s, %s)
+                         ON CONFLICT (loaded_file) DO UPDATE SET
+                             byte_offset = EXCLUDED.byte_offset,
+                             last_line = EXCLUDED.last_line,
+                             num_lines = EXCLUDED.num_lines,
+                             updated_date = EXCLUDED.updated_date'''
+
+# The followed file is tracked when its first lines are loaded, so the daily load skips it
+INSERT_TRACKING_SQL = '''INSERT INTO apache_tracking (loaded_file, loaded_date)
+                         VALUES (%s, %s)
+                         ON CONFLICT (loaded_file) DO NOTHING'''
+
+
+def _records_end(data):
+    """
+        Offset after the last complete csv record of the data: the last end of line outside a quoted field
+        The data must start at a record boundary, a quoted field is open after an odd number of quotes
+        (the "" escaped quotes count twice)
+     """
+    end = data.rfind(b'\n') + 1
+    quotes = data.count(b'"', 0, end)
+    while end > 0 and quotes % 2:
+        # That end of line is inside a quoted field spanning lines: step back to the previous one
+        previous = data.rfind(b'\n', 0, end - 1) + 1
+        quotes -= data.count(b'"', previous, end)
+        end = previous
+    return end
+
+
+def read_appended_lines(file_path, byte_offset=0, last_line=None, max_bytes=DEFAULT_FOLLOW_MAX_BYTES):
+    """
+        Read the complete lines appended to a csv file after a byte offset
+        A partially written last record is left for the next read, the data ends at an end of line outside
+        any quoted field so a record with a quoted field spanning lines is read whole
+        A record longer than max_bytes is read whole, beyond max_bytes
+        :param file_path: path of the csv file
+        :param byte_offset: offset after the last line read, 0 to read the file from the start
+        :param last_line: the last line read (without the end of line), checked against the file
+                          to detect a file replaced or truncated since the last read
+        :param max_bytes: maximum number of bytes read, unless the first record is longer
+        :return: dictionary with the header line, the data (bytes of complete records), the new byte_offset,
+                 last_line and the number of lines read (a record with quoted ends of line counts several lines)
+     """
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+        if not header.endswith(b'\n'):
+            # The header itself is not written completely yet
+            return {'header': b'', 'data': b'', 'byte_offset': byte_offset, 'last_line': last_line, 'lines': 0}
+
+        if byte_offset < f.tell():
+            byte_offset = f.tell()
+        elif last_line is not None:
+            # The checkpointed line must still end at the checkpointed offset
+            expected = last_line.encode('utf-8') + b'\n'
+            f.seek(max(byte_offset - len(expected), 0))
+            if f.read(len(expected)) != expected:
+                raise ValueError(f'{file_path} does not match its checkpoint at byte {byte_offset}, '
+                                 f'the file was replaced or truncated')
+
+        f.seek(byte_offset)
+        data = f.read(max_bytes)
+        end = _records_end(data)
+        while end == 0:
+            # The first record is longer than max_bytes: keep reading until its end
+            more = f.read(max_bytes)
+            if not more:
+                break
+            data += more
+            end = _records_end(data)
+
+    if end == 0:
+        return {'header': header, 'data': b'', 'byte_offset': byte_offset, 'last_line': last_line, 'lines': 0}
+
+    data = data[:end]
+    return {'header': header,
+            'data': data,
+            'byte_offset': byte_offset + end,
+            'last_line': data[data.rfind(b'\n', 0, end - 1) + 1:end - 1].decode('utf-8'),
+            'lines': data.count(b'\n')}
+
+
+def fetch_checkpoint(cursor, file_name):
+    """
+        Fetch, and lock until the end of the transaction, the checkpoint of a followed file
+        :param cursor: postgres cursor
+        :param file_name: name of the csv file
+        :return: tuple (byte_offset, last_line, num_lines), None if the file is not followed yet
+     """
+    cursor.execute(FETCH_CHECKPOINT_SQL, (file_name,))
+    return cursor.fetchone()
+
+
+def fetch_checkpoints(cursor):
+    """
+        Fetch the checkpoints of all the followed files
+        :param cursor: postgres cursor
+        :return: dictionary file name -> byte_offset
+     """
+    cursor.execute('SELECT loaded_file, byte_offset FROM apache_follow_checkpoint')
+    return {file_name: byte_offset for file_name, byte_offset in cursor.fetchall()}
+
+
+def follow_apache_file(cursor, file_path, csv_file_date,
+                       cookie_name=DEFAULT_SESSION_COOKIE, id_length=DEFAULT_SESSION_ID_LENGTH,
+                       max_bytes=DEFAULT_FOLLOW_MAX_BYTES, load_method=LOAD_METHOD_COPY,
+                       batch_rows=DEFAULT_BATCH_ROWS, log=None):
+    """
+        Poll a followed csv file once: aggregate the lines appended since the checkpoint into sessions,
+        merge them into apache_session and move the checkpoint, the caller commits
+        The sessions are merged on (ip_address, session_id), the tables must be created with session_stitching
+        :param cursor: postgres cursor
+        :param file_path: path of the csv file
+        :param csv_file_date: date of the csv file being processed
+        :param cookie_name: name of the cookie holding the session ID
+        :param id_length: number of word characters in the session ID
+        :param max_bytes: maximum number of bytes read by the poll
+        :param load_method: LOAD_METHOD_COPY or LOAD_METHOD_VALUES, used to load the staging table
+        :param batch_rows: maximum number of rows per batch
+        :param log: optional logger (e.g. context.log)
+        :return: dictionary with the file name, status ('loaded', 'unchanged' or 'followed'),
+                 lines, sessions, byte_offset and seconds
+     """
+    start = time.perf_counter()
+    file_name = os.path.basename(file_path)
+    result = {'name': file_name, 'status': 'unchanged', 'lines': 0, 'sessions': 0, 'byte_offset': 0, 'seconds': 0}
+
+    checkpoint = fetch_checkpoint(cursor, file_name)
+    if checkpoint is None:
+        # First poll of the file: it must not be loaded already by the daily load
+        cursor.execute(INSERT_TRACKING_SQL, (file_name, datetime.now()))
+        if cursor.rowcount == 0:
+            result['status'] = 'loaded'
+            return result
+        byte_offset, last_line, num_lines = 0, None, 0
+    else:
+        byte_offset, last_line, num_lines = checkpoint
+
+    # Only the bytes appended since the checkpoint are read
+    appended = read_appended_lines(file_path, byte_offset, last_line, max_bytes)
+    result['byte_offset'] = appended['byte_offset']
+
+    if appended['lines'] > 0:
+        apache_df = read_apache_csv(io.BytesIO(appended['header'] + appended['data']))
+        apache_df = add_derived_columns(apache_df, csv_file_date, cookie_name, id_length)
+        final_df = final_session_frame(aggregate_sessions_reduceat(apache_df))
+        upsert_sessions(cursor, final_df, method=load_method, batch_rows=batch_rows, log=log)
+
+        result['status'] = 'followed'
+        result['lines'] = appended['lines']
+        result['sessions'] = len(final_df)
+
+    if appended['lines'] > 0 or checkpoint is None:
+        cursor.execute(SAVE_CHECKPOINT_SQL, (file_name, appended['byte_offset'], appended['last_line'],
+                                             num_lines + appended['lines'], datetime.now()))
+
+    result['seconds'] = time.perf_counter() - start
+    if log is not None:
+        log.info(f'{file_name}: {result["lines"]} new lines, {result["sessions"]} sessions merged, '
+                 f'checkpoint at byte {result["byte_offset"]} ({result["seconds"]:.2f}s)')
+    return result
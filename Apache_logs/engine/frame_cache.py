@@ -0,0 +1,257 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+##################################################################################
+#   Content-addressed cache of the parsed apache csv frames
+#   The parsed, typed frame of each csv file is stored as a Feather (Arrow IPC) file
+#   which is memory-mapped on the next runs, the csv is not parsed again
+#   Only the fixed-width columns (timestamps, numbers, category codes) stay in the mapped
+#   pages: the object (string) columns are rebuilt on every hit. They are stored
+#   dictionary-encoded, so a hit builds the distinct strings then takes them by code,
+#   instead of one Python string per log entry from the Arrow buffers
+##################################################################################
+
+# Environment variable overriding the default cache directory
+FRAME_CACHE_DIR_ENV = 'APACHE_FRAME_CACHE_DIR'
+DEFAULT_FRAME_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'apache_logs', 'frames')
+
+# Disk budget of the cache, the least recently used frames are evicted above it
+DEFAULT_FRAME_CACHE_MAX_BYTES = 10 * 1024 ** 3
+
+FRAME_CACHE_SUFFIX = '.feather'
+
+# Schema metadata listing the object columns stored as dictionaries
+STRING_COLUMNS_KEY = b'apache_logs.string_columns'
+
+
+def frame_to_table(df):
+    """
+        Convert a DataFrame to an Arrow table, with the object columns dictionary-encoded
+        :param df: pandas DataFrame with a default index
+        :return: pyarrow Table, the encoded columns are listed in its schema metadata
+     """
+    # The object columns are recorded, to be decoded back by table_to_frame
+    string_columns = [column for column in df.columns if df[column].dtype == object]
+    df = df.astype({column: 'category' for column in string_columns})
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[STRING_COLUMNS_KEY] = json.dumps(string_columns).encode()
+    return table.replace_schema_metadata(metadata)
+
+
+def table_to_frame(table, decode_strings=True):
+    """
+        Convert an Arrow table written by frame_to_table back to a DataFrame
+        :param table: pyarrow Table
+        :param decode_strings: convert the encoded columns back to object, otherwise they stay categoricals
+                               (only the distinct strings are materialised)
+        :return: pandas DataFrame
+     """
+    df = table.to_pandas(split_blocks=True)
+    if decode_strings:
+        metadata = table.schema.metadata or {}
+        string_columns = [column for column in json.loads(metadata.get(STRING_COLUMNS_KEY, b'[]'))
+                          if column in df.columns]
+        # A categorical converted to object restores the NaN of the csv parser
+        for column in string_columns:
+            df[column] = df[column].astype(object)
+    return df
+
+
+def file_content_digest(file_path, block_size=1024 * 1024):
+    """
+        Hash the content of a file
+        :param file_path: path of the file
+        :param block_size: number of bytes read at a time
+        :return: hexadecimal digest
+     """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FrameCache:
+    """
+        Cache of parsed csv frames keyed by the csv path, size, modification time and content hash
+        :param cache_dir: directory of the cached frames, default: $APACHE_FRAME_CACHE_DIR or ~/.cache/apache_logs/frames
+        :param max_bytes: disk budget of the cache
+        :param version: version of the parsing, change it when the parsed frame changes (columns, types)
+     """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_FRAME_CACHE_MAX_BYTES, version='1'):
+        if cache_dir is None or cache_dir == '':
+            cache_dir = os.environ.get(FRAME_CACHE_DIR_ENV, DEFAULT_FRAME_CACHE_DIR)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.version = version
+
+    def key(self, file_path):
+        """
+            Cache key of a csv file
+            :param file_path: path of the csv file
+            :return: hexadecimal key
+         """
+        stat = os.stat(file_path)
+        parts = [self.version, os.path.abspath(file_path), str(stat.st_size), str(stat.st_mtime_ns),
+                 file_content_digest(file_path)]
+        return hashlib.blake2b('|'.join(parts).encode('utf-8'), digest_size=20).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + FRAME_CACHE_SUFFIX)
+
+    def get(self, key):
+        """
+            Memory-map a cached frame
+            :param key: cache key
+            :return: DataFrame, None on a cache miss
+         """
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            df = table_to_frame(feather.read_table(path, memory_map=True))
+        except Exception:
+            # Unreadable entry (e.g. interrupted write), drop it
+            os.remove(path)
+            return None
+
+        # Mark the entry as recently used
+        os.utime(path, None)
+        return df
+
+    def put(self, key, df):
+        """
+            Store a frame in the cache then evict the least recently used entries above the budget
+            :param key: cache key
+            :param df: DataFrame with a default index
+            :return: True if the frame was stored
+         """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        try:
+            # Uncompressed, so the frame can be memory-mapped
+            feather.write_feather(frame_to_table(df.reset_index(drop=True)), tmp_path, compression='uncompressed')
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        self.evict()
+        return True
+
+    def get_or_parse(self, file_path, parse, log=None):
+        """
+            Return the parsed frame of a csv file, parsing and caching it on a cache miss
+            :param file_path: path of the csv file
+            :param parse: function parsing the csv file into a DataFrame
+            :param log: optional logger (e.g. context.log)
+            :return: DataFrame
+         """
+        start = time.perf_counter()
+        key = self.key(file_path)
+        df = self.get(key)
+        if df is not None:
+            if log is not None:
+                log.info(f'Frame cache hit for {file_path} ({time.perf_counter() - start:.2f}s)')
+            return df
+
+        df = parse(file_path)
+        stored = self.put(key, df)
+        if log is not None:
+            log.info(f'Frame cache miss for {file_path}, parsed in {time.perf_counter() - start:.2f}s'
+                     + ('' if stored else ', the frame could not be cached'))
+        return df
+
+    def entries(self):
+        """
+            List the cached frames, least recently used first
+            :return: list of dictionaries with the key, path, size and last use time of each entry
+         """
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(FRAME_CACHE_SUFFIX):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            stat = os.stat(path)
+            entries.append({'key': name[:-len(FRAME_CACHE_SUFFIX)], 'path': path,
+                            'size': stat.st_size, 'last_used': stat.st_mtime})
+        entries.sort(key=lambda e: e['last_used'])
+        return entries
+
+    def evict(self, max_bytes=None):
+        """
+            Remove the least recently used frames until the cache fits in the budget
+            :param max_bytes: budget, default is the cache budget
+            :return: number of frames removed
+         """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(e['size'] for e in entries)
+        removed = 0
+        for entry in entries:
+            if total <= max_bytes:
+                break
+            os.remove(entry['path'])
+            total -= entry['size']
+            removed += 1
+        return removed
+
+    def purge(self):
+        """
+            Remove all the cached frames
+            :return: number of frames removed
+         """
+        return self.evict(max_bytes=0)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Inspect or purge the cache of parsed apache csv frames')
+    parser.add_argument('command', choices=['list', 'purge', 'evict'],
+                        help='list the entries, purge them all or evict down to --max-bytes')
+    parser.add_argument('--cache-dir', default=None, help='cache directory')
+    parser.add_argument('--max-bytes', type=int, default=DEFAULT_FRAME_CACHE_MAX_BYTES, help='disk budget')
+    args = parser.parse_args()
+
+    cache = FrameCache(args.cache_dir, args.max_bytes)
+    if args.command == 'list':
+        entries = cache.entries()
+        for entry in entries:
+            print(f'{entry["key"]}  {entry["size"]:>14,d}  {time.ctime(entry["last_used"])}')
+        print(f'{len(entries)} frames, {sum(e["size"] for e in entries):,d} bytes in {cache.cache_dir}')
+    elif args.command == 'purge':
+        print(f'Removed {cache.purge()} frames from {cache.cache_dir}')
+    else:
+        print(f'Removed {cache.evict()} frames from {cache.cache_dir}')
@@ -0,0 +1,153 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from .aggregate import aggregate_sessions_reduceat
+from .finalize import final_session_frame
+from .reader import read_apache_csv
+from .sessions import DEFAULT_SESSION_COOKIE, DEFAULT_SESSION_ID_LENGTH, extract_session_ids, \
+    sessionize_by_inactivity
+from .url_rules import classify_url_paths
+
+##################################################################################
+#   Fused ETL: parse -> derive -> aggregate -> finalize on one frame, in one call
+#   Only the columns used downstream are parsed and the derived columns are added
+#   in place, so no full-length intermediate frame is copied
+##################################################################################
+
+# Columns of the csv file used by the fused ETL
+# _id, referer, http_method and the response metrics are not used to build the sessions
+FUSED_CSV_COLUMNS = ["@timestamp", "url_path", "geoip.ip", "cookie",
+                     "geoip.city_name", "geoip.country_code2", "geoip.country_name",
+                     "geoip.continent_code", "geoip.latitude", "geoip.longitude", "geoip.timezone"]
+
+
+def fused_csv_columns(idle_timeout=None):
+    """
+        Columns of the csv file read by the fused ETL
+        :param idle_timeout: inactivity gap of the cookie-less sessions, which also needs the user agent
+        :return: list of column names
+     """
+    if idle_timeout:
+        return FUSED_CSV_COLUMNS + ["user_agent_string"]
+    return FUSED_CSV_COLUMNS
+
+
+def fused_session_frame(file_path, csv_file_date,
+                        cookie_name=DEFAULT_SESSION_COOKIE, id_length=DEFAULT_SESSION_ID_LENGTH, idle_timeout=None,
+                        stats=None):
+    """
+        Read an apache csv file and return its sessions, ready for the apache_session table
+        The result is identical to the csv_to_postgres_pipeline solids from load_apache_csv to create_final_df
+        :param file_path: path of the csv file
+        :param csv_file_date: date of the csv file being processed
+        :param cookie_name: name of the cookie holding the session ID
+        :param id_length: number of word characters in the session ID
+        :param idle_timeout: if set, inactivity gap (in seconds) splitting the cookie-less entries into sessions
+        :param stats: optional dictionary, updated with the decompression time and sizes of a compressed file
+        :return: tuple (DataFrame with the SESSION_COLUMNS columns, number of log entries read)
+     """
+    apache_df = read_apache_csv(file_path, columns=fused_csv_columns(idle_timeout), stats=stats)
+    rows = len(apache_df)
+
+    # Derive the session column, then drop the columns only used to derive it
+    session = extract_session_ids(apache_df['cookie'], csv_file_date, cookie_name, id_length)
+    if idle_timeout:
+        session = sessionize_by_inactivity(apache_df, session, csv_file_date, idle_timeout)
+        del apache_df['user_agent_string']
+    del apache_df['cookie']
+    apache_df['session'] = session.values
+    del session
+
+    # Same for the url classification
+    url_class_df = classify_url_paths(apache_df['url_path'])
+    del apache_df['url_path']
+    apache_df['channel'] = url_class_df['channel'].values
+    apache_df['accessed_step'] = url_class_df['accessed_step'].values
+    del url_class_df
+
+    # The aggregation also computes the session duration
+    agg_df = aggregate_sessions_reduceat(apache_df, with_duration=True)
+    del apache_df
+
+    return final_session_frame(agg_df), rows
+
+
+def _process_rss():
+    """ Resident memory of the process in bytes, None without psutil """
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+@contextmanager
+def measure_run(trace_memory=True):
+    """
+        Measure the wall time and the memory of a block
+            with measure_run() as run:
+                ...
+            run['seconds'], run['peak_bytes'], run['rss_delta_bytes']
+        With trace_memory peak_bytes is the highest memory traced by tracemalloc during the block
+        (the NumPy and pandas buffers are traced), but tracing slows down the Python object allocations
+        Otherwise rss_delta_bytes is the change of the resident memory of the process from the start
+        to the end of the block, which costs nothing but misses a peak freed within the block
+        A measure that is not available (rss_delta_bytes without psutil) is left to None
+        :param trace_memory: trace the allocations of the block
+        :return: dict filled with seconds, peak_bytes and rss_delta_bytes when the block exits
+     """
+    run = {'seconds': None, 'peak_bytes': None, 'rss_delta_bytes': None}
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    elif trace_memory and hasattr(tracemalloc, 'reset_peak'):
+        # Python 3.9+, before that the peak also covers what was traced before the block
+        tracemalloc.reset_peak()
+    start_rss = None if trace_memory else _process_rss()
+    start = time.perf_counter()
+    try:
+        yield run
+    finally:
+        run['seconds'] = time.perf_counter() - start
+        if trace_memory:
+            run['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+        elif start_rss is not None:
+            run['rss_delta_bytes'] = _process_rss() - start_rss
+
+
+def run_summary(run):
+    """
+        Describe a run measured by measure_run, e.g. 'in 1.23s, peak memory 116.5 MB'
+        :param run: dict filled by measure_run
+        :return: text of the available measures
+     """
+    summary = f'in {run["seconds"]:.2f}s'
+    if run['peak_bytes'] is not None:
+        summary += f', peak memory {run["peak_bytes"] / 1024 ** 2:.1f} MB'
+    if run['rss_delta_bytes'] is not None:
+        summary += f', resident memory {run["rss_delta_bytes"] / 1024 ** 2:+.1f} MB'
+    return summary
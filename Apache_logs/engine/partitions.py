@@ -0,0 +1,186 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import re
+from datetime import date, datetime
+
+import pandas as pd
+
+from .rollups import has_rollups, rollup_sessions_sql
+
+##################################################################################
+#   Range partitioning of the apache_session table on session_start_time
+#   One partition per day or per month, created by the loader as new dates arrive
+#   A query filtering session_start_time only scans the partitions of its window,
+#   and old sessions are retired by dropping their partitions
+##################################################################################
+
+# Partition granularities
+PARTITION_BY_DAY = 'day'
+PARTITION_BY_MONTH = 'month'
+PARTITION_GRANULARITIES = [PARTITION_BY_DAY, PARTITION_BY_MONTH]
+
+# The granularity is recorded in the comment of the partitioned table
+PARTITION_COMMENT = 'apache_session partitioned by {granularity}'
+PARTITION_COMMENT_REGEX = re.compile(r'apache_session partitioned by (\w+)')
+
+# Bounds of a partition, as returned by pg_get_expr(relpartbound)
+PARTITION_BOUND_REGEX = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def check_granularity(granularity):
+    """
+        Verify a partition granularity
+        :param granularity: PARTITION_BY_DAY or PARTITION_BY_MONTH
+        :return: the granularity
+     """
+    if granularity not in PARTITION_GRANULARITIES:
+        raise ValueError(f'Invalid partition granularity: {granularity}, expected one of {PARTITION_GRANULARITIES}')
+    return granularity
+
+
+def partition_bounds(day, granularity):
+    """
+        Bounds of the partition holding a date
+        :param day: datetime.date
+        :param granularity: PARTITION_BY_DAY or PARTITION_BY_MONTH
+        :return: tuple (first date, first date of the next partition)
+     """
+    if check_granularity(granularity) == PARTITION_BY_DAY:
+        start = pd.Timestamp(day)
+        return start.date(), (start + pd.Timedelta(days=1)).date()
+    start = pd.Timestamp(day).replace(day=1)
+    return start.date(), (start + pd.offsets.MonthBegin(1)).date()
+
+
+def partition_name(start, granularity, table='apache_session'):
+    """
+        Name of the partition starting at a date, e.g. apache_session_p20191125 or apache_session_p201911
+        :param start: first date of the partition
+        :param granularity: PARTITION_BY_DAY or PARTITION_BY_MONTH
+        :param table: name of the partitioned table
+        :return: partition name
+     """
+    if check_granularity(granularity) == PARTITION_BY_DAY:
+        return f'{table}_p{start:%Y%m%d}'
+    return f'{table}_p{start:%Y%m}'
+
+
+def session_partitioning(cursor, table='apache_session'):
+    """
+        Partition granularity of the apache_session table
+        :param cursor: postgres cursor
+        :param table: name of the table
+        :return: PARTITION_BY_DAY, PARTITION_BY_MONTH or None if the table is not partitioned (or does not exist)
+     """
+    cursor.execute("SELECT c.relkind, obj_description(c.oid, 'pg_class') FROM pg_class c "
+                   "WHERE c.oid = to_regclass(%s)", (table,))
+    row = cursor.fetchone()
+    if row is None or row[0] != 'p':
+        return None
+    match = PARTITION_COMMENT_REGEX.match(row[1] or '')
+    if match is None:
+        raise ValueError(f'The table {table} is partitioned, but its granularity is unknown '
+                         f'(expected the comment "{PARTITION_COMMENT}")')
+    return check_granularity(match.group(1))
+
+
+def list_session_partitions(cursor, table='apache_session'):
+    """
+        List the partitions of the apache_session table, oldest first
+        :param cursor: postgres cursor
+        :param table: name of the partitioned table
+        :return: list of tuples (partition name, first date, first date of the next partition)
+     """
+    cursor.execute("SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+                   "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s)", (table,))
+    partitions = []
+    for name, bound in cursor.fetchall():
+        match = PARTITION_BOUND_REGEX.search(bound or '')
+        if match is None:
+            # Not a range partition created by ensure_session_partitions (e.g. a default partition)
+            continue
+        partitions.append((name, pd.Timestamp(match.group(1)).date(), pd.Timestamp(match.group(2)).date()))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def ensure_session_partitions(cursor, start_times, granularity, table='apache_session', log=None):
+    """
+        Create the missing partitions for a set of session start times, the caller commits
+        :param cursor: postgres cursor
+        :param start_times: session_start_time values about to be loaded (pandas Series), NaT is ignored
+        :param granularity: PARTITION_BY_DAY or PARTITION_BY_MONTH
+        :param table: name of the partitioned table
+        :param log: optional logger (e.g. context.log)
+        :return: list of the partitions created
+     """
+    # A session without any timestamp (NaT) has no partition, it is not loaded (see final_session_frame)
+    start_times = pd.Series(start_times).dropna()
+    if len(start_times) == 0:
+        return []
+    if getattr(start_times.dt, 'tz', None) is not None:
+        # Stored as UTC without offset, see postgres_load
+        start_times = start_times.dt.tz_convert('UTC').dt.tz_localize(None)
+
+    days = pd.unique(start_times.dt.normalize())
+    bounds = sorted({partition_bounds(pd.Timestamp(day).date(), granularity) for day in days})
+    existing = {start for _, start, _ in list_session_partitions(cursor, table)}
+
+    created = []
+    for start, end in bounds:
+        if start in existing:
+            continue
+        name = partition_name(start, granularity, table)
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                       f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')")
+        created.append(name)
+        if log is not None:
+            log.info(f'Created the partition {name} [{start}, {end})')
+    return created
+
+
+def drop_session_partitions(cursor, before, table='apache_session', log=None):
+    """
+        Retire the sessions older than a date by dropping their partitions, the caller commits
+        Only whole partitions are dropped: a partition with sessions on or after the date is kept
+        The sessions of the dropped partitions are removed from the rollup table, if it exists
+        :param cursor: postgres cursor
+        :param before: datetime.date, the partitions ending on or before this date are dropped
+        :param table: name of the partitioned table
+        :param log: optional logger (e.g. context.log)
+        :return: list of the partitions dropped
+     """
+    if isinstance(before, datetime):
+        before = before.date()
+    if not isinstance(before, date):
+        raise ValueError(f'Invalid date: {before}')
+
+    rollups = has_rollups(cursor)
+    dropped = []
+    for name, start, end in list_session_partitions(cursor, table):
+        if end <= before:
+            if rollups:
+                rollup_sessions_sql(cursor, f'{name} a', sign=-1)
+            cursor.execute(f'DROP TABLE {name}')
+            dropped.append(name)
+            if log is not None:
+                log.info(f'Dropped the partition {name} [{start}, {end})')
+    return dropped
@@ -0,0 +1,261 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import io
+import time
+
+from psycopg2.extras import execute_values
+
+from .finalize import SESSION_COLUMNS
+from .partitions import ensure_session_partitions, session_partitioning
+from .rollups import has_rollups, add_rollups, rollup_sessions_sql
+
+##################################################################################
+#   Bulk load of the final sessions into the apache_session table
+##################################################################################
+
+# Load methods: COPY ... FROM STDIN (default) or INSERT ... VALUES with execute_values
+LOAD_METHOD_COPY = 'copy'
+LOAD_METHOD_VALUES = 'values'
+LOAD_METHODS = [LOAD_METHOD_COPY, LOAD_METHOD_VALUES]
+
+# Maximum number of rows sent in one COPY buffer or one execute_values call
+DEFAULT_BATCH_ROWS = 50000
+
+
+# Text stored for the missing values, by both load methods (the analysis queries filter on it)
+MISSING_VALUE = 'NaN'
+
+
+def _load_frame(final_df):
+    """
+        Prepare a frame for loading, so that both load methods store the same data:
+        the timestamps are written as UTC without offset, and the missing values of the text
+        columns (NaN or None) as MISSING_VALUE
+        :param final_df: batch of the DataFrame with the apache_session columns
+        :return: DataFrame ready to be written as csv or converted to tuples
+     """
+    final_df = final_df.copy()
+    for column in ['session_start_time', 'session_end_time']:
+        if column in final_df.columns and getattr(final_df[column].dt, 'tz', None) is not None:
+            final_df[column] = final_df[column].dt.tz_convert('UTC').dt.tz_localize(None)
+    for column in final_df.columns[final_df.dtypes == object]:
+        final_df[column] = final_df[column].where(final_df[column].notna(), MISSING_VALUE)
+    return final_df
+
+
+def copy_sessions(cursor, final_df, table='apache_session', columns=SESSION_COLUMNS, batch_rows=DEFAULT_BATCH_ROWS):
+    """
+        Stream a DataFrame into a table with COPY ... FROM STDIN, one in-memory csv buffer per batch
+        Missing values are written as NaN, as by insert_sessions_values
+        :param cursor: postgres cursor
+        :param final_df: DataFrame with the table columns
+        :param table: name of the table
+        :param columns: columns of the table, in the order of the DataFrame columns
+        :param batch_rows: maximum number of rows per COPY buffer
+        :return: number of rows copied
+     """
+    copy_sql = f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)'
+
+    rows = 0
+    for start in range(0, len(final_df), batch_rows):
+        buffer = io.StringIO()
+        _load_frame(final_df.iloc[start:start + batch_rows]).to_csv(buffer, header=False, index=False,
+                                                                    na_rep=MISSING_VALUE)
+        buffer.seek(0)
+        cursor.copy_expert(copy_sql, buffer)
+        rows += cursor.rowcount
+    return rows
+
+
+def insert_sessions_values(cursor, final_df, table='apache_session', columns=SESSION_COLUMNS,
+                           batch_rows=DEFAULT_BATCH_ROWS):
+    """
+        Insert a DataFrame into a table with INSERT ... VALUES, using execute_values
+        The rows are prepared as for copy_sessions, so both methods store the same data
+        :param cursor: postgres cursor
+        :param final_df: DataFrame with the table columns
+        :param table: name of the table
+        :param columns: columns of the table, in the order of the DataFrame columns
+        :param batch_rows: maximum number of rows converted to tuples at a time
+        :return: number of rows inserted
+     """
+    insert_query = f'INSERT INTO {table} ({", ".join(columns)}) VALUES %s'
+
+    rows = 0
+    for start in range(0, len(final_df), batch_rows):
+        tuples = [tuple(x) for x in _load_frame(final_df.iloc[start:start + batch_rows]).values]
+        execute_values(cursor, insert_query, tuples, page_size=1000)
+        rows += len(tuples)
+    return rows
+
+
+def prepare_partitions(cursor, final_df, log=None):
+    """
+        Create the partitions of a partitioned apache_session table missing for the sessions to load
+        :param cursor: postgres cursor
+        :param final_df: DataFrame with the SESSION_COLUMNS columns
+        :param log: optional logger (e.g. context.log)
+        :return: partition granularity, None if apache_session is not partitioned
+     """
+    granularity = session_partitioning(cursor)
+    if granularity is not None:
+        ensure_session_partitions(cursor, final_df['session_start_time'], granularity, log=log)
+    return granularity
+
+
+def load_sessions(cursor, final_df, method=LOAD_METHOD_COPY, batch_rows=DEFAULT_BATCH_ROWS, log=None):
+    """
+        Load the final sessions into the apache_session table, the caller commits
+        If apache_session is partitioned, the missing partitions are created first
+        The sessions are added to the rollup table, if it exists
+        :param cursor: postgres cursor
+        :param final_df: DataFrame with the SESSION_COLUMNS columns
+        :param method: LOAD_METHOD_COPY or LOAD_METHOD_VALUES
+        :param batch_rows: maximum number of rows per batch
+        :param log: optional logger (e.g. context.log)
+        :return: number of rows loaded
+     """
+    if method not in LOAD_METHODS:
+        raise ValueError(f'Invalid load method: {method}, expected one of {LOAD_METHODS}')
+
+    prepare_partitions(cursor, final_df, log=log)
+
+    start = time.perf_counter()
+    if method == LOAD_METHOD_COPY:
+        rows = copy_sessions(cursor, final_df, batch_rows=batch_rows)
+    else:
+        rows = insert_sessions_values(cursor, final_df, batch_rows=batch_rows)
+    if has_rollups(cursor):
+        add_rollups(cursor, final_df)
+    seconds = time.perf_counter() - start
+
+    if log is not None:
+        log.info(f'Loaded {rows} rows into apache_session with {method} in {seconds:.2f}s '
+                 f'({rows / seconds if seconds > 0 else 0:,.0f} rows/sec)')
+    return rows
+
+
+# Name of the unique index on (ip_address, session_id) required to stitch the sessions across days
+SESSION_KEY_INDEX = 'uk_apache_session_ip_session'
+
+# A partitioned apache_session has a (non unique) index on (ip_address, session_id) instead
+SESSION_KEY_PARTITIONED_INDEX = 'idx_apache_session_ip_session'
+
+# Merge the sessions of the staging table into apache_session
+# A session already loaded from a previous file (e.g. started before midnight) is widened:
+# earliest start, latest end, duration recomputed, min/max steps and summed page counts.
+# The channel and geographical columns of the first file are kept, a geographical column
+# missing ('NaN') in the first file is taken from the next one, as 'first' does within a file
+GEO_COLUMNS = ['continent_code', 'country_code', 'country_name', 'city_name', 'latitude', 'longitude', 'timezone']
+
+
+def _merge_assignments(old, new):
+    """ SET list merging the session {new} into the session {old} """
+    return ",\n".join([
+        f"        session_start_time = LEAST({old}.session_start_time, {new}.session_start_time)",
+        f"        session_end_time = GREATEST({old}.session_end_time, {new}.session_end_time)",
+        f"        session_duration = EXTRACT(EPOCH FROM (\n"
+        f"            GREATEST({old}.session_end_time, {new}.session_end_time)\n"
+        f"            - LEAST({old}.session_start_time, {new}.session_start_time)))::INT",
+        f"        first_step = LEAST({old}.first_step, {new}.first_step)",
+        f"        last_step = GREATEST({old}.last_step, {new}.last_step)",
+        f"        num_pages_accessed = {old}.num_pages_accessed + {new}.num_pages_accessed",
+    ] + [f"        {column} = CASE WHEN {old}.{column} = 'NaN' THEN {new}.{column} ELSE {old}.{column} END"
+         for column in GEO_COLUMNS]) + "\n"
+
+
+UPSERT_SESSIONS_SQL = """INSERT INTO apache_session ({columns})
+    SELECT {columns} FROM {stage_table}
+    ON CONFLICT (ip_address, session_id) DO UPDATE SET
+""" + _merge_assignments('apache_session', 'EXCLUDED')
+
+# A partitioned apache_session cannot have the unique (ip_address, session_id) index (a unique index
+# must include the partition key), so the sessions are merged with an UPDATE of the sessions already
+# loaded followed by an INSERT of the others, under a lock serializing the concurrent merges
+MERGE_PARTITIONED_SESSIONS_SQL = [
+    "LOCK TABLE apache_session IN SHARE ROW EXCLUSIVE MODE",
+    """UPDATE apache_session SET
+""" + _merge_assignments('apache_session', 's') + """    FROM {stage_table} s
+    WHERE apache_session.ip_address = s.ip_address AND apache_session.session_id = s.session_id""",
+    """INSERT INTO apache_session ({columns})
+    SELECT {columns} FROM {stage_table} s
+    WHERE NOT EXISTS (SELECT 1 FROM apache_session a
+                      WHERE a.ip_address = s.ip_address AND a.session_id = s.session_id)""",
+]
+
+def upsert_sessions(cursor, final_df, method=LOAD_METHOD_COPY, batch_rows=DEFAULT_BATCH_ROWS, log=None):
+    """
+        Load the final sessions into apache_session, merging them into the sessions already loaded
+        with the same (ip_address, session_id), the caller commits
+        The sessions are bulk loaded into a temporary staging table first, then merged with one
+        INSERT ... ON CONFLICT using the SESSION_KEY_INDEX unique index
+        If apache_session is partitioned, the missing partitions are created first and the sessions
+        are merged with MERGE_PARTITIONED_SESSIONS_SQL
+        The rollup table, if it exists, is updated: the merged sessions are removed from the rollup
+        before the merge and added back after it
+        :param cursor: postgres cursor
+        :param final_df: DataFrame with the SESSION_COLUMNS columns
+        :param method: LOAD_METHOD_COPY or LOAD_METHOD_VALUES, used to load the staging table
+        :param batch_rows: maximum number of rows per batch
+        :param log: optional logger (e.g. context.log)
+        :return: number of rows inserted or updated
+     """
+    if method not in LOAD_METHODS:
+        raise ValueError(f'Invalid load method: {method}, expected one of {LOAD_METHODS}')
+
+    granularity = prepare_partitions(cursor, final_df, log=log)
+
+    stage_table = 'apache_session_stage'
+    # Same column types as apache_session, without the id sequence and the constraints
+    cursor.execute(f'CREATE TEMP TABLE {stage_table} ON COMMIT DROP AS '
+                   f'SELECT {", ".join(SESSION_COLUMNS)} FROM apache_session WITH NO DATA')
+
+    start = time.perf_counter()
+    if method == LOAD_METHOD_COPY:
+        staged = copy_sessions(cursor, final_df, table=stage_table, batch_rows=batch_rows)
+    else:
+        staged = insert_sessions_values(cursor, final_df, table=stage_table, batch_rows=batch_rows)
+
+    # Sessions of apache_session with the (ip_address, session_id) of a staged session
+    merged_sessions = (f'apache_session a JOIN {stage_table} s '
+                       f'ON a.ip_address = s.ip_address AND a.session_id = s.session_id')
+    rollups = has_rollups(cursor)
+    if rollups:
+        rollup_sessions_sql(cursor, merged_sessions, sign=-1)
+
+    if granularity is None:
+        cursor.execute(UPSERT_SESSIONS_SQL.format(columns=', '.join(SESSION_COLUMNS), stage_table=stage_table))
+        rows = cursor.rowcount
+    else:
+        rows = 0
+        for merge_sql in MERGE_PARTITIONED_SESSIONS_SQL:
+            cursor.execute(merge_sql.format(columns=', '.join(SESSION_COLUMNS), stage_table=stage_table))
+            rows += max(cursor.rowcount, 0)
+
+    if rollups:
+        rollup_sessions_sql(cursor, merged_sessions, sign=1)
+    seconds = time.perf_counter() - start
+
+    if log is not None:
+        log.info(f'Merged {staged} sessions into apache_session with {method} in {seconds:.2f}s '
+                 f'({staged / seconds if seconds > 0 else 0:,.0f} rows/sec)')
+    return rows
@@ -0,0 +1,126 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import hashlib
+import os
+import re
+
+import pandas as pd
+
+from .customer_time import customer_timezone
+from .frame_cache import FrameCache
+from .partitions import list_session_partitions
+
+##################################################################################
+#   Cache of the analysis query results, keyed by the normalized SQL and the data
+#   watermark: any new load (or retired partition) moves the watermark, so the cached
+#   results of older data are never read again (and are evicted as least recently used)
+#   The results are Feather files, in a cache directory of their own
+##################################################################################
+
+# Environment variable overriding the default cache directory
+QUERY_CACHE_DIR_ENV = 'APACHE_QUERY_CACHE_DIR'
+DEFAULT_QUERY_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'apache_logs', 'queries')
+
+# Disk budget of the query cache
+DEFAULT_QUERY_CACHE_MAX_BYTES = 256 * 1024 ** 2
+
+# Last load of a file (apache_tracking), number of files loaded, and last poll of follow mode
+TRACKING_WATERMARK_SQL = 'SELECT MAX(loaded_date), COUNT(*) FROM apache_tracking'
+FOLLOW_WATERMARK_SQL = 'SELECT MAX(updated_date) FROM apache_follow_checkpoint'
+
+
+def normalize_sql(sql):
+    """
+        Normalize a query for the cache key: whitespace collapsed, no trailing semicolon
+        :param sql: the query
+        :return: normalized query
+     """
+    return re.sub(r'\s+', ' ', sql).strip().rstrip(';').strip()
+
+
+def data_watermark(cursor):
+    """
+        Watermark of the loaded data: the latest load of apache_tracking, with the number of loaded
+        files and the latest follow mode poll, which update apache_session without a new tracking row,
+        and the customer timezone, which regenerates the customer time columns and the rollup
+        The partitions of apache_session are part of it: retiring the old sessions drops partitions
+        (in the transaction removing them from the rollup), without any new load
+        :param cursor: postgres cursor
+        :return: watermark string
+     """
+    cursor.execute(TRACKING_WATERMARK_SQL)
+    loaded_date, loaded_files = cursor.fetchone()
+    parts = [str(loaded_date), str(loaded_files)]
+
+    cursor.execute("SELECT to_regclass('apache_follow_checkpoint') IS NOT NULL")
+    if cursor.fetchone()[0]:
+        cursor.execute(FOLLOW_WATERMARK_SQL)
+        parts.append(str(cursor.fetchone()[0]))
+    parts.append(str(customer_timezone(cursor)))
+    parts.append(','.join(name for name, _, _ in list_session_partitions(cursor)))
+    return '|'.join(parts)
+
+
+class QueryCache(FrameCache):
+    """
+        Cache of query results keyed by the normalized SQL and the data watermark
+        :param cache_dir: directory of the cached results, default: $APACHE_QUERY_CACHE_DIR or
+                          ~/.cache/apache_logs/queries
+        :param max_bytes: disk budget of the cache
+        :param version: version of the results, change it when the frames built from the queries change
+     """
+
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_QUERY_CACHE_MAX_BYTES, version='1'):
+        if cache_dir is None or cache_dir == '':
+            cache_dir = os.environ.get(QUERY_CACHE_DIR_ENV, DEFAULT_QUERY_CACHE_DIR)
+        super().__init__(cache_dir, max_bytes, version)
+
+    def query_key(self, sql, watermark):
+        """
+            Cache key of a query
+            :param sql: the query
+            :param watermark: data watermark, see data_watermark
+            :return: hexadecimal key
+         """
+        parts = [self.version, normalize_sql(sql), watermark]
+        return hashlib.blake2b('|'.join(parts).encode('utf-8'), digest_size=20).hexdigest()
+
+    def read_sql(self, sql, connection, watermark, stats=None):
+        """
+            Return the result of a query, from the cache or from postgres on a cache miss
+            :param sql: the query
+            :param connection: postgres connection, not used on a cache hit
+            :param watermark: data watermark, see data_watermark
+            :param stats: optional dictionary, updated with the number of hits and misses
+            :return: DataFrame
+         """
+        key = self.query_key(sql, watermark)
+        df = self.get(key)
+        hit = df is not None
+        if not hit:
+            df = pd.read_sql(sql, connection)
+            self.put(key, df)
+
+        if stats is not None:
+            stats['hits'] = stats.get('hits', 0) + int(hit)
+            stats['misses'] = stats.get('misses', 0) + int(not hit)
+        return df
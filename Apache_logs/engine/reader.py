@@ -0,0 +1,141 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import os
+
+import pandas as pd
+
+from .compressed import open_apache_file
+
+##################################################################################
+#   Read the apache logs csv files
+##################################################################################
+
+#  A subset of the column from the source file are loaded
+# The following columns are in the source file but will not be loaded:
+# customer, env
+# These must be in the csv , they prove that the data is from the correct system (production)
+# and for the correct customer (pal)
+APACHE_CSV_COLUMNS = ["@timestamp", "_id", "url_path", "referer", "geoip.ip", "cookie",
+                      "user_agent_string", "geoip.city_name", "geoip.country_code2",
+                      "geoip.country_name", "geoip.continent_code", "geoip.latitude",
+                      "geoip.longitude", "geoip.timezone", "http_method", "response_code",
+                      "response_size_bytes", "response_time_microseconds"]
+
+
+# Explicit types of the loaded columns
+# Low-cardinality strings (geo location, http method) are categoricals, coordinates float32 and the
+# response metrics narrow (nullable) integers. The other strings (_id, url_path, geoip.ip, cookie, referer,
+# user_agent_string) have too many distinct values to gain from a categorical, they stay objects
+APACHE_CSV_DTYPES = {
+    "geoip.city_name": "category",
+    "geoip.country_code2": "category",
+    "geoip.country_name": "category",
+    "geoip.continent_code": "category",
+    "geoip.timezone": "category",
+    "http_method": "category",
+    "geoip.latitude": "float32",
+    "geoip.longitude": "float32",
+    "response_code": "Int16",
+    "response_size_bytes": "UInt32",
+    "response_time_microseconds": "UInt32",
+}
+
+# Format of @timestamp in the csv export, e.g. 2019-11-25T00:00:01.000Z
+APACHE_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+# Version of the parsed frame, part of the frame cache key: change it when the schema changes
+APACHE_SCHEMA_VERSION = '3'
+
+
+def parse_timestamp(timestamp):
+    """
+        Parse the @timestamp column (UTC) with the explicit export format,
+        falling back to format inference if a file uses another format
+        :param timestamp: pandas Series of strings
+        :return: pandas Series of UTC datetimes
+     """
+    try:
+        return pd.to_datetime(timestamp, format=APACHE_TIMESTAMP_FORMAT, utc=True)
+    except (ValueError, TypeError):
+        return pd.to_datetime(timestamp, utc=True)
+
+
+def _typed(df):
+    df['@timestamp'] = parse_timestamp(df['@timestamp'])
+    return df
+
+
+def _typed_chunks(reader):
+    for chunk in reader:
+        yield _typed(chunk)
+
+
+def _read_csv(source, chunksize, columns):
+    return pd.read_csv(source,
+                       sep=',',
+                       usecols=columns,
+                       dtype={column: dtype for column, dtype in APACHE_CSV_DTYPES.items() if column in columns},
+                       chunksize=chunksize)
+
+
+def _read_chunks(file_path, chunksize, columns, stats):
+    # The (decompressed) file stays open while the chunks are consumed
+    with open_apache_file(file_path, stats) as source:
+        yield from _typed_chunks(_read_csv(source, chunksize, columns))
+
+
+def read_apache_csv(file_path, chunksize=None, columns=None, stats=None):
+    """
+        Read an apache logs csv file into a pandas DataFrame with the APACHE_CSV_DTYPES schema
+        A .csv.gz or .csv.zst file is decompressed as a stream into the parser
+        :param file_path: path of the csv file, or a binary stream
+        :param chunksize: if set, return an iterator of DataFrames of at most chunksize rows
+        :param columns: subset of APACHE_CSV_COLUMNS to read, default: all of them
+        :param stats: optional dictionary, updated with the decompression time and sizes of a compressed file
+        :return: DataFrame, or iterator of DataFrames
+     """
+    columns = APACHE_CSV_COLUMNS if columns is None else columns
+    if not isinstance(file_path, (str, os.PathLike)):
+        reader = _read_csv(file_path, chunksize, columns)
+        return _typed(reader) if chunksize is None else _typed_chunks(reader)
+    if chunksize is not None:
+        return _read_chunks(file_path, chunksize, columns, stats)
+    with open_apache_file(file_path, stats) as source:
+        return _typed(_read_csv(source, chunksize, columns))
+
+
+def frame_memory_report(df):
+    """
+        Describe the memory used by a DataFrame, and the resident memory of the process
+        :param df: pandas DataFrame
+        :return: list of report lines
+     """
+    usage = df.memory_usage(index=True, deep=True)
+    lines = [f'{column}: {size / 1024 ** 2:.1f} MB ({df[column].dtype if column in df.columns else "index"})'
+             for column, size in usage.items()]
+    lines.append(f'Total: {usage.sum() / 1024 ** 2:.1f} MB for {len(df)} records')
+    try:
+        import psutil
+        lines.append(f'Process RSS: {psutil.Process().memory_info().rss / 1024 ** 2:.1f} MB')
+    except ImportError:
+        pass
+    return lines
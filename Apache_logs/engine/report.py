@@ -0,0 +1,154 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import html
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from plotly.offline import get_plotlyjs
+
+from .figures import GRAPH_FIGURES
+
+##################################################################################
+#   Headless report: the figures of the graphs are built in a process pool and
+#   written as static html (and json) files, which share a single plotly.js file,
+#   with an index page listing the graphs, their build time and size
+##################################################################################
+
+PLOTLY_JS_FILE = 'plotly.min.js'
+REPORT_INDEX_FILE = 'index.html'
+
+REPORT_INDEX_HTML = '''<html>
+<head><meta charset="utf-8" /><title>{title}</title></head>
+<body>
+<h1>{title}</h1>
+<p>{summary}</p>
+<table border="1" cellpadding="4">
+<tr><th>Graph</th><th>Figures</th><th>Seconds</th><th>Size (KB)</th></tr>
+{rows}
+</table>
+{frames}
+</body>
+</html>
+'''
+
+
+def write_plotly_js(report_dir):
+    """
+        Write plotly.js once in the report directory, for all the figures
+        :param report_dir: report directory
+        :return: path to the plotly.js file
+     """
+    path = os.path.join(report_dir, PLOTLY_JS_FILE)
+    if not os.path.exists(path):
+        with open(path, 'w', encoding='utf-8') as js_file:
+            js_file.write(get_plotlyjs())
+    return path
+
+
+def render_graph(graph, frames, report_dir, write_json=True):
+    """
+        Build the figures of a graph and write them to the report directory, as html pages loading the shared
+        plotly.js, and optionally as plotly json
+        :param graph: name of the graph, key of GRAPH_FIGURES
+        :param frames: dictionary of DataFrames returned by analysis_frames
+        :param report_dir: report directory
+        :param write_json: also write the figures as json
+        :return: dictionary describing the figures written, the wall time and the size of the files
+     """
+    start = time.perf_counter()
+    result = {'graph': graph, 'figures': [], 'bytes': 0, 'error': None}
+    try:
+        for name, fig in GRAPH_FIGURES[graph](frames):
+            figure = {'name': name, 'title': fig.layout.title.text or name,
+                      'html': os.path.join(report_dir, name + '.html'), 'json': None}
+            fig.write_html(figure['html'], include_plotlyjs=PLOTLY_JS_FILE, full_html=True)
+            result['bytes'] += os.path.getsize(figure['html'])
+            if write_json:
+                figure['json'] = os.path.join(report_dir, name + '.json')
+                fig.write_json(figure['json'])
+                result['bytes'] += os.path.getsize(figure['json'])
+            result['figures'].append(figure)
+    except Exception as exc:
+        result['error'] = f'{type(exc).__name__}: {exc}'
+    result['seconds'] = time.perf_counter() - start
+
+    return result
+
+
+def render_graphs(frames, report_dir, graphs=None, workers=None, write_json=True):
+    """
+        Build and write the figures of the graphs in a process pool
+        :param frames: dictionary of DataFrames returned by analysis_frames
+        :param report_dir: report directory
+        :param graphs: names of the graphs, default: all the graphs of GRAPH_FIGURES
+        :param workers: number of worker processes, default is the number of CPUs
+        :param write_json: also write the figures as json
+        :return: generator of render_graph results, in completion order
+     """
+    graphs = list(GRAPH_FIGURES) if graphs is None else graphs
+    if len(graphs) == 0:
+        return
+
+    os.makedirs(report_dir, exist_ok=True)
+    write_plotly_js(report_dir)
+
+    workers = min(workers or os.cpu_count() or 1, len(graphs))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(render_graph, graph, frames, report_dir, write_json) for graph in graphs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def write_report_index(report_dir, results, seconds=None, title='Apache logs analysis'):
+    """
+        Write the index page of the report: a table of the graphs and their figures, embedded below
+        :param report_dir: report directory
+        :param results: render_graph results
+        :param seconds: optional wall time of the report
+        :param title: page title
+        :return: path to the index page
+     """
+    # In the order of GRAPH_FIGURES, whatever the completion order
+    order = {graph: i for i, graph in enumerate(GRAPH_FIGURES)}
+    results = sorted(results, key=lambda r: order.get(r['graph'], len(order)))
+
+    rows = []
+    frames = []
+    for result in results:
+        links = ' '.join(f'<a href="{os.path.basename(f["html"])}">{html.escape(f["title"])}</a>'
+                         for f in result['figures'])
+        if result['error'] is not None:
+            links += f' <b>{html.escape(result["error"])}</b>'
+        rows.append(f'<tr><td>{result["graph"]}</td><td>{links}</td>'
+                    f'<td>{result["seconds"]:.2f}</td><td>{result["bytes"] / 1024:.0f}</td></tr>')
+        frames.extend(f'<iframe src="{os.path.basename(f["html"])}" width="100%" height="520" '
+                      f'frameborder="0"></iframe>' for f in result['figures'])
+
+    summary = f'{sum(len(r["figures"]) for r in results)} figures'
+    if seconds is not None:
+        summary += f', built in {seconds:.1f}s'
+    path = os.path.join(report_dir, REPORT_INDEX_FILE)
+    with open(path, 'w', encoding='utf-8') as index_file:
+        index_file.write(REPORT_INDEX_HTML.format(title=html.escape(title), summary=summary,
+                                                  rows='\n'.join(rows), frames='\n'.join(frames)))
+    return path
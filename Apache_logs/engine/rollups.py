@@ -0,0 +1,140 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import pandas as pd
+from psycopg2.extras import execute_values
+
+from .customer_time import DEFAULT_CUSTOMER_TIMEZONE, customer_timezone, local_times
+
+##################################################################################
+#   Rollup of apache_session maintained at load time, read by the graph solids
+#   One row per (customer date, customer hour, channel, last step, customer end date)
+#   as stored in the customer time columns of apache_session
+#   with the number of sessions, of bookings and the sum of the session durations,
+#   updated in the transaction loading the sessions
+##################################################################################
+
+ROLLUP_TABLE = 'apache_session_rollup'
+
+# last_step of a booking: the Confirmation step of booking_step
+BOOKING_STEP = 6
+
+ROLLUP_KEYS = ['session_date', 'session_hour', 'channel', 'last_step', 'end_date']
+ROLLUP_MEASURES = ['sessions', 'bookings', 'session_duration_sum']
+
+CREATE_ROLLUP_TABLE_SQL = f'''CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+            session_date DATE NOT NULL,
+            session_hour SMALLINT NOT NULL,
+            channel TEXT NOT NULL,
+            last_step SMALLINT NOT NULL,
+            end_date DATE NOT NULL,
+            sessions BIGINT NOT NULL,
+            bookings BIGINT NOT NULL,
+            session_duration_sum BIGINT NOT NULL,
+            PRIMARY KEY ({", ".join(ROLLUP_KEYS)})
+            ) '''
+
+# Add rows to the rollup, the measures of an existing key are summed
+MERGE_ROLLUP_SQL = f'''INSERT INTO {ROLLUP_TABLE} ({", ".join(ROLLUP_KEYS + ROLLUP_MEASURES)})
+    {{rows}}
+    ON CONFLICT ({", ".join(ROLLUP_KEYS)}) DO UPDATE SET
+''' + ",\n".join(f'        {measure} = {ROLLUP_TABLE}.{measure} + EXCLUDED.{measure}' for measure in ROLLUP_MEASURES)
+
+# Rollup of a set of sessions, in SQL, on the stored customer time columns (see customer_time)
+# {sign} is 1 to add the sessions, -1 to remove them
+ROLLUP_SELECT_SQL = f'''SELECT a.session_local_date, a.session_local_hour,
+           a.channel, COALESCE(a.last_step, 0), a.end_local_date,
+           {{sign}} * COUNT(*), {{sign}} * COUNT(*) FILTER (WHERE a.last_step = {BOOKING_STEP}),
+           {{sign}} * COALESCE(SUM(a.session_duration), 0)
+    FROM {{source}}
+    GROUP BY 1, 2, 3, 4, 5'''
+
+DELETE_EMPTY_ROLLUPS_SQL = f'DELETE FROM {ROLLUP_TABLE} WHERE sessions = 0'
+
+
+def has_rollups(cursor):
+    """
+        Check if the rollup table exists (created by create_postgres_tables)
+        :param cursor: postgres cursor
+        :return: True if the rollup is maintained
+     """
+    cursor.execute('SELECT to_regclass(%s) IS NOT NULL', (ROLLUP_TABLE,))
+    return cursor.fetchone()[0]
+
+
+def rollup_frame(final_df, timezone=DEFAULT_CUSTOMER_TIMEZONE):
+    """
+        Rollup of the final sessions, computed in pandas with the same keys as ROLLUP_SELECT_SQL
+        :param final_df: DataFrame with the SESSION_COLUMNS columns
+        :param timezone: customer timezone, as the customer time columns of apache_session
+        :return: DataFrame with the ROLLUP_KEYS and ROLLUP_MEASURES columns
+     """
+    local_start = local_times(final_df['session_start_time'], timezone)
+    last_step = final_df['last_step'].fillna(0).astype('int64')
+    rollup_df = pd.DataFrame({'session_date': local_start.dt.date,
+                              'session_hour': local_start.dt.hour,
+                              'channel': final_df['channel'].astype(object),
+                              'last_step': last_step,
+                              'end_date': local_times(final_df['session_end_time'], timezone).dt.date,
+                              'sessions': 1,
+                              'bookings': (last_step == BOOKING_STEP).astype('int64'),
+                              'session_duration_sum': final_df['session_duration'].fillna(0).astype('int64')})
+    return rollup_df.groupby(ROLLUP_KEYS, sort=False).sum().reset_index()
+
+
+def add_rollups(cursor, final_df):
+    """
+        Add the final sessions to the rollup, the caller commits
+        :param cursor: postgres cursor
+        :param final_df: DataFrame with the SESSION_COLUMNS columns
+        :return: number of rollup rows inserted or updated
+     """
+    rollup_df = rollup_frame(final_df, customer_timezone(cursor) or DEFAULT_CUSTOMER_TIMEZONE)
+    # Python types, for psycopg2
+    tuples = list(zip(*(rollup_df[column].tolist() for column in ROLLUP_KEYS + ROLLUP_MEASURES)))
+    if len(tuples) > 0:
+        execute_values(cursor, MERGE_ROLLUP_SQL.format(rows='VALUES %s'), tuples, page_size=1000)
+    return len(tuples)
+
+
+def rollup_sessions_sql(cursor, source, sign=1):
+    """
+        Add (or remove) a set of sessions of the database to the rollup, the caller commits
+        :param cursor: postgres cursor
+        :param source: FROM clause of the sessions, aliased a, e.g. 'apache_session_p20191125 a'
+        :param sign: 1 to add the sessions, -1 to remove them
+        :return: number of rollup rows inserted or updated
+     """
+    cursor.execute(MERGE_ROLLUP_SQL.format(rows=ROLLUP_SELECT_SQL.format(sign=int(sign), source=source)))
+    rows = cursor.rowcount
+    if sign < 0:
+        cursor.execute(DELETE_EMPTY_ROLLUPS_SQL)
+    return rows
+
+
+def rebuild_rollups(cursor):
+    """
+        Rebuild the whole rollup from apache_session, the caller commits
+        :param cursor: postgres cursor
+        :return: number of rollup rows
+     """
+    cursor.execute(f'TRUNCATE {ROLLUP_TABLE}')
+    return rollup_sessions_sql(cursor, 'apache_session a')
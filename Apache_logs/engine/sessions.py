@@ -0,0 +1,184 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+##################################################################################
+#   Vectorized session extraction from the 'cookie' column
+##################################################################################
+
+# Default cookie carrying the session ID in the DCP UI logs
+DEFAULT_SESSION_COOKIE = 'JSESSIONID'
+DEFAULT_SESSION_ID_LENGTH = 32
+
+
+@lru_cache(maxsize=None)
+def session_cookie_regex(cookie_name=DEFAULT_SESSION_COOKIE, id_length=DEFAULT_SESSION_ID_LENGTH):
+    """
+        Compile (once per cookie name) the regular expression extracting the session ID
+        :param cookie_name: name of the cookie holding the session ID, e.g. JSESSIONID
+        :param id_length: number of word characters in the session ID
+        :return: compiled regular expression with one capturing group: the session ID
+     """
+    return re.compile(re.escape(cookie_name) + r'=(\w{' + str(int(id_length)) + r'})')
+
+
+def unknown_session_id(csv_file_date):
+    """
+        To avoid duplicate issues when loading data for multiple days, unknown values
+        for each day are given a unique value
+        :param csv_file_date: date of the csv file being processed
+        :return: the pseudo session ID for entries without a session cookie
+     """
+    return 'Unknown_' + csv_file_date
+
+
+def extract_session_ids(cookie, csv_file_date,
+                        cookie_name=DEFAULT_SESSION_COOKIE, id_length=DEFAULT_SESSION_ID_LENGTH):
+    """
+        Extract the session ID of every log entry in a single str.extract pass
+        Entries without the cookie (including NaN cookies) get the Unknown_<date> session
+        :param cookie: pandas Series, the 'cookie' column
+        :param csv_file_date: date of the csv file being processed
+        :param cookie_name: name of the cookie holding the session ID
+        :param id_length: number of word characters in the session ID
+        :return: pandas Series named 'session', aligned on the cookie index
+     """
+    regex = session_cookie_regex(cookie_name, id_length)
+
+    if isinstance(cookie.dtype, pd.CategoricalDtype):
+        # Extract once per distinct cookie, then broadcast to the log entries (the code -1 of NaN
+        # picks the appended Unknown_<date> session)
+        distinct = extract_session_ids(pd.Series(cookie.cat.categories, dtype=object), csv_file_date,
+                                       cookie_name=cookie_name, id_length=id_length)
+        session_ids = np.append(distinct.to_numpy(), unknown_session_id(csv_file_date))
+        return pd.Series(session_ids[cookie.cat.codes.to_numpy()], index=cookie.index, name='session')
+
+    # NaN cookies are not strings, cast them so the .str accessor does not choke on them
+    if cookie.dtype != object:
+        cookie = cookie.astype(object)
+
+    # Take the first occurence of the regexp, NaN when there is no match
+    session = cookie.str.extract(regex, expand=False)
+    session = session.fillna(unknown_session_id(csv_file_date))
+    session.name = 'session'
+
+    return session
+
+
+def _value_codes(column):
+    """
+        Integer code of the value of every log entry, equal values get the same code
+        :param column: pandas Series, categorical (e.g. attached by attach_columns) or not
+        :return: numpy array of codes
+     """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy()
+    return pd.factorize(column.to_numpy())[0]
+
+
+def sessionize_by_inactivity(apache_df, session, csv_file_date, idle_timeout, open_sessions=None):
+    """
+        Split the cookie-less log entries (Unknown_<date> session) into sessions of activity:
+        the entries are sorted by (ip, user agent, timestamp) and a new session starts when the
+        ip or the user agent changes, or when the gap since the previous entry exceeds idle_timeout
+        The session ID is Unknown_<date>_<start of the session>_<hash of the user agent>
+        A file read in chunks passes the same open_sessions dictionary for each chunk, in file order:
+        the first entries of an (ip, user agent) continue its session of the previous chunks when they
+        are within idle_timeout of its last entry, so a session running across a chunk boundary keeps one ID
+        Without open_sessions, the entries are sessionized on their own
+        :param apache_df: pandas DataFrame of log entries, with geoip.ip, user_agent_string and @timestamp
+        :param session: pandas Series returned by extract_session_ids
+        :param csv_file_date: date of the csv file being processed
+        :param idle_timeout: inactivity gap starting a new session, in seconds
+        :param open_sessions: optional dictionary (ip, user agent) -> (last timestamp, session ID), updated
+                              with the last session of each (ip, user agent) of the entries
+        :return: pandas Series named 'session', aligned on the session index
+     """
+    unknown = (session == unknown_session_id(csv_file_date)).to_numpy()
+    if not unknown.any():
+        return session
+
+    hits = pd.DataFrame({
+        'ip': _value_codes(apache_df['geoip.ip'])[unknown],
+        'user_agent': _value_codes(apache_df['user_agent_string'])[unknown],
+        'timestamp': apache_df['@timestamp'].to_numpy()[unknown],
+    })
+    hits = hits.sort_values(['ip', 'user_agent', 'timestamp'], kind='mergesort')
+
+    # A new session starts on a new (ip, user agent) or after an inactivity gap
+    new_visitor = (hits['ip'].diff() != 0) | (hits['user_agent'].diff() != 0)
+    gap = hits['timestamp'].diff() > pd.Timedelta(seconds=idle_timeout)
+    session_number = (new_visitor | gap).cumsum()
+
+    # Start of the session of each entry, and user agent hash, both independent of the other entries
+    session_start = hits['timestamp'].groupby(session_number).transform('min')
+    start_epoch = (session_start - pd.Timestamp(0, tz=session_start.dt.tz)) // pd.Timedelta(seconds=1)
+    positions = np.flatnonzero(unknown)[hits.index.to_numpy()]
+    user_agent = apache_df['user_agent_string'].iloc[positions].astype(object).to_numpy().astype(str)
+    user_agent_hash = pd.Series(pd.util.hash_array(user_agent) % 0xFFFFFFFF, index=hits.index)
+
+    session_ids = (unknown_session_id(csv_file_date) + '_' + start_epoch.astype(str)
+                   + '_' + user_agent_hash.astype(str))
+
+    if open_sessions is not None:
+        ip = apache_df['geoip.ip'].iloc[positions].astype(object).to_numpy().astype(str)
+        session_ids = _continue_open_sessions(open_sessions, session_ids, session_number, new_visitor,
+                                              hits['timestamp'], ip, user_agent, idle_timeout)
+
+    session = session.copy()
+    session.iloc[positions] = session_ids.to_numpy()
+    return session
+
+
+def _continue_open_sessions(open_sessions, session_ids, session_number, new_visitor, timestamps, ips,
+                            user_agents, idle_timeout):
+    """
+        Give the first session of each (ip, user agent) the ID of its open session from the previous chunks,
+        when it starts within idle_timeout of that session's last entry, then record the last session
+        of each (ip, user agent) in open_sessions
+        The arguments are aligned on the sorted entries, the result is the session IDs
+     """
+    timeout = pd.Timedelta(seconds=idle_timeout)
+    first = np.flatnonzero(new_visitor.to_numpy())
+    last = np.append(first[1:], len(new_visitor)) - 1
+
+    # Map the first session number of a visitor to the ID of the session it continues
+    continued = {}
+    for position in first:
+        previous = open_sessions.get((ips[position], user_agents[position]))
+        if previous is not None and timestamps.iat[position] - previous[0] <= timeout:
+            continued[session_number.iat[position]] = previous[1]
+    if continued:
+        session_ids = session_number.map(continued).fillna(session_ids)
+
+    open_sessions.update(((ips[position], user_agents[position]), (timestamps.iat[position], session_ids.iat[position]))
+                         for position in last)
+
+    # The sessions idle for longer than idle_timeout cannot be continued any more
+    latest = timestamps.max()
+    for key in [key for key, (timestamp, _) in open_sessions.items() if not latest - timestamp <= timeout]:
+        del open_sessions[key]
+    return session_ids
@@ -0,0 +1,125 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import glob
+import os
+import tempfile
+import time
+
+import pyarrow.feather as feather
+
+from .frame_cache import frame_to_table, table_to_frame
+
+##################################################################################
+#   Hand the parsed log entries to parallel workers
+#   The frame is written once to an uncompressed Feather (Arrow IPC) file in shared memory,
+#   each solid memory-maps the columns it reads instead of unpickling its own copy of apache_df
+#   The string columns are stored dictionary-encoded: a reader maps the int codes and only
+#   materialises the distinct strings, not one Python object per log entry
+##################################################################################
+
+# Columns read by create_session_col (sessionize_by_inactivity also needs the ip, user agent
+# and timestamp) and classify_url_path
+DERIVATION_COLUMNS = ['@timestamp', 'geoip.ip', 'cookie', 'user_agent_string', 'url_path']
+
+# /dev/shm is a RAM-backed file system on Linux, elsewhere fall back to the temporary directory
+DEFAULT_SHARED_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+SHARED_FRAME_PREFIX = 'apache_columns_'
+SHARED_FRAME_SUFFIX = '.feather'
+
+# Shared files older than this are left over by crashed runs
+STALE_SHARED_FRAME_SECONDS = 24 * 3600
+
+
+def shared_frame_path(run_id, shared_dir=None):
+    """
+        Path of the shared columns of a pipeline run
+        :param run_id: pipeline run ID
+        :param shared_dir: directory of the shared files, default: DEFAULT_SHARED_DIR
+        :return: file path
+     """
+    shared_dir = shared_dir or DEFAULT_SHARED_DIR
+    return os.path.join(shared_dir, SHARED_FRAME_PREFIX + run_id + SHARED_FRAME_SUFFIX)
+
+
+def share_columns(apache_df, path, columns=None):
+    """
+        Write columns of a DataFrame to a memory-mappable file, once for all the readers
+        :param apache_df: pandas DataFrame of log entries
+        :param path: file path, see shared_frame_path
+        :param columns: columns to share, default: all the columns
+        :return: the file path
+     """
+    df = apache_df if columns is None else apache_df[columns]
+    table = frame_to_table(df.reset_index(drop=True))
+
+    # Write then rename, so a reader never maps a partial file
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    try:
+        feather.write_feather(table, tmp_path, compression='uncompressed')
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def attach_columns(path, columns=None, decode_strings=False):
+    """
+        Memory-map shared columns
+        The fixed-width columns (timestamps, numbers) point to the mapped pages, the string columns
+        come back as categoricals: the codes are read from the mapped pages and only the distinct
+        strings are materialised in the reading process
+        :param path: file path returned by share_columns
+        :param columns: columns to read, default: all
+        :param decode_strings: convert the string columns back to object, as in the frame that was shared
+                               (one Python object per log entry)
+        :return: pandas DataFrame
+     """
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    return table_to_frame(table, decode_strings=decode_strings)
+
+
+def release_columns(path=None, shared_dir=None, stale_seconds=STALE_SHARED_FRAME_SECONDS):
+    """
+        Remove the shared columns of a run, and the files left over by crashed runs
+        :param path: file path returned by share_columns, or None
+        :param shared_dir: directory of the shared files, default: DEFAULT_SHARED_DIR
+        :param stale_seconds: age above which a shared file is removed
+        :return: number of files removed
+     """
+    removed = 0
+    if path is not None and os.path.exists(path):
+        os.remove(path)
+        removed += 1
+
+    shared_dir = shared_dir or DEFAULT_SHARED_DIR
+    now = time.time()
+    for stale_path in glob.glob(os.path.join(shared_dir, SHARED_FRAME_PREFIX + '*' + SHARED_FRAME_SUFFIX)):
+        try:
+            if now - os.path.getmtime(stale_path) > stale_seconds:
+                os.remove(stale_path)
+                removed += 1
+        except OSError:
+            # Removed by another process in the meantime
+            pass
+    return removed
@@ -0,0 +1,103 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from .aggregate import aggregate_sessions, merge_session_aggregates
+from .reader import read_apache_csv
+from .sessions import DEFAULT_SESSION_COOKIE, DEFAULT_SESSION_ID_LENGTH, extract_session_ids, \
+    sessionize_by_inactivity
+from .url_rules import classify_url_paths
+
+##################################################################################
+#   Chunked streaming ingest: the file is never held in memory as a whole
+##################################################################################
+
+# Default number of log entries read at a time
+DEFAULT_CHUNKSIZE = 250000
+
+# Number of per-chunk partial aggregates held before they are merged: each merge regroups all the
+# sessions so far, merging every chunk would cost O(chunks x sessions)
+DEFAULT_MERGE_CHUNKS = 16
+
+
+def add_derived_columns(apache_df, csv_file_date,
+                        cookie_name=DEFAULT_SESSION_COOKIE, id_length=DEFAULT_SESSION_ID_LENGTH, idle_timeout=None,
+                        open_sessions=None):
+    """
+        Add the session, channel and accessed_step columns to a DataFrame of log entries
+        :param apache_df: pandas DataFrame of log entries
+        :param csv_file_date: date of the csv file being processed
+        :param cookie_name: name of the cookie holding the session ID
+        :param id_length: number of word characters in the session ID
+        :param idle_timeout: if set, split the cookie-less entries into sessions of activity
+                             separated by this inactivity gap (in seconds)
+        :param open_sessions: optional dictionary of the cookie-less sessions still open at the end of the
+                              previous chunks, see sessionize_by_inactivity
+        :return: the DataFrame with the 3 derived columns
+     """
+    session_col = extract_session_ids(apache_df['cookie'], csv_file_date, cookie_name, id_length)
+    if idle_timeout:
+        session_col = sessionize_by_inactivity(apache_df, session_col, csv_file_date, idle_timeout, open_sessions)
+    url_class_df = classify_url_paths(apache_df['url_path'])
+
+    return apache_df.assign(session=session_col.values,
+                            channel=url_class_df['channel'].values,
+                            accessed_step=url_class_df['accessed_step'].values)
+
+
+def stream_session_aggregates(file_path, csv_file_date, chunksize=DEFAULT_CHUNKSIZE,
+                              cookie_name=DEFAULT_SESSION_COOKIE, id_length=DEFAULT_SESSION_ID_LENGTH,
+                              idle_timeout=None, log=None, stats=None, merge_chunks=DEFAULT_MERGE_CHUNKS):
+    """
+        Read the csv file in chunks, derive the session columns and aggregate each chunk by session,
+        the partial aggregates are merged once at the end, or every merge_chunks chunks
+        Only one chunk and the per-session aggregates are held in memory
+        A cookie-less session running across a chunk boundary keeps its session ID, so its partial
+        aggregates are merged into one session
+        :param file_path: path of the csv file
+        :param csv_file_date: date of the csv file being processed
+        :param chunksize: number of log entries read at a time
+        :param cookie_name: name of the cookie holding the session ID
+        :param id_length: number of word characters in the session ID
+        :param idle_timeout: if set, inactivity gap (in seconds) splitting the cookie-less entries into sessions
+        :param log: optional logger (e.g. context.log)
+        :param stats: optional dictionary, updated with the decompression time and sizes of a compressed file
+        :param merge_chunks: maximum number of partial aggregates held before they are merged
+        :return: tuple (DataFrame indexed by (geoip.ip, session), number of log entries read)
+     """
+    partials = []
+    rows = 0
+    # Last cookie-less session of each (ip, user agent), continued by the next chunk
+    open_sessions = {}
+
+    for chunk_number, chunk in enumerate(read_apache_csv(file_path, chunksize=chunksize, stats=stats)):
+        rows += len(chunk)
+        chunk = add_derived_columns(chunk, csv_file_date, cookie_name, id_length, idle_timeout, open_sessions)
+
+        partials.append(aggregate_sessions(chunk))
+        if len(partials) > merge_chunks:
+            # Bound the memory of the partials: fold them into one aggregate
+            partials = [merge_session_aggregates(partials)]
+
+        if log is not None:
+            log.info(f'Chunk {chunk_number}: {rows} log entries read, '
+                     f'{sum(len(partial) for partial in partials)} partial sessions held')
+
+    return merge_session_aggregates(partials), rows
@@ -0,0 +1,108 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+##################################################################################
+#   URL classification: page, step of the booking flow and channel of each url_path
+##################################################################################
+
+# Declarative rule table, the first rule whose substrings are ALL found in the url_path wins
+# To add a page of the booking flow, add a line here
+# (required substrings, page, channel, step)
+URL_RULES = (
+    (('ApplicationStartAction.do',), 'CUI-Start', 'CUI', 1),
+    (('AirFareFamiliesForward.do',), 'CUI-AirFareFamilies', 'CUI', 2),
+    (('AirFareFamiliesFlexibleForward.do',), 'CUI-AirFareFamilies', 'CUI', 2),
+    (('ItinerarySummary.do',), 'CUI-ItinerarySummary', 'CUI', 3),
+    (('TravelersDetailsForwardAction.do',), 'CUI-TravelersDetails', 'CUI', 4),
+    (('PaymentExternal.do',), 'CUI-Payment', 'CUI', 5),
+    (('PaymentForward.do',), 'CUI-Payment', 'CUI', 5),
+    (('ConfirmationForward.do',), 'CUI-Confirmation', 'CUI', 6),
+    (('palmobile/air-shopping/',), 'Mobile-AirFareFamilies', 'Mobile', 2),
+    (('palmobile/cart/',), 'Mobile-ItinerarySummary', 'Mobile', 3),
+    (('palmobile/reservations/', '/payment'), 'Mobile-Payment', 'Mobile', 5),
+    (('palmobile/reservations/', '/confirmation'), 'Mobile-Confirmation', 'Mobile', 6),
+    (('palmobile/reservations/',), 'na', 'na', 0),
+)
+
+# Classification of a url_path matching no rule (and of missing url_path values)
+URL_DEFAULT = ('na', 'Unknown', 0)
+
+
+@lru_cache(maxsize=None)
+def _compile_rules(rules):
+    """
+        Compile the rule table into one regular expression
+        Each rule becomes a set of lookaheads anchored at the start of the url_path followed by
+        an empty named group, so the regex engine tries the rules in table order, exactly like
+        an if/elif chain, and the group that matched tells which rule won
+        :param rules: the rule table
+        :return: tuple (compiled regex, page categories, channel categories,
+                        page code / channel code / step of each rule, the default last)
+     """
+    alternatives = []
+    for index, (substrings, _, _, _) in enumerate(rules):
+        lookaheads = ''.join('(?=.*?' + re.escape(sub) + ')' for sub in substrings)
+        alternatives.append(lookaheads + '(?P<r' + str(index) + '>)')
+    regex = re.compile('^(?:' + '|'.join(alternatives) + ')', re.DOTALL)
+
+    outcomes = [(page, channel, step) for _, page, channel, step in rules] + [URL_DEFAULT]
+    pages = list(dict.fromkeys(page for page, _, _ in outcomes))
+    channels = list(dict.fromkeys(channel for _, channel, _ in outcomes))
+    page_codes = np.array([pages.index(page) for page, _, _ in outcomes], dtype=np.int8)
+    channel_codes = np.array([channels.index(channel) for _, channel, _ in outcomes], dtype=np.int8)
+    steps = np.array([step for _, _, step in outcomes], dtype=np.int8)
+
+    return regex, pages, channels, page_codes, channel_codes, steps
+
+
+def classify_url_paths(url_path, rules=URL_RULES):
+    """
+        Classify every url_path in one vectorized pass
+        The distinct url_path values are matched once against the combined rule regex,
+        the result is then broadcast back to all the log entries
+        :param url_path: pandas Series, the 'url_path' column
+        :param rules: the rule table, URL_RULES by default
+        :return: DataFrame aligned on url_path with the columns
+                 page (categorical), accessed_step (int8) and channel (categorical)
+     """
+    regex, pages, channels, page_codes, channel_codes, steps = _compile_rules(tuple(rules))
+    default_rule = len(rules)
+
+    # Classify each distinct url_path once, NaN url_path values get the code -1
+    codes, uniques = pd.factorize(url_path)
+    matches = pd.Series(uniques, dtype=object).str.extract(regex)
+    matched = matches.notna().to_numpy()
+    unique_rule = np.where(matched.any(axis=1), matched.argmax(axis=1), default_rule)
+
+    # Index of the winning rule for every log entry, the code -1 picks the appended default
+    rule = np.append(unique_rule, default_rule)[codes]
+
+    return pd.DataFrame({
+        'page': pd.Categorical.from_codes(page_codes[rule], categories=pages),
+        'accessed_step': steps[rule],
+        'channel': pd.Categorical.from_codes(channel_codes[rule], categories=channels),
+    }, index=url_path.index)
@@ -1,9 +1,16 @@
 from .apache_etl import  call_create_postgres_tables_pipeline, \
     call_csv_to_postgres_pipeline, \
-    send_all_files_to_csv_postgres_pipeline
-from .apache_analysis import call_postgres_to_visualisation_pipeline
+    send_all_files_to_csv_postgres_pipeline, call_retire_apache_sessions_pipeline
+from .apache_analysis import call_postgres_to_visualisation_pipeline, \
+    call_postgres_to_report_pipeline
+from .apache_backfill import call_backfill_csv_to_postgres_pipeline
+from .apache_follow import call_follow_csv_to_postgres_pipeline
 
 __all__ = ['call_create_postgres_tables_pipeline',
            'call_csv_to_postgres_pipeline',
            'send_all_files_to_csv_postgres_pipeline',
-           'call_postgres_to_visualisation_pipeline']
\ No newline at end of file
+           'call_retire_apache_sessions_pipeline',
+           'call_backfill_csv_to_postgres_pipeline',
+           'call_follow_csv_to_postgres_pipeline',
+           'call_postgres_to_visualisation_pipeline',
+           'call_postgres_to_report_pipeline']
\ No newline at end of file
@@ -25,13 +25,14 @@ from dagster import (
     ModeDefinition
 )
 
-from dagster_toolkit.postgres import postgres_warehouse_resource
+from Apache_logs.resources import pooled_postgres_warehouse_resource
 
 from db_toolkit.misc.get_env import get_file_path
 
 from Apache_logs.solids import  graph1_avg_sessions_by_hour, graph2_avg_bookings_by_hour,  \
     graph3_visitor_bookings_pie_charts, graph4_conversion_rate_funnels, \
-    graph6_session_duration, graph7_geo, graph5_bookings_per_day
+    graph6_session_duration, graph7_geo, graph5_bookings_per_day, compute_analysis_frames, \
+    build_analysis_report
 
 
 @pipeline(
@@ -39,7 +40,7 @@ from Apache_logs.solids import  graph1_avg_sessions_by_hour, graph2_avg_bookings
         ModeDefinition(
             # attach resources to pipeline
             resource_defs={
-                'postgres_warehouse': postgres_warehouse_resource,
+                'postgres_warehouse': pooled_postgres_warehouse_resource,
             }
         )
     ]
@@ -47,16 +48,41 @@ from Apache_logs.solids import  graph1_avg_sessions_by_hour, graph2_avg_bookings
 
 def postgres_to_visualisation_pipeline():
 
-    graph1_avg_sessions_by_hour()
-    graph2_avg_bookings_by_hour()
-    graph5_bookings_per_day()
-    graph3_visitor_bookings_pie_charts()
-    graph4_conversion_rate_funnels()
-    graph6_session_duration()
-    graph7_geo()
+    # The datasets of all the graphs, in one pass over the rollup
+    analysis_frames = compute_analysis_frames()
 
+    graph1_avg_sessions_by_hour(analysis_frames)
+    graph2_avg_bookings_by_hour(analysis_frames)
+    graph5_bookings_per_day(analysis_frames)
+    graph3_visitor_bookings_pie_charts(analysis_frames)
+    graph4_conversion_rate_funnels(analysis_frames)
+    graph6_session_duration(analysis_frames)
+    graph7_geo(analysis_frames)
 
-def call_postgres_to_visualisation_pipeline():
+
+@pipeline(
+    mode_defs=[
+        ModeDefinition(
+            # attach resources to pipeline
+            resource_defs={
+                'postgres_warehouse': pooled_postgres_warehouse_resource,
+            }
+        )
+    ]
+)
+def postgres_to_report_pipeline():
+
+    # The figures are written to static html files by a process pool, no browser needed
+    build_analysis_report(compute_analysis_frames())
+
+
+def call_postgres_to_visualisation_pipeline(date_from='', date_to='', bucket=''):
+    """
+    Show the graphs of the sessions started in the [date_from, date_to) window
+    :param date_from: first session start, YYYY-MM-DD [HH:MM] customer-local, default: the first session
+    :param date_to: end of the window (excluded), YYYY-MM-DD [HH:MM] customer-local, default: after the last session
+    :param bucket: resolution of the bookings over time: hour, day or week, default: chosen by the window span
+    """
 
     # get path to postgres config file
     postgres_cfg = get_file_path('POSTGRES_CFG', 'Postgres configuration file')
@@ -66,6 +92,8 @@ def call_postgres_to_visualisation_pipeline():
     # resource entries for environment_dict
     postgres_warehouse = {'config': {'postgres_cfg': postgres_cfg}}
 
+    analysis_config = {'date_from': date_from, 'date_to': date_to, 'bucket': bucket}
+
     def execute_postgres_to_visualisation_pipeline():
         """
         Describe
@@ -73,6 +101,10 @@ def call_postgres_to_visualisation_pipeline():
         # environment dictionary
         postgres_to_visualisation_env_dict = {
             'solids': {
+                'compute_analysis_frames':
+                    {
+                        'config': analysis_config
+                    },
                 'graph1_avg_sessions_by_hour':
                     {
                     },
@@ -105,6 +137,44 @@ def call_postgres_to_visualisation_pipeline():
 
     execute_postgres_to_visualisation_pipeline()
 
+def call_postgres_to_report_pipeline(report_dir, workers=0, write_json=True, date_from='', date_to='', bucket=''):
+    """
+    Write the graphs to a static html report, with an index page, for headless servers
+    :param report_dir: directory of the report
+    :param workers: number of worker processes building the figures, 0 for the number of CPUs
+    :param write_json: also write the figures as plotly json
+    :param date_from: first session start, YYYY-MM-DD [HH:MM] customer-local, default: the first session
+    :param date_to: end of the window (excluded), YYYY-MM-DD [HH:MM] customer-local, default: after the last session
+    :param bucket: resolution of the bookings over time: hour, day or week, default: chosen by the window span
+    """
+    # get path to postgres config file
+    postgres_cfg = get_file_path('POSTGRES_CFG', 'Postgres configuration file')
+    if postgres_cfg is None:
+        exit(0)
+
+    postgres_to_report_env_dict = {
+        'solids': {
+            'compute_analysis_frames':
+                {
+                    'config': {'date_from': date_from, 'date_to': date_to, 'bucket': bucket}
+                },
+            'build_analysis_report':
+                {
+                    'config': {
+                        'report_dir': report_dir,
+                        'workers': workers,
+                        'write_json': write_json,
+                    }
+                },
+        },
+        'resources': {
+            'postgres_warehouse': {'config': {'postgres_cfg': postgres_cfg}},
+        }
+    }
+
+    result = execute_pipeline(postgres_to_report_pipeline, environment_dict=postgres_to_report_env_dict)
+    assert result.success
+
 if __name__ == '__main__':
     # Normal flow: Call the function to execute the pipeline to load the csv file to postgres
     call_postgres_to_visualisation_pipeline()
@@ -0,0 +1,129 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+
+from dagster import (
+    execute_pipeline,
+    pipeline,
+    ModeDefinition
+)
+
+from db_toolkit.misc.get_env import get_file_path, get_dir_path
+
+from Apache_logs.resources import pooled_postgres_warehouse_resource
+
+from Apache_logs.engine import APACHE_FILENAME_PATTERN
+from Apache_logs.solids.backfill_apache_nodes import find_pending_apache_files, parse_apache_files, \
+    upload_parsed_files
+
+
+@pipeline(
+    mode_defs=[
+        ModeDefinition(
+            # attach resources to pipeline
+            resource_defs={
+                'postgres_warehouse': pooled_postgres_warehouse_resource,
+            }
+        )
+    ]
+)
+
+def backfill_csv_to_postgres_pipeline():
+
+    # Find all the apache csv files not loaded yet, oldest first
+    pending_files = find_pending_apache_files()
+
+    # Parse and aggregate them in a process pool
+    parsed_files = parse_apache_files(pending_files)
+
+    # Upload the sessions to postgres, one file at a time
+    upload_parsed_files(parsed_files)
+
+
+def call_backfill_csv_to_postgres_pipeline(date_from='', date_to='', workers=0, chunksize=None, stitch_sessions=False):
+    """
+    Load all the pending apache csv files to postgres
+    :param date_from: first date of logs to load, YYYY.MM.DD, empty for no lower bound
+    :param date_to: last date of logs to load (inclusive), YYYY.MM.DD, empty for no upper bound
+    :param workers: number of worker processes, 0 for the number of CPUs
+    :param chunksize: number of log entries read at a time by each worker
+    :param stitch_sessions: merge sessions across days, the tables must be created with session_stitching
+    """
+
+    # get path to the apache logs csv files
+    filepath = get_dir_path('CSV_DIR_PATH', 'Apache Csv directory path')
+    if filepath is None:
+       exit(0)
+
+    # get path to postgres config file
+    postgres_cfg = get_file_path('POSTGRES_CFG', 'Postgres configuration file')
+    if postgres_cfg is None:
+        exit(0)
+
+    # resource entries for environment_dict
+    postgres_warehouse = {'config': {'postgres_cfg': postgres_cfg}}
+
+    parse_config = {'workers': workers}
+    if chunksize is not None:
+        parse_config['chunksize'] = chunksize
+
+    # environment dictionary
+    backfill_env_dict = {
+        'solids':   {
+                    'find_pending_apache_files':
+                        {
+                            'inputs':
+                                {
+                                    'file_path' : {'value': filepath },
+                                    'filename_pattern': {'value': APACHE_FILENAME_PATTERN },
+                                },
+                            'config': {'date_from': date_from, 'date_to': date_to}
+                        },
+                    'parse_apache_files':
+                        {
+                            'config': parse_config
+                        },
+                    'upload_parsed_files':
+                        {
+                            'config': {'stitch_sessions': stitch_sessions}
+                        }
+                    },
+        'resources': {
+                        'postgres_warehouse': postgres_warehouse,
+                    }
+    }
+    result = execute_pipeline(backfill_csv_to_postgres_pipeline, environment_dict=backfill_env_dict)
+    assert result.success
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Load all the pending apache csv files to postgres')
+    parser.add_argument('--from', dest='date_from', default='', help='First date of logs to load, YYYY.MM.DD')
+    parser.add_argument('--to', dest='date_to', default='', help='Last date of logs to load (inclusive), YYYY.MM.DD')
+    parser.add_argument('--workers', type=int, default=0, help='Number of worker processes, default: number of CPUs')
+    parser.add_argument('--chunksize', type=int, default=None, help='Number of log entries read at a time')
+    parser.add_argument('--stitch-sessions', action='store_true', help='Merge sessions across days')
+    args = parser.parse_args()
+
+    call_backfill_csv_to_postgres_pipeline(args.date_from, args.date_to, args.workers, args.chunksize,
+                                           args.stitch_sessions)
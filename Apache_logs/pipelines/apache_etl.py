@@ -22,19 +22,27 @@
 from dagster import (
     execute_pipeline,
     pipeline,
-    ModeDefinition
+    ModeDefinition,
+    ExecutionTargetHandle
 )
 
 from db_toolkit.misc.get_env import get_file_path, get_dir_path
 
 from Apache_logs.solids.create_apache_tables_nodes import create_postgres_tables
+from Apache_logs.solids.drop_apache_tables_nodes import retire_apache_sessions
 
 
-from Apache_logs.solids.load_apache_csv_nodes import create_accessed_step_col, create_channel_col, create_session_col, \
+from Apache_logs.solids.load_apache_csv_nodes import classify_url_path, create_session_col, \
     add_cols_to_df, \
-    aggregate_df_by_session, add_session_duration_col, create_final_df, upload_to_postgres, load_apache_csv
+    aggregate_df_by_session, add_session_duration_col, create_final_df, upload_to_postgres, load_apache_csv, \
+    stream_apache_csv_sessions, fused_apache_csv_sessions, load_shared_apache_csv
 
-from dagster_toolkit.postgres import postgres_warehouse_resource
+from Apache_logs.engine import shared_frame_path, release_columns, LOG_FORMAT_CSV, LOG_FORMAT_ACCESS_LOG, \
+    ACCESS_LOG_FILENAME_PATTERN, DEFAULT_CUSTOMER_TIMEZONE
+
+from Apache_logs.resources import pooled_postgres_warehouse_resource
+
+from Apache_logs.pipelines.apache_backfill import call_backfill_csv_to_postgres_pipeline
 
 
 @pipeline(
@@ -42,7 +50,7 @@ from dagster_toolkit.postgres import postgres_warehouse_resource
         ModeDefinition(
             # attach resources to pipeline
             resource_defs={
-                'postgres_warehouse': postgres_warehouse_resource,
+                'postgres_warehouse': pooled_postgres_warehouse_resource,
             }
         )
     ]
@@ -56,7 +64,21 @@ def create_postgres_tables_pipeline():
         ModeDefinition(
             # attach resources to pipeline
             resource_defs={
-                'postgres_warehouse': postgres_warehouse_resource,
+                'postgres_warehouse': pooled_postgres_warehouse_resource,
+            }
+        )
+    ]
+)
+
+def retire_apache_sessions_pipeline():
+    retire_apache_sessions()
+
+@pipeline(
+    mode_defs=[
+        ModeDefinition(
+            # attach resources to pipeline
+            resource_defs={
+                'postgres_warehouse': pooled_postgres_warehouse_resource,
             }
         )
     ]
@@ -71,11 +93,10 @@ def csv_to_postgres_pipeline():
 
     # Calculate new columns
     session_col_df=create_session_col(df, csv_file_date )
-    accessed_step_df=create_accessed_step_col(df)
-    channel_col_df=create_channel_col(df)
+    url_class_df=classify_url_path(df)
 
     # Add new columns to the data frame
-    extended_df=add_cols_to_df(df, session_col_df, channel_col_df, accessed_step_df)
+    extended_df=add_cols_to_df(df, session_col_df, url_class_df)
 
     # Aggegate the data by session
     agg_df=aggregate_df_by_session(extended_df)
@@ -89,7 +110,97 @@ def csv_to_postgres_pipeline():
     # Upload to the apache_session table in posgtres
     upload_to_postgres(agg_df, csv_file_name_to_load)
 
-def call_create_postgres_tables_pipeline():
+@pipeline(
+    mode_defs=[
+        ModeDefinition(
+            # attach resources to pipeline
+            resource_defs={
+                'postgres_warehouse': pooled_postgres_warehouse_resource,
+            }
+        )
+    ]
+)
+
+def csv_to_postgres_streaming_pipeline():
+
+    # Read the first available apache csv file in chunks and aggregate it by session
+    # Memory stays bounded by the chunk size and the number of sessions, whatever the file size
+    csv_file_name_to_load, csv_file_date, agg_df = stream_apache_csv_sessions()
+
+    # Add a column with the duration of each session
+    agg_df=add_session_duration_col(agg_df)
+
+    # Prepare the final data frame
+    agg_df=create_final_df(agg_df)
+
+    # Upload to the apache_session table in posgtres
+    upload_to_postgres(agg_df, csv_file_name_to_load)
+
+@pipeline(
+    mode_defs=[
+        ModeDefinition(
+            # attach resources to pipeline
+            resource_defs={
+                'postgres_warehouse': pooled_postgres_warehouse_resource,
+            }
+        )
+    ]
+)
+
+def csv_to_postgres_fused_pipeline():
+
+    # Parse the first available apache csv file, derive the session columns, aggregate and
+    # prepare the final data frame in a single solid, without intermediate copies of the log entries
+    csv_file_name_to_load, csv_file_date, agg_df = fused_apache_csv_sessions()
+
+    # Upload to the apache_session table in posgtres
+    upload_to_postgres(agg_df, csv_file_name_to_load)
+
+@pipeline(
+    mode_defs=[
+        ModeDefinition(
+            # attach resources to pipeline
+            resource_defs={
+                'postgres_warehouse': pooled_postgres_warehouse_resource,
+            }
+        )
+    ]
+)
+
+def csv_to_postgres_parallel_pipeline():
+
+    # Load the first available apache csv file and write it once to shared memory
+    # With the multiprocess executor, the next solids only receive the file path: the derivation
+    # solids run in parallel and attach to the columns they read
+    csv_file_name_to_load, csv_file_date , shared_df = load_shared_apache_csv()
+
+    # Calculate new columns
+    session_col_df=create_session_col(shared_df, csv_file_date )
+    url_class_df=classify_url_path(shared_df)
+
+    # Add new columns to the data frame
+    extended_df=add_cols_to_df(shared_df, session_col_df, url_class_df)
+
+    # Aggegate the data by session
+    agg_df=aggregate_df_by_session(extended_df)
+
+    # Add a column with the duration of each session
+    agg_df=add_session_duration_col(agg_df)
+
+    # Prepare the final data frame
+    agg_df=create_final_df(agg_df)
+
+    # Upload to the apache_session table in posgtres
+    upload_to_postgres(agg_df, csv_file_name_to_load)
+
+def call_create_postgres_tables_pipeline(session_stitching=False, partition_by='',
+                                         customer_timezone=DEFAULT_CUSTOMER_TIMEZONE):
+    """
+    Create the apache tables in postgres
+    :param session_stitching: create the unique (ip_address, session_id) index used to merge sessions across days
+    :param partition_by: 'day' or 'month' to partition apache_session on session_start_time, empty for one table
+    :param customer_timezone: IANA timezone of the customer date and hour columns of apache_session
+    """
 
     # get path to postgres config file
     postgres_cfg = get_file_path('POSTGRES_CFG', 'Postgres configuration file')
@@ -108,6 +219,9 @@ def call_create_postgres_tables_pipeline():
                 'solids':   {
                             'create_postgres_tables':
                                 {
+                                    'config': {'session_stitching': session_stitching,
+                                               'partition_by': partition_by,
+                                               'customer_timezone': customer_timezone}
                                 }
                             },
                 'resources': {
@@ -119,7 +233,49 @@ def call_create_postgres_tables_pipeline():
 
     execute_create_postgres_tables_pipeline()
 
-def call_csv_to_postgres_pipeline():
+def call_retire_apache_sessions_pipeline(before):
+    """
+    Retire the sessions started before a date, by dropping the partitions of apache_session
+    :param before: first date of the sessions kept, YYYY.MM.DD
+    """
+
+    # get path to postgres config file
+    postgres_cfg = get_file_path('POSTGRES_CFG', 'Postgres configuration file')
+    if postgres_cfg is None:
+        exit(0)
+
+    # environment dictionary
+    retire_env_dict = {
+        'solids':   {
+                    'retire_apache_sessions':
+                        {
+                            'config': {'before': before}
+                        }
+                    },
+        'resources': {
+                        'postgres_warehouse': {'config': {'postgres_cfg': postgres_cfg}},
+                    }
+    }
+    result = execute_pipeline(retire_apache_sessions_pipeline, environment_dict=retire_env_dict)
+    assert result.success
+
+def call_csv_to_postgres_pipeline(streaming=False, chunksize=None, stitch_sessions=False, fused=False,
+                                  parallel=False, log_format=LOG_FORMAT_CSV, geo_lookup_file='',
+                                  frame_cache_dir=''):
+    """
+    Load the next apache csv file to postgres
+    :param streaming: if True, read the file in chunks with the csv_to_postgres_streaming_pipeline
+    :param chunksize: number of log entries read at a time in streaming mode
+    :param stitch_sessions: merge sessions across days, the tables must be created with session_stitching
+    :param fused: if True, process the file in a single solid with the csv_to_postgres_fused_pipeline
+    :param parallel: if True, run the derivation solids in parallel processes with the
+                     csv_to_postgres_parallel_pipeline
+    :param log_format: csv, or access_log to load the raw apache access logs (apache_access-p-pal-YYYY.MM.DD.log)
+                       instead of the csv export, not available in streaming and fused mode
+    :param geo_lookup_file: csv table of IPv4 ranges filling the geo columns of the raw access logs
+    :param frame_cache_dir: if set, cache the parsed frames in this directory (see Apache_logs.engine.frame_cache),
+                            not used in streaming and fused mode
+    """
 
     # get path to the apache logs csv files
     filepath = get_dir_path('CSV_DIR_PATH', 'Apache Csv directory path')
@@ -127,6 +283,12 @@ def call_csv_to_postgres_pipeline():
        exit(0)
 
     filename_pattern = r'apache_access-p-pal-\d{4}.\d{2}.\d{2}.csv'
+    if log_format == LOG_FORMAT_ACCESS_LOG:
+        filename_pattern = ACCESS_LOG_FILENAME_PATTERN
+
+    load_config = {'log_format': log_format, 'geo_lookup_file': geo_lookup_file}
+    if frame_cache_dir:
+        load_config.update({'use_frame_cache': True, 'frame_cache_dir': frame_cache_dir})
 
     # get path to postgres config file
     postgres_cfg = get_file_path('POSTGRES_CFG', 'Postgres configuration file')
@@ -151,15 +313,13 @@ def call_csv_to_postgres_pipeline():
                                         {
                                             'file_path' : {'value': filepath },
                                             'filename_pattern': {'value': filename_pattern },
-                                        }
+                                        },
+                                    'config': load_config
                                 },
                             'create_session_col':
                                  {
                                  },
-                            'create_accessed_step_col':
-                                {
-                                },
-                            'create_channel_col':
+                            'classify_url_path':
                                 {
                                 },
                             'add_cols_to_df':
@@ -176,6 +336,7 @@ def call_csv_to_postgres_pipeline():
                                 },
                             'upload_to_postgres':
                                 {
+                                    'config': {'stitch_sessions': stitch_sessions}
                                 }
                             },
                 'resources': {
@@ -185,14 +346,126 @@ def call_csv_to_postgres_pipeline():
             result = execute_pipeline(csv_to_postgres_pipeline, environment_dict=csv_to_postgres_env_dict)
             assert result.success
 
-        execute_csv_to_postgres_pipeline()
+        def execute_csv_to_postgres_streaming_pipeline():
+            """
+            Execute the pipeline to stream the apache csv file in chunks, apply ETL and save the result to Postgres
+            """
+            stream_config = {}
+            if chunksize is not None:
+                stream_config['chunksize'] = chunksize
 
-def send_all_files_to_csv_postgres_pipeline():
+            # environment dictionary
+            csv_to_postgres_streaming_env_dict = {
+                'solids':   {
+                            'stream_apache_csv_sessions':
+                                {
+                                    'inputs':
+                                        {
+                                            'file_path' : {'value': filepath },
+                                            'filename_pattern': {'value': filename_pattern },
+                                        },
+                                    'config': stream_config
+                                },
+                            'add_session_duration_col':
+                                {
+                                },
+                            'create_final_df':
+                                {
+                                },
+                            'upload_to_postgres':
+                                {
+                                    'config': {'stitch_sessions': stitch_sessions}
+                                }
+                            },
+                'resources': {
+                                'postgres_warehouse': postgres_warehouse,
+                            }
+            }
+            result = execute_pipeline(csv_to_postgres_streaming_pipeline,
+                                      environment_dict=csv_to_postgres_streaming_env_dict)
+            assert result.success
 
-    # Call the pipeline iteratively to load all the csv files to postgres
-     for file in range(7):
-        print ('Running csv_to_postgres_pipeline - Iteration: file number: ', file )
-        call_csv_to_postgres_pipeline()
+        def execute_csv_to_postgres_fused_pipeline():
+            """
+            Execute the pipeline to process the apache csv file in a single solid and save the result to Postgres
+            """
+            # environment dictionary
+            csv_to_postgres_fused_env_dict = {
+                'solids':   {
+                            'fused_apache_csv_sessions':
+                                {
+                                    'inputs':
+                                        {
+                                            'file_path' : {'value': filepath },
+                                            'filename_pattern': {'value': filename_pattern },
+                                        }
+                                },
+                            'upload_to_postgres':
+                                {
+                                    'config': {'stitch_sessions': stitch_sessions}
+                                }
+                            },
+                'resources': {
+                                'postgres_warehouse': postgres_warehouse,
+                            }
+            }
+            result = execute_pipeline(csv_to_postgres_fused_pipeline,
+                                      environment_dict=csv_to_postgres_fused_env_dict)
+            assert result.success
+
+        def execute_csv_to_postgres_parallel_pipeline():
+            """
+            Execute the pipeline with the multiprocess executor, the derivation solids attach to the shared columns
+            """
+            # environment dictionary
+            csv_to_postgres_parallel_env_dict = {
+                'solids':   {
+                            'load_shared_apache_csv':
+                                {
+                                    'inputs':
+                                        {
+                                            'file_path' : {'value': filepath },
+                                            'filename_pattern': {'value': filename_pattern },
+                                        },
+                                    'config': load_config
+                                },
+                            'upload_to_postgres':
+                                {
+                                    'config': {'stitch_sessions': stitch_sessions}
+                                }
+                            },
+                'resources': {
+                                'postgres_warehouse': postgres_warehouse,
+                            },
+                # The multiprocess executor needs a persistent intermediate storage
+                'storage': {'filesystem': {}},
+                'execution': {'multiprocess': {}},
+            }
+            # The executor processes load the pipeline from this module
+            pipeline_def = ExecutionTargetHandle.for_pipeline_python_file(
+                __file__, 'csv_to_postgres_parallel_pipeline').build_pipeline_definition()
+            result = execute_pipeline(pipeline_def, environment_dict=csv_to_postgres_parallel_env_dict)
+
+            # The shared columns only live for the run
+            release_columns(shared_frame_path(result.run_id))
+            assert result.success
+
+        if (streaming or fused) and log_format != LOG_FORMAT_CSV:
+            raise ValueError(f'The {log_format} log format is not available in streaming and fused mode')
+
+        if streaming:
+            execute_csv_to_postgres_streaming_pipeline()
+        elif fused:
+            execute_csv_to_postgres_fused_pipeline()
+        elif parallel:
+            execute_csv_to_postgres_parallel_pipeline()
+        else:
+            execute_csv_to_postgres_pipeline()
+
+def send_all_files_to_csv_postgres_pipeline(date_from='', date_to='', workers=0):
+
+    # Load all the pending csv files to postgres, the files are parsed in a process pool
+    call_backfill_csv_to_postgres_pipeline(date_from, date_to, workers)
 
 if __name__ == '__main__':
 
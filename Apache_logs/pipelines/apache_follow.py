@@ -0,0 +1,120 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import time
+
+from dagster import (
+    execute_pipeline,
+    pipeline,
+    ModeDefinition
+)
+
+from db_toolkit.misc.get_env import get_file_path, get_dir_path
+
+from Apache_logs.resources import pooled_postgres_warehouse_resource
+
+from Apache_logs.engine import APACHE_FILENAME_PATTERN
+from Apache_logs.solids.follow_apache_nodes import follow_apache_csv
+
+
+@pipeline(
+    mode_defs=[
+        ModeDefinition(
+            # attach resources to pipeline
+            resource_defs={
+                'postgres_warehouse': pooled_postgres_warehouse_resource,
+            }
+        )
+    ]
+)
+
+def follow_csv_to_postgres_pipeline():
+
+    # Merge the lines appended to the current apache csv file since the last poll into apache_session
+    follow_apache_csv()
+
+
+def call_follow_csv_to_postgres_pipeline(poll_seconds=60, polls=0, max_bytes=None):
+    """
+    Follow the current apache csv file: poll it and load the new lines to postgres
+    The tables must be created with session_stitching, the sessions are merged on (ip_address, session_id)
+    :param poll_seconds: time between the start of two polls
+    :param polls: number of polls, 0 to poll until interrupted
+    :param max_bytes: maximum number of bytes read from a file by one poll
+    """
+
+    # get path to the apache logs csv files
+    filepath = get_dir_path('CSV_DIR_PATH', 'Apache Csv directory path')
+    if filepath is None:
+       exit(0)
+
+    # get path to postgres config file
+    postgres_cfg = get_file_path('POSTGRES_CFG', 'Postgres configuration file')
+    if postgres_cfg is None:
+        exit(0)
+
+    # resource entries for environment_dict
+    postgres_warehouse = {'config': {'postgres_cfg': postgres_cfg}}
+
+    follow_config = {}
+    if max_bytes is not None:
+        follow_config['max_bytes'] = max_bytes
+
+    # environment dictionary
+    follow_env_dict = {
+        'solids':   {
+                    'follow_apache_csv':
+                        {
+                            'inputs':
+                                {
+                                    'file_path' : {'value': filepath },
+                                    'filename_pattern': {'value': APACHE_FILENAME_PATTERN },
+                                },
+                            'config': follow_config
+                        },
+                    },
+        'resources': {
+                        'postgres_warehouse': postgres_warehouse,
+                    }
+    }
+
+    poll = 0
+    while polls == 0 or poll < polls:
+        start = time.time()
+        result = execute_pipeline(follow_csv_to_postgres_pipeline, environment_dict=follow_env_dict)
+        assert result.success
+        poll += 1
+
+        if polls == 0 or poll < polls:
+            time.sleep(max(poll_seconds - (time.time() - start), 0))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Follow the current apache csv file and load the new lines '
+                                                 'to postgres')
+    parser.add_argument('--poll-seconds', type=int, default=60, help='Time between two polls')
+    parser.add_argument('--polls', type=int, default=0, help='Number of polls, default: until interrupted')
+    parser.add_argument('--max-bytes', type=int, default=None, help='Maximum number of bytes read by one poll')
+    args = parser.parse_args()
+
+    call_follow_csv_to_postgres_pipeline(args.poll_seconds, args.polls, args.max_bytes)
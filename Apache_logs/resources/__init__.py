@@ -0,0 +1,3 @@
+from .postgres_pool import PooledPostgresWarehouse, pooled_postgres_warehouse_resource
+
+__all__ = ['PooledPostgresWarehouse', 'pooled_postgres_warehouse_resource']
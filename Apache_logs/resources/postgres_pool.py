@@ -0,0 +1,110 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import atexit
+import os
+import threading
+
+from dagster import resource, Field, String, Int, Float, Bool
+
+from dagster_toolkit.postgres import postgres_warehouse_resource
+
+from Apache_logs.engine import ConnectionPool, PooledConnection, DEFAULT_POOL_SIZE, DEFAULT_POOL_TIMEOUT, \
+    pool_report
+
+##################################################################################
+#   Pooled variant of the postgres_warehouse resource: the solids keep calling
+#   get_connection(context) and close_connection(), which borrow and return a
+#   connection of a pool shared by the pipeline runs of the process
+##################################################################################
+
+# Pools by process, configuration file and pool settings
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+class PooledPostgresWarehouse(object):
+    """
+        postgres_warehouse lending the connections of a pool
+        :param pool: the ConnectionPool of the connections of the postgres_warehouse resource
+     """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def get_connection(self, context):
+        """
+            Borrow a connection, returned to the pool by its close_connection()
+            :param context: execution context
+            :return: connection, or None if it could not be opened
+         """
+        connection, borrow = self.pool.borrow(context)
+        if connection is None:
+            return None
+        context.log.debug(f'Pooled connection: {"reused" if borrow["reused"] else "new"}, '
+                          f'lent {borrow["uses"]} times, waited {borrow["wait_seconds"] * 1000:.1f} ms')
+        return PooledConnection(self.pool, connection)
+
+
+def connection_pool(init_context):
+    """
+        Pool of the connections of the postgres_warehouse resource for the resource configuration,
+        created on first use and closed when the process exits
+        :param init_context: resource initialisation context
+        :return: ConnectionPool
+     """
+    config = init_context.resource_config
+    key = (os.getpid(), config['postgres_cfg'], config['pool_size'], config['pool_timeout'],
+           config['pool_health_check'])
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            warehouse = postgres_warehouse_resource.resource_fn(init_context)
+            pool = ConnectionPool(warehouse.get_connection, lambda connection: connection.close_connection(),
+                                  size=config['pool_size'], timeout=config['pool_timeout'],
+                                  health_check=config['pool_health_check'])
+            atexit.register(pool.close_all)
+            _POOLS[key] = pool
+    return pool
+
+
+@resource(
+    config={
+        'postgres_cfg': Field(String, description='Postgres configuration file'),
+        'pool_size': Field(Int, is_optional=True, default_value=DEFAULT_POOL_SIZE,
+                           description='Maximum number of connections'),
+        'pool_timeout': Field(Float, is_optional=True, default_value=DEFAULT_POOL_TIMEOUT,
+                              description='Seconds to wait for a connection when the pool is full'),
+        'pool_health_check': Field(Bool, is_optional=True, default_value=True,
+                                   description='Check an idle connection (SELECT 1) before lending it'),
+    }
+)
+def pooled_postgres_warehouse_resource(init_context):
+    """
+        postgres_warehouse resource lending pooled connections; reports the pool activity of the run
+        :param init_context: resource initialisation context
+     """
+    pool = connection_pool(init_context)
+    before = pool.stats()
+    try:
+        yield PooledPostgresWarehouse(pool)
+    finally:
+        init_context.log_manager.info(f'Postgres connection pool: {pool_report(pool.stats(), before)}')
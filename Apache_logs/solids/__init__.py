@@ -1,7 +1,9 @@
 from .analyse_apache_nodes import graph1_avg_sessions_by_hour, graph2_avg_bookings_by_hour, \
     graph3_visitor_bookings_pie_charts, graph4_conversion_rate_funnels, \
-    graph6_session_duration, graph7_geo, graph5_bookings_per_day
+    graph6_session_duration, graph7_geo, graph5_bookings_per_day, compute_analysis_frames, \
+    build_analysis_report
 
 __all__ = ['graph1_avg_sessions_by_hour', 'graph2_avg_bookings_by_hour',
            'graph3_visitor_bookings_pie_charts', 'graph4_conversion_rate_funnels',
-           'graph6_session_duration', 'graph7_geo', 'graph5_bookings_per_day']
+           'graph6_session_duration', 'graph7_geo', 'graph5_bookings_per_day', 'compute_analysis_frames',
+           'build_analysis_report']
@@ -0,0 +1,257 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+import pandas as pd
+
+from dagster import (solid, String, Int, Bool, Field, Output, OutputDefinition)
+
+from Apache_logs.engine import DEFAULT_CHUNKSIZE, DEFAULT_SESSION_COOKIE, DEFAULT_SESSION_ID_LENGTH, \
+    find_pending_files, process_apache_files, LOAD_METHOD_COPY, DEFAULT_BATCH_ROWS
+from Apache_logs.solids.load_apache_csv_nodes import insert_sessions, insert_tracking_row
+
+##################################################################################
+#   Backfill of all the pending apache csv files
+#   The files are parsed and aggregated in a process pool,
+#   the uploads to postgres are serialized
+##################################################################################
+
+
+def parse_log_date(value):
+    """
+        Parse a date given as YYYY.MM.DD or YYYY-MM-DD
+        :param value: the date string, may be empty
+        :return: datetime.date, None if value is empty
+     """
+    if value is None or value == '':
+        return None
+    return datetime.strptime(value.replace('-', '.'), '%Y.%m.%d').date()
+
+
+@solid(
+    required_resource_keys={'postgres_warehouse'},
+    config={
+        'date_from': Field(String, is_optional=True, default_value='',
+                           description='First date of logs to load, YYYY.MM.DD'),
+        'date_to': Field(String, is_optional=True, default_value='',
+                         description='Last date of logs to load (inclusive), YYYY.MM.DD'),
+    },
+    output_defs=[
+        OutputDefinition(name='pending_files', is_optional=False),
+    ],
+)
+def find_pending_apache_files(context, file_path: String, filename_pattern):
+    """
+        List the apache csv files not loaded yet, in the date range, oldest first
+        :param context: execution context
+        :param file_path: path to the folder containing the apache csv files
+        :param filename_pattern: the expected format for the apache file names
+        :return: list of dictionaries describing the pending files
+     """
+    if not os.path.exists(file_path):
+        raise ValueError(f'Invalid directory path: {file_path}')
+
+    pending_files = []
+    client = context.resources.postgres_warehouse.get_connection(context)
+    if client is not None:
+        cursor = client.cursor()
+        try:
+            # Files in the date range not loaded yet, with a single apache_tracking lookup
+            pending_files = find_pending_files(cursor, file_path, filename_pattern,
+                                               date_from=parse_log_date(context.solid_config['date_from']),
+                                               date_to=parse_log_date(context.solid_config['date_to']))
+        finally:
+            # tidy up
+            cursor.close()
+            client.close_connection()
+
+    context.log.info(f'{len(pending_files)} apache csv files to load')
+    for f in pending_files:
+        context.log.info(f' {f["name"]}')
+
+    yield Output(pending_files, 'pending_files')
+
+
+@solid(
+    config={
+        'workers': Field(Int, is_optional=True, default_value=0,
+                         description='Number of worker processes, 0 for the number of CPUs'),
+        'chunksize': Field(Int, is_optional=True, default_value=DEFAULT_CHUNKSIZE,
+                           description='Number of log entries read at a time'),
+        'cookie_name': Field(String, is_optional=True, default_value=DEFAULT_SESSION_COOKIE,
+                             description='Name of the cookie holding the session ID'),
+        'session_id_length': Field(Int, is_optional=True, default_value=DEFAULT_SESSION_ID_LENGTH,
+                                   description='Number of characters in the session ID'),
+        'idle_timeout_seconds': Field(Int, is_optional=True, default_value=0,
+                                      description='If set, split the entries without session cookie into sessions '
+                                                  'separated by this inactivity gap, instead of one Unknown_<date> '
+                                                  'session per IP address and day'),
+        'staging_dir': Field(String, is_optional=True, default_value='',
+                             description='Directory for the aggregated frames, the frames of the failed uploads '
+                                         'are kept there. By default a temporary directory, removed after the '
+                                         'upload'),
+    },
+    output_defs=[
+        OutputDefinition(name='parsed_files', is_optional=False),
+    ],
+)
+def parse_apache_files(context, pending_files):
+    """
+        Parse and aggregate the pending apache csv files in a process pool
+        :param context: execution context
+        :param pending_files: list of dictionaries returned by find_pending_apache_files
+        :return: list of per-file results, in date order
+     """
+    staging_dir = context.solid_config['staging_dir']
+    temporary_dir = staging_dir == ''
+    if temporary_dir:
+        staging_dir = tempfile.mkdtemp(prefix='apache_backfill_')
+    else:
+        os.makedirs(staging_dir, exist_ok=True)
+
+    parsed_files = []
+    try:
+        for result in process_apache_files(pending_files, staging_dir,
+                                           workers=context.solid_config['workers'] or None,
+                                           chunksize=context.solid_config['chunksize'],
+                                           cookie_name=context.solid_config['cookie_name'],
+                                           id_length=context.solid_config['session_id_length'],
+                                           idle_timeout=context.solid_config['idle_timeout_seconds']):
+            if result['error'] is None:
+                context.log.info(f'Parsed {result["name"]}: {result["rows"]} records, '
+                                 f'{result["sessions"]} sessions in {result["seconds"]:.1f}s'
+                                 + (f' ({result["split"]}, parse includes the aggregation)'
+                                    if result['split'] else ''))
+            else:
+                context.log.error(f'Failed to parse {result["name"]}: {result["error"]}')
+            # The temporary directory is removed by upload_parsed_files
+            result['temporary_dir'] = staging_dir if temporary_dir else None
+            parsed_files.append(result)
+    except Exception:
+        if temporary_dir:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+    # Upload in date order
+    parsed_files.sort(key=lambda r: (r['log_date'], r['name']))
+
+    yield Output(parsed_files, 'parsed_files')
+
+
+def mark_empty_file(client, csv_file_name):
+    """
+        Mark a csv file without sessions as loaded in the apache_tracking table
+        :param client: postgres connection
+        :param csv_file_name: name of the csv file
+        :return: False if the file is already loaded (or being loaded by another run)
+     """
+    cursor = client.cursor()
+    try:
+        marked = insert_tracking_row(cursor, csv_file_name)
+        client.commit()
+        return marked
+    except Exception:
+        client.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+@solid(
+    required_resource_keys={'postgres_warehouse'},
+    config={
+        'load_method': Field(String, is_optional=True, default_value=LOAD_METHOD_COPY,
+                             description='copy (COPY FROM STDIN) or values (INSERT with execute_values)'),
+        'batch_rows': Field(Int, is_optional=True, default_value=DEFAULT_BATCH_ROWS,
+                            description='Maximum number of rows sent per batch'),
+        'stitch_sessions': Field(Bool, is_optional=True, default_value=False,
+                                 description='Merge sessions across days on (ip_address, session_id), '
+                                             'the tables must be created with session_stitching'),
+    },
+    output_defs=[
+        OutputDefinition(name='backfill_report', is_optional=False),
+    ],
+)
+def upload_parsed_files(context, parsed_files):
+    """
+        Upload the staged frames to postgres one file at a time, and report the outcome of each file
+        A file without sessions is only marked as loaded in apache_tracking, with the status 'empty'
+        A file loaded by another run since it was found pending is not loaded again, with the status 'skipped'
+        The frames of the failed uploads are kept in an explicit staging_dir, the temporary one is removed
+        :param context: execution context
+        :param parsed_files: list of per-file results returned by parse_apache_files
+        :return: list of per-file results with a status
+     """
+    report = []
+    client = None
+    if any(r['error'] is None for r in parsed_files):
+        client = context.resources.postgres_warehouse.get_connection(context)
+
+    try:
+        for result in parsed_files:
+            result = dict(result)
+            if result['error'] is not None:
+                result['status'] = 'parse failed'
+            elif client is None:
+                result['status'] = 'upload failed'
+                result['error'] = 'No postgres connection'
+            else:
+                try:
+                    if result['staged_path'] is not None:
+                        final_df = pd.read_pickle(result['staged_path'])
+                        result['inserted'] = insert_sessions(context, client, final_df, result['name'],
+                                                             load_method=context.solid_config['load_method'],
+                                                             batch_rows=context.solid_config['batch_rows'],
+                                                             stitch_sessions=context.solid_config['stitch_sessions'])
+                        os.remove(result['staged_path'])
+                        # Nothing inserted: the tracking row already existed
+                        result['status'] = 'loaded' if result['inserted'] > 0 else 'skipped'
+                    else:
+                        # No sessions in the file: mark it as loaded so it is not pending any more
+                        result['inserted'] = 0
+                        result['status'] = 'empty' if mark_empty_file(client, result['name']) else 'skipped'
+                except Exception as exc:
+                    result['status'] = 'upload failed'
+                    result['error'] = f'{type(exc).__name__}: {exc}'
+            report.append(result)
+    finally:
+        # tidy up
+        if client is not None:
+            client.close_connection()
+        for temporary_dir in {r.get('temporary_dir') for r in parsed_files} - {None}:
+            shutil.rmtree(temporary_dir, ignore_errors=True)
+
+    for result in report:
+        context.log.info(f'{result["name"]}: {result["status"]}'
+                         + (f' - {result["error"]}' if result['error'] is not None else '')
+                         + (f' (staged in {result["staged_path"]})'
+                            if result['status'] == 'upload failed' and result.get('temporary_dir') is None
+                            and result['staged_path'] is not None else ''))
+    loaded = sum(1 for r in report if r['status'] == 'loaded')
+    empty = sum(1 for r in report if r['status'] == 'empty')
+    skipped = sum(1 for r in report if r['status'] == 'skipped')
+    context.log.info(f'Backfill complete: {loaded} files loaded, {empty} empty, {skipped} skipped (already loaded), '
+                     f'{len(report) - loaded - empty - skipped} failed')
+
+    yield Output(report, 'backfill_report')
@@ -24,22 +24,155 @@
 # import csv
 # import os
 # import io
-# import pandas as pd
+import pandas as pd
 # import re
 # import os.path as path
 # from os import listdir
 # from os.path import isfile, join
 from psycopg2.extras import execute_values
 
-from dagster import (solid, String, Output, OutputDefinition)
+from dagster import (solid, String, Bool, Field, Output, OutputDefinition)
 from dagster_pandas import DataFrame
 
 from db_toolkit.postgres import count_sql
+
+from Apache_logs.engine import SESSION_KEY_INDEX, SESSION_KEY_PARTITIONED_INDEX, PARTITION_COMMENT, \
+    PARTITION_GRANULARITIES, check_granularity, session_partitioning, ensure_session_partitions, \
+    CREATE_ROLLUP_TABLE_SQL, has_rollups, rebuild_rollups, SESSION_COLUMNS, DEFAULT_CUSTOMER_TIMEZONE, \
+    add_customer_time_columns
 ##########################################################
 #   Craete the required apache tables in postgres
 # #########################################################
 
-@solid(required_resource_keys={'postgres_warehouse'})
+# Merge the sessions split across days into one row (the first one loaded), so that the
+# unique (ip_address, session_id) index can be created on a table loaded without session stitching
+merge_split_sessions_SQL = '''WITH merged AS (
+                                SELECT ip_address, session_id, MIN(id) AS keep_id,
+                                       MIN(session_start_time) AS session_start_time,
+                                       MAX(session_end_time) AS session_end_time,
+                                       MIN(first_step) AS first_step,
+                                       MAX(last_step) AS last_step,
+                                       SUM(num_pages_accessed) AS num_pages_accessed
+                                FROM apache_session
+                                GROUP BY ip_address, session_id
+                                HAVING COUNT(*) > 1
+                            )
+                            UPDATE apache_session a
+                            SET session_start_time = m.session_start_time,
+                                session_end_time = m.session_end_time,
+                                session_duration = EXTRACT(EPOCH FROM (m.session_end_time - m.session_start_time))::INT,
+                                first_step = m.first_step,
+                                last_step = m.last_step,
+                                num_pages_accessed = m.num_pages_accessed
+                            FROM merged m
+                            WHERE a.id = m.keep_id
+                            '''
+
+delete_split_sessions_SQL = '''DELETE FROM apache_session a
+                               USING apache_session b
+                               WHERE a.ip_address = b.ip_address
+                               AND a.session_id = b.session_id
+                               AND a.id > b.id
+                            '''
+
+# Columns of the apache_session table
+apache_session_columns_SQL = '''
+            ip_address TEXT   NOT NULL,
+            session_id TEXT   NOT NULL,
+            channel TEXT  NOT NULL,
+            session_start_time TIMESTAMP NOT NULL,
+            session_end_time TIMESTAMP NOT NULL,
+            session_duration INT,     
+            first_step SMALLINT,
+            last_step SMALLINT,
+            num_pages_accessed SMALLINT,
+            continent_code TEXT,
+            country_code TEXT,
+            country_name TEXT,    
+            city_name TEXT,
+            latitude TEXT,
+            longitude TEXT,
+            timezone TEXT'''
+
+# Partitioned layout: range partitions on session_start_time, created by the loader (see engine.partitions)
+# The primary key of a partitioned table must include the partition key
+create_apache_session_partitioned_table_SQL = '''CREATE TABLE IF NOT EXISTS apache_session (
+            id SERIAL,''' + apache_session_columns_SQL + ''',
+            PRIMARY KEY (id, session_start_time)
+            ) PARTITION BY RANGE (session_start_time) '''
+
+# An existing apache_session table is moved into the partitioned layout in one transaction:
+# renamed with its constraint and indexes, copied into the partitions, then dropped
+# The customer time columns are generated again in the partitions, see add_customer_time_columns
+unpartitioned_table = 'apache_session_unpartitioned'
+rename_unpartitioned_table_SQL = [
+    f'ALTER TABLE apache_session RENAME TO {unpartitioned_table}',
+    f'ALTER TABLE {unpartitioned_table} RENAME CONSTRAINT apache_session_pkey TO {unpartitioned_table}_pkey',
+    f'DROP INDEX IF EXISTS idx_apache_session_start',
+    f'DROP INDEX IF EXISTS idx_apache_session_step',
+    f'DROP INDEX IF EXISTS {SESSION_KEY_INDEX}',
+]
+copy_unpartitioned_table_SQL = [
+    f'INSERT INTO apache_session (id, {", ".join(SESSION_COLUMNS)}) '
+    f'SELECT id, {", ".join(SESSION_COLUMNS)} FROM {unpartitioned_table}',
+    f"SELECT setval(pg_get_serial_sequence('apache_session', 'id'), "
+    f"(SELECT COALESCE(MAX(id), 0) + 1 FROM apache_session), false)",
+    f'DROP TABLE {unpartitioned_table}',
+]
+
+
+def create_partitioned_session_table(context, cursor, partition_by):
+    """
+        Create the partitioned apache_session table, or move the existing table into the partitioned layout
+        The caller commits
+        :param context: execution context
+        :param cursor: postgres cursor
+        :param partition_by: partition granularity, day or month
+     """
+    cursor.execute("SELECT to_regclass('apache_session') IS NOT NULL")
+    exists = cursor.fetchone()[0]
+    granularity = session_partitioning(cursor) if exists else None
+    if granularity is not None:
+        if granularity != partition_by:
+            raise ValueError(f'apache_session is already partitioned by {granularity}, not by {partition_by}')
+        context.log.info(f'apache_session is partitioned by {granularity}')
+        return
+
+    if exists:
+        context.log.info(f'Moving apache_session into the partitioned layout')
+        for sql in rename_unpartitioned_table_SQL:
+            cursor.execute(sql)
+
+    context.log.info(f'{create_apache_session_partitioned_table_SQL}')
+    cursor.execute(create_apache_session_partitioned_table_SQL)
+    cursor.execute(f"COMMENT ON TABLE apache_session IS '{PARTITION_COMMENT.format(granularity=partition_by)}'")
+
+    if exists:
+        cursor.execute(f'SELECT DISTINCT date_trunc(%s, session_start_time) FROM {unpartitioned_table}',
+                       (partition_by,))
+        days = pd.Series([row[0] for row in cursor.fetchall()], dtype='datetime64[ns]')
+        created = ensure_session_partitions(cursor, days, partition_by, log=context.log)
+        for sql in copy_unpartitioned_table_SQL:
+            cursor.execute(sql)
+        context.log.info(f'Moved the sessions into {len(created)} partitions')
+
+
+@solid(
+    required_resource_keys={'postgres_warehouse'},
+    config={
+        'session_stitching': Field(Bool, is_optional=True, default_value=False,
+                                   description='Create the unique (ip_address, session_id) index used to '
+                                               'merge sessions across days (upload_to_postgres stitch_sessions)'),
+        'partition_by': Field(String, is_optional=True, default_value='',
+                              description=f'Range partitioning of apache_session on session_start_time, one of '
+                                          f'{PARTITION_GRANULARITIES}, empty for a single table. An existing '
+                                          f'table is moved into the partitions'),
+        'customer_timezone': Field(String, is_optional=True, default_value=DEFAULT_CUSTOMER_TIMEZONE,
+                                   description='IANA timezone of the customer date and hour columns of '
+                                               'apache_session, e.g. Pacific/Auckland. A new timezone '
+                                               'regenerates the columns and the rollup'),
+    }
+)
 def create_postgres_tables(context):
     client = context.resources.postgres_warehouse.get_connection(context)
 
@@ -59,6 +192,18 @@ def create_postgres_tables(context):
             cursor.execute(create_apache_tracking_table_SQL)
             client.commit()
 
+            # Byte offset reached in each file loaded in follow mode (see apache_follow)
+            create_apache_follow_checkpoint_table_SQL = """CREATE TABLE IF NOT EXISTS apache_follow_checkpoint
+            (
+                loaded_file text PRIMARY KEY,
+                byte_offset bigint NOT NULL,
+                last_line text,
+                num_lines bigint NOT NULL,
+                updated_date timestamp
+            )            """
+            cursor.execute(create_apache_follow_checkpoint_table_SQL)
+            client.commit()
+
             create_bs_table_query = """CREATE TABLE IF NOT EXISTS booking_step (
             step_number integer NOT NULL,
             step_name text NOT NULL,
@@ -99,23 +244,7 @@ def create_postgres_tables(context):
             # create table
 
             create_apache_session_table_SQL = '''CREATE TABLE IF NOT EXISTS apache_session (
-            id SERIAL PRIMARY KEY,
-            ip_address TEXT   NOT NULL,
-            session_id TEXT   NOT NULL,
-            channel TEXT  NOT NULL,
-            session_start_time TIMESTAMP NOT NULL,
-            session_end_time TIMESTAMP NOT NULL,
-            session_duration INT,     
-            first_step SMALLINT,
-            last_step SMALLINT,
-            num_pages_accessed SMALLINT,
-            continent_code TEXT,
-            country_code TEXT,
-            country_name TEXT,    
-            city_name TEXT,
-            latitude TEXT,
-            longitude TEXT,
-            timezone TEXT
+            id SERIAL PRIMARY KEY,''' + apache_session_columns_SQL + '''
             ) '''
             ############################################################################################################
             #   Removed  CONSTRAINT UK_apache_session UNIQUE(ip_address,session_id) due to UK violation
@@ -124,8 +253,21 @@ def create_postgres_tables(context):
             # Also
             ############################################################################################################
 
-            context.log.info(f'{create_apache_session_table_SQL}')
-            cursor.execute(create_apache_session_table_SQL)
+            partition_by = context.solid_config['partition_by']
+            if partition_by:
+                # One partition per day or month, the indexes below are created on each partition
+                create_partitioned_session_table(context, cursor, check_granularity(partition_by))
+            else:
+                context.log.info(f'{create_apache_session_table_SQL}')
+                cursor.execute(create_apache_session_table_SQL)
+            client.commit()
+            partitioned = session_partitioning(cursor) is not None
+            merged = False
+
+            # Customer date and hour, generated at load time in the customer timezone, and their indexes
+            # for the groupings by hour and by day
+            regenerated = add_customer_time_columns(cursor, context.solid_config['customer_timezone'],
+                                                    log=context.log)
             client.commit()
 
             create_apache_index1_SQL =  '''  CREATE INDEX IF NOT EXISTS idx_apache_session_start
@@ -142,6 +284,38 @@ def create_postgres_tables(context):
             cursor.execute(create_apache_index2_SQL)
             client.commit()
 
+            if context.solid_config['session_stitching']:
+                # Sessions across midnight are merged at load time: one row per (ip_address, session_id)
+                # The constraint was removed when each file was loaded independently (see above)
+                # A partitioned table cannot have this unique index (it must include session_start_time):
+                # the sessions are merged on a plain index instead, see upsert_sessions
+                session_key_index = SESSION_KEY_PARTITIONED_INDEX if partitioned else SESSION_KEY_INDEX
+                cursor.execute('SELECT 1 FROM pg_indexes WHERE indexname = %s', (session_key_index,))
+                if cursor.fetchone() is None:
+                    # First time: merge the sessions already split across days
+                    cursor.execute(merge_split_sessions_SQL)
+                    context.log.info(f'Merged {cursor.rowcount} sessions split across days')
+                    cursor.execute(delete_split_sessions_SQL)
+                    context.log.info(f'Deleted {cursor.rowcount} duplicate session rows')
+                    merged = True
+
+                    create_apache_index3_SQL = f'''CREATE {'' if partitioned else 'UNIQUE '}INDEX IF NOT EXISTS
+                                                    {session_key_index} ON apache_session(ip_address, session_id)
+                                                '''
+                    context.log.info(f'{create_apache_index3_SQL}')
+                    cursor.execute(create_apache_index3_SQL)
+                    client.commit()
+
+            # Rollup of apache_session read by the graph solids, maintained by the loaders
+            # It is built from the sessions already loaded when it is created, after merging the split sessions,
+            # or when the customer timezone changes
+            rollups = has_rollups(cursor)
+            context.log.info(f'{CREATE_ROLLUP_TABLE_SQL}')
+            cursor.execute(CREATE_ROLLUP_TABLE_SQL)
+            if not rollups or merged or regenerated:
+                context.log.info(f'Built {rebuild_rollups(cursor)} rollup rows from apache_session')
+            client.commit()
+
         finally:
             # tidy up
             cursor.close()
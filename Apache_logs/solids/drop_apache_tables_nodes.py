@@ -32,10 +32,15 @@
 
 from psycopg2.extras import execute_values
 
-from dagster import (solid, String, Output, OutputDefinition)
+from dagster import (solid, String, Field, Output, OutputDefinition)
 from dagster_pandas import DataFrame
 
 from db_toolkit.postgres import count_sql
+
+from Apache_logs.engine import session_partitioning, list_session_partitions, drop_session_partitions
+from Apache_logs.solids.backfill_apache_nodes import parse_log_date
+
+
 @solid(required_resource_keys={'postgres_warehouse'})
 def drop_postgres_tables(context):
     client = context.resources.postgres_warehouse.get_connection(context)
@@ -51,11 +56,28 @@ def drop_postgres_tables(context):
             cursor.execute(drop_apache_tracking_table_SQL)
             client.commit()
 
+            drop_apache_follow_checkpoint_table_SQL = """DROP TABLE IF EXISTS apache_follow_checkpoint"""
+            context.log.info(f'{drop_apache_follow_checkpoint_table_SQL}')
+            cursor.execute(drop_apache_follow_checkpoint_table_SQL)
+            client.commit()
+
+            drop_apache_session_rollup_table_SQL = """DROP TABLE IF EXISTS apache_session_rollup"""
+            context.log.info(f'{drop_apache_session_rollup_table_SQL}')
+            cursor.execute(drop_apache_session_rollup_table_SQL)
+            client.commit()
+
             drop_booking_step_table_SQL= """DROP TABLE IF EXISTS booking_step"""
             context.log.info(f'{drop_booking_step_table_SQL}')
             cursor.execute(drop_booking_step_table_SQL)
             client.commit()
 
+            # The partitions of a partitioned apache_session are dropped with it
+            granularity = session_partitioning(cursor)
+            if granularity is not None:
+                partitions = list_session_partitions(cursor)
+                context.log.info(f'apache_session is partitioned by {granularity}, '
+                                 f'dropping its {len(partitions)} partitions')
+
             drop_apache_session_table_SQL = '''DROP TABLE IF EXISTS apache_session  '''
             context.log.info(f'{drop_apache_session_table_SQL}')
             cursor.execute(drop_apache_session_table_SQL)
@@ -64,4 +86,43 @@ def drop_postgres_tables(context):
         finally:
             # tidy up
             cursor.close()
-            client.close_connection()
\ No newline at end of file
+            client.close_connection()
+
+
+@solid(
+    required_resource_keys={'postgres_warehouse'},
+    config={
+        'before': Field(String, is_optional=False,
+                        description='Retire the sessions started before this date, YYYY.MM.DD'),
+    },
+    output_defs=[
+        OutputDefinition(name='dropped_partitions', is_optional=False),
+    ],
+)
+def retire_apache_sessions(context):
+    """
+        Retire the old sessions of a partitioned apache_session table by dropping their partitions
+        A partition is only dropped if all of it is before the date, no row is deleted one by one
+        :param context: execution context
+        :return: list of the dropped partitions
+     """
+    before = parse_log_date(context.solid_config['before'])
+    dropped = []
+
+    client = context.resources.postgres_warehouse.get_connection(context)
+    if client is not None:
+        cursor = client.cursor()
+        try:
+            if session_partitioning(cursor) is None:
+                raise ValueError('apache_session is not partitioned, create the tables with partition_by '
+                                 'to retire the old sessions by partition')
+            dropped = drop_session_partitions(cursor, before, log=context.log)
+            client.commit()
+        finally:
+            # tidy up
+            cursor.close()
+            client.close_connection()
+
+    context.log.info(f'Dropped {len(dropped)} partitions of sessions before {before}')
+
+    yield Output(dropped, 'dropped_partitions')
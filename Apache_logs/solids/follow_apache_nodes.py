@@ -0,0 +1,110 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import os
+
+from dagster import (solid, String, Int, Field, Output, OutputDefinition)
+
+from Apache_logs.engine import DEFAULT_SESSION_COOKIE, DEFAULT_SESSION_ID_LENGTH, LOAD_METHOD_COPY, \
+    DEFAULT_BATCH_ROWS, DEFAULT_FOLLOW_MAX_BYTES, discover_apache_files, file_compression, fetch_checkpoints, \
+    follow_apache_file
+
+##################################################################################
+#   Follow mode: load the lines appended to the current apache csv file during the day
+#   Each poll merges the new sessions into apache_session and moves the byte offset
+#   checkpoint in the same transaction, a restart resumes from the checkpoint
+##################################################################################
+
+
+@solid(
+    required_resource_keys={'postgres_warehouse'},
+    config={
+        'cookie_name': Field(String, is_optional=True, default_value=DEFAULT_SESSION_COOKIE,
+                             description='Name of the cookie holding the session ID'),
+        'session_id_length': Field(Int, is_optional=True, default_value=DEFAULT_SESSION_ID_LENGTH,
+                                   description='Number of characters in the session ID'),
+        'max_bytes': Field(Int, is_optional=True, default_value=DEFAULT_FOLLOW_MAX_BYTES,
+                           description='Maximum number of bytes read from a file by one poll'),
+        'load_method': Field(String, is_optional=True, default_value=LOAD_METHOD_COPY,
+                             description='copy (COPY FROM STDIN) or values (INSERT with execute_values)'),
+        'batch_rows': Field(Int, is_optional=True, default_value=DEFAULT_BATCH_ROWS,
+                            description='Maximum number of rows sent per batch'),
+    },
+    output_defs=[
+        OutputDefinition(name='follow_report', is_optional=False),
+    ],
+)
+def follow_apache_csv(context, file_path: String, filename_pattern):
+    """
+        Poll the latest apache csv file, and the followed files which grew since their checkpoint
+        (the end of the previous day's file is written after midnight)
+        The sessions are merged on (ip_address, session_id): the tables must be created with session_stitching
+        :param context: execution context
+        :param file_path: path to the folder containing the apache csv files
+        :param filename_pattern: the expected format for the apache file names
+        :return: list of per-file results
+     """
+    if not os.path.exists(file_path):
+        raise ValueError(f'Invalid directory path: {file_path}')
+
+    report = []
+    client = context.resources.postgres_warehouse.get_connection(context)
+    if client is not None:
+        cursor = client.cursor()
+        try:
+            # A compressed file is rotated, it does not grow any more
+            apache_files = [f for f in discover_apache_files(file_path, filename_pattern)
+                            if file_compression(f['path']) is None]
+            checkpoints = fetch_checkpoints(cursor)
+            client.commit()
+
+            followed_files = [f for f in apache_files[:-1]
+                              if f['name'] in checkpoints and os.path.getsize(f['path']) > checkpoints[f['name']]]
+            followed_files += apache_files[-1:]
+
+            for apache_file in followed_files:
+                # One transaction per file: the sessions and the checkpoint move together
+                try:
+                    result = follow_apache_file(cursor, apache_file['path'], apache_file['file_date'],
+                                                cookie_name=context.solid_config['cookie_name'],
+                                                id_length=context.solid_config['session_id_length'],
+                                                max_bytes=context.solid_config['max_bytes'],
+                                                load_method=context.solid_config['load_method'],
+                                                batch_rows=context.solid_config['batch_rows'],
+                                                log=context.log)
+                    client.commit()
+                except Exception as exc:
+                    client.rollback()
+                    result = {'name': apache_file['name'], 'status': 'failed',
+                              'error': f'{type(exc).__name__}: {exc}'}
+                    context.log.error(f'Failed to follow {apache_file["name"]}: {result["error"]}')
+                report.append(result)
+
+                if result['status'] == 'loaded':
+                    context.log.info(f'{apache_file["name"]} is already loaded by the daily load, not followed')
+        finally:
+            # tidy up
+            cursor.close()
+            client.close_connection()
+
+    if len(report) == 0:
+        context.log.info(f'There is no apache csv file to follow')
+
+    yield Output(report, 'follow_report')
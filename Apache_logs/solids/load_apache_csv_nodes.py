@@ -32,23 +32,148 @@ from os.path import isfile, join
 from psycopg2.extras import execute_values
 
 from datetime import *
+from time import perf_counter
+from contextlib import contextmanager
 
-from dagster import (solid, String, Output, OutputDefinition)
+from dagster import (solid, String, Int, Bool, Field, Output, OutputDefinition)
 from dagster_pandas import DataFrame
 
-from db_toolkit.postgres import count_sql
+from Apache_logs.engine import DEFAULT_SESSION_COOKIE, DEFAULT_SESSION_ID_LENGTH, extract_session_ids, \
+    sessionize_by_inactivity, \
+    classify_url_paths, aggregate_sessions, AGGREGATION_ENGINE_GROUPBY, \
+    AGGREGATION_ENGINE_REDUCEAT, AGGREGATION_ENGINES, aggregate_sessions_reduceat, DEFAULT_CHUNKSIZE, \
+    stream_session_aggregates, \
+    add_session_duration, final_session_frame, find_pending_files, \
+    LOAD_METHOD_COPY, DEFAULT_BATCH_ROWS, load_sessions, DEFAULT_FRAME_CACHE_MAX_BYTES, FrameCache, \
+    APACHE_SCHEMA_VERSION, frame_memory_report, upsert_sessions, fused_session_frame, measure_run, run_summary, \
+    shared_frame_path, share_columns, attach_columns, release_columns, LOG_FORMAT_CSV, LOG_FORMAT_ACCESS_LOG, \
+    GeoLookup, read_apache_log, decompress_parse_split
 
 ##################################################################################
 #   1. Extract the apache logs csv file and load its contents to a Pandas dataframe
 ##################################################################################
 
-#  A subset of the column from the source file are loaded
-# The following columns are in the source file but will not be loaded:
-# customer, env
-# These must be in the csv , they prove that the data is from the correct system (production)
-# and for the correct customer (pal)
+def find_apache_file_to_load(context, file_path, filename_pattern):
+    """
+        Scan the directory passed as input for files matching the expected name pattern
+        and return the oldest matching file that has not already been loaded to postgres
+        The loaded files are looked up in the apache_tracking table with a single query
+        :param context: execution context
+        :param file_path: path to the folder containing the apache csv files
+        :param filename_pattern: the expected format for the apache file names
+        :return: tuple (file name, file date, file path), the name and path are 'None' if there is no file to load
+     """
+
+    # Verify the file path exists
+    if not path.exists(file_path):
+        raise ValueError(f'Invalid directory path: {file_path}')
+
+    file_name_to_load = 'None'
+    file_path_to_load = 'None'
+    file_date = 'na'
+
+    client = context.resources.postgres_warehouse.get_connection(context)
+    if client is not None:
+        cursor = client.cursor()
+        try:
+            # Files matching the pattern and not loaded yet, sorted by date
+            pending_files = find_pending_files(cursor, file_path, filename_pattern)
+        finally:
+            # tidy up
+            cursor.close()
+            client.close_connection()
+
+        context.log.info(f'{len(pending_files)} apache csv files to load')
+
+        # Load the oldest file that was not loaded already
+        if len(pending_files) > 0:
+            file_name_to_load = pending_files[0]['name']
+            file_path_to_load = pending_files[0]['path']
+            file_date = pending_files[0]['file_date']
+
+    context.log.info(f'The following csv file will be loaded: {file_path_to_load }')
+
+    return file_name_to_load, file_date, file_path_to_load
+
+
+# Configuration of the solids parsing the apache file
+LOAD_APACHE_CSV_CONFIG = {
+    'use_frame_cache': Field(Bool, is_optional=True, default_value=False,
+                             description='Reuse the parsed frame of a csv file parsed in a previous run, '
+                                         'the cache uses up to frame_cache_max_bytes of frame_cache_dir'),
+    'frame_cache_dir': Field(String, is_optional=True, default_value='',
+                             description='Frame cache directory, default: $APACHE_FRAME_CACHE_DIR '
+                                         'or ~/.cache/apache_logs/frames'),
+    'frame_cache_max_bytes': Field(Int, is_optional=True, default_value=DEFAULT_FRAME_CACHE_MAX_BYTES,
+                                   description='Disk budget of the frame cache'),
+    'log_format': Field(String, is_optional=True, default_value=LOG_FORMAT_CSV,
+                        description='csv (export with the geoip columns) or access_log (raw apache access log, '
+                                    'see Apache_logs.engine.access_log.ACCESS_LOG_FORMAT)'),
+    'geo_lookup_file': Field(String, is_optional=True, default_value='',
+                             description='access_log format: csv table of IPv4 ranges filling the geo columns'),
+}
+
+
+@contextmanager
+def logged_run(context, step):
+    """
+        Measure the wall time and the peak memory of a step of the fine-grained pipeline and log them
+        The memory is the change of the resident memory of the process during the step,
+        as logged by fused_apache_csv_sessions without trace_memory
+        :param context: execution context
+        :param step: description of the step, starting the log line
+        :return: dict filled by measure_run when the block exits
+     """
+    with measure_run(trace_memory=False) as run:
+        yield run
+    context.log.info(f'{step} {run_summary(run)}')
+
+
+def parse_apache_file(context, file_path_to_load):
+    """
+        Parse an apache file into a panda DataFrame, through the frame cache if enabled
+        :param context: execution context of a solid with the LOAD_APACHE_CSV_CONFIG config
+        :param file_path_to_load: path of the file
+        :return: panda DataFrame
+     """
+    # A raw access log is parsed into the same columns as the csv export
+    log_format = context.solid_config['log_format']
+    geo_lookup_file = context.solid_config['geo_lookup_file']
+    geo_lookup = GeoLookup.from_csv(geo_lookup_file) if log_format == LOG_FORMAT_ACCESS_LOG and geo_lookup_file \
+        else None
+
+    # Decompression time of a .gz or .zst file
+    stats = {}
+
+    def parse(parse_path):
+        return read_apache_log(parse_path, log_format=log_format, geo_lookup=geo_lookup, stats=stats)
+
+    start = perf_counter()
+    # The frame parsed by a previous run is memory-mapped from the frame cache if the file did not change
+    if context.solid_config['use_frame_cache']:
+        # The parsed frame also depends on the format and the geo table
+        version = '|'.join([APACHE_SCHEMA_VERSION, log_format, geo_lookup_file] +
+                           ([str(path.getmtime(geo_lookup_file))] if geo_lookup is not None else []))
+        frame_cache = FrameCache(context.solid_config['frame_cache_dir'],
+                                 context.solid_config['frame_cache_max_bytes'],
+                                 version=version)
+        df = frame_cache.get_or_parse(file_path_to_load, parse, log=context.log)
+    else:
+        df = parse(file_path_to_load)
+    seconds = perf_counter() - start
+
+    context.log.info(f'Loaded {len(df)} records into the apache data frame in {seconds:.2f}s '
+                     f'({len(df) / seconds if seconds > 0 else 0:,.0f} records/sec)')
+    split = decompress_parse_split(stats, seconds)
+    if split:
+        context.log.info(f' {split}')
+    for line in frame_memory_report(df):
+        context.log.info(f' {line}')
+    return df
+
 
 @solid(
+    config=LOAD_APACHE_CSV_CONFIG,
     output_defs=[
         OutputDefinition(dagster_type=String, name='apache_file_name_to_load', is_optional=False),
         OutputDefinition(dagster_type=String, name='apache_file_date', is_optional=False),
@@ -67,144 +192,250 @@ def load_apache_csv (context, file_path: String, filename_pattern ):
         :return: panda DataFrame
      """
 
-    # Function to determnine if a file name matches the input file pattern
-    def match_pattern (filename, pattern):
-        regex = re.compile(pattern)
-        match = regex.search(filename)
-        if match:
-            return True
-        else:
-            return False
+    # Start of the load_apache_csv logic
+    file_name_to_load, file_date, file_path_to_load = find_apache_file_to_load(context, file_path, filename_pattern)
 
-    # Function to extract the date from the csv file
-    def apache_file_date (filename):
-        if filename is not None:
-            return filename[20:31]
-        else:
-            return 'na'
+    if file_name_to_load == 'None':
+        # Return an empty dataframe if there is no file to load
+        df = pd.DataFrame()
+        context.log.info(f'There is no apache csv file to load')
+        context.log.info(f'Exit the load_apache_csv solid')
+    else :
+        # If a file is ready to load , read it into a dataframe
+        with logged_run(context, f'Loaded {file_name_to_load}'):
+            df = parse_apache_file(context, file_path_to_load)
 
-    # Function to determine if a file was already loaded
-    # The input file is a dictionary
-    def is_file_loaded (file):
-        client = context.resources.postgres_warehouse.get_connection(context)
-        if client is not None:
-            file_name = file['name']
-            cursor = client.cursor()
-            try:
-                select_apache_tracking_query =  " SELECT COUNT(loaded_file) FROM apache_tracking WHERE loaded_file ='"  +  file_name + "'"
+    yield Output(file_name_to_load, 'apache_file_name_to_load')
+    yield Output(file_date, 'apache_file_date')
+    yield Output(df, 'apache_df')
 
-                cursor.execute(select_apache_tracking_query )
+##################################################################################
+#   1b. Streaming mode: read the apache logs csv file in chunks and aggregate
+#       each chunk by session, the file is never held in memory as a whole
+#       This replaces steps 1 to 6 below
+##################################################################################
 
-                # Return the first value in the tuple
-                is_file_loaded = cursor.fetchone()[0]
+@solid(
+    config={
+        'chunksize': Field(Int, is_optional=True, default_value=DEFAULT_CHUNKSIZE,
+                           description='Number of log entries read at a time'),
+        'cookie_name': Field(String, is_optional=True, default_value=DEFAULT_SESSION_COOKIE,
+                             description='Name of the cookie holding the session ID'),
+        'session_id_length': Field(Int, is_optional=True, default_value=DEFAULT_SESSION_ID_LENGTH,
+                                   description='Number of characters in the session ID'),
+        'idle_timeout_seconds': Field(Int, is_optional=True, default_value=0,
+                                      description='If set, split the entries without session cookie into sessions '
+                                                  'separated by this inactivity gap, instead of one Unknown_<date> '
+                                                  'session per IP address and day'),
+    },
+    output_defs=[
+        OutputDefinition(dagster_type=String, name='apache_file_name_to_load', is_optional=False),
+        OutputDefinition(dagster_type=String, name='apache_file_date', is_optional=False),
+        OutputDefinition(dagster_type=DataFrame, name='agg_df', is_optional=False),
+    ],
+)
+def stream_apache_csv_sessions (context, file_path: String, filename_pattern ):
+    """
+        Stream the first apache csv file not already loaded to postgres and aggregate it by session
+        Each chunk is aggregated by session and the partial aggregates are merged, the output is identical
+        to the aggregate_df_by_session output
+        :param context: execution context
+        :param path: path to the folder containing the apache csv files
+        :param filename_pattern: the expected format for the apache file names
+        :return: panda DataFrame aggregated by session
+     """
 
-                if (is_file_loaded == 1):
-                    return True
-                else:
-                    return False
+    file_name_to_load, file_date, file_path_to_load = find_apache_file_to_load(context, file_path, filename_pattern)
 
-            finally:
-                # tidy up
-                cursor.close()
-                client.close_connection()
+    if file_name_to_load == 'None':
+        # Return an empty dataframe if there is no file to load
+        agg_df = pd.DataFrame()
+        context.log.info(f'There is no apache csv file to load')
+        context.log.info(f'Exit the stream_apache_csv_sessions solid')
+    else :
+        stats = {}
+        start = perf_counter()
+        agg_df, rows = stream_session_aggregates(file_path_to_load, file_date,
+                                                 chunksize=context.solid_config['chunksize'],
+                                                 cookie_name=context.solid_config['cookie_name'],
+                                                 id_length=context.solid_config['session_id_length'],
+                                                 idle_timeout=context.solid_config['idle_timeout_seconds'],
+                                                 log=context.log, stats=stats)
+        context.log.info(f'Aggregated {rows} records into {len(agg_df)} sessions')
+        split = decompress_parse_split(stats, perf_counter() - start)
+        if split:
+            context.log.info(f' {split} (parse includes the aggregation)')
 
-    # Start of the load_apache_csv logic
-    # Verify the file path exists
-    if not path.exists(file_path):
-        raise ValueError(f'Invalid directory path: {file_path}')
+    yield Output(file_name_to_load, 'apache_file_name_to_load')
+    yield Output(file_date, 'apache_file_date')
+    yield Output(agg_df, 'agg_df')
 
-    # Get the list of files
-    all_files = [{'name': f, 'path': join(file_path, f)}
-                 for f in listdir(file_path)
-                 if isfile(join(file_path, f)) ]
+##################################################################################
+#   1c. Fused mode: parse, derive, aggregate and finalize the sessions in one solid
+#       Only the columns used downstream are read and no intermediate frame is copied
+#       This replaces steps 1 to 8 below, which remain available for debugging
+##################################################################################
 
-    context.log.info(f' List of files in the directory')
-    context.log.info(f' {all_files}')
+@solid(
+    config={
+        'cookie_name': Field(String, is_optional=True, default_value=DEFAULT_SESSION_COOKIE,
+                             description='Name of the cookie holding the session ID'),
+        'session_id_length': Field(Int, is_optional=True, default_value=DEFAULT_SESSION_ID_LENGTH,
+                                   description='Number of characters in the session ID'),
+        'idle_timeout_seconds': Field(Int, is_optional=True, default_value=0,
+                                      description='If set, split the entries without session cookie into sessions '
+                                                  'separated by this inactivity gap, instead of one Unknown_<date> '
+                                                  'session per IP address and day'),
+        'trace_memory': Field(Bool, is_optional=True, default_value=False,
+                              description='Report the peak memory traced while processing the file (slower), '
+                                          'instead of the change of the resident memory of the process'),
+    },
+    output_defs=[
+        OutputDefinition(dagster_type=String, name='apache_file_name_to_load', is_optional=False),
+        OutputDefinition(dagster_type=String, name='apache_file_date', is_optional=False),
+        OutputDefinition(dagster_type=DataFrame, name='final_df', is_optional=False),
+    ],
+)
+def fused_apache_csv_sessions (context, file_path: String, filename_pattern ):
+    """
+        Process the first apache csv file not already loaded to postgres in one step
+        The output is identical to the create_final_df output of the csv_to_postgres_pipeline
+        :param context: execution context
+        :param path: path to the folder containing the apache csv files
+        :param filename_pattern: the expected format for the apache file names
+        :return: panda DataFrame with the apache_session columns
+     """
 
-    # Go through the files in the data directory to find the next file to load
-    # load the first file that was not loaded already
+    file_name_to_load, file_date, file_path_to_load = find_apache_file_to_load(context, file_path, filename_pattern)
 
-    file_name_to_load = 'None'
-    file_path_to_load = 'None'
+    if file_name_to_load == 'None':
+        # Return an empty dataframe if there is no file to load
+        final_df = pd.DataFrame()
+        context.log.info(f'There is no apache csv file to load')
+        context.log.info(f'Exit the fused_apache_csv_sessions solid')
+    else :
+        stats = {}
+        with measure_run(trace_memory=context.solid_config['trace_memory']) as run:
+            final_df, rows = fused_session_frame(file_path_to_load, file_date,
+                                                 cookie_name=context.solid_config['cookie_name'],
+                                                 id_length=context.solid_config['session_id_length'],
+                                                 idle_timeout=context.solid_config['idle_timeout_seconds'],
+                                                 stats=stats)
+        context.log.info(f'Processed {rows} records into {len(final_df)} sessions {run_summary(run)}')
+        split = decompress_parse_split(stats, run['seconds'])
+        if split:
+            context.log.info(f' {split} (parse includes the session derivation)')
 
-    for f in all_files:
-            print('for loop- file:', f)
-            filename = f['name']
-            file_date = apache_file_date(filename)
-            filepath= f['path']
-            if match_pattern(filename, filename_pattern):
-                    # The curent file in the list is in the correct format
-                    # Check if it is already loaded
-                    if not is_file_loaded (f):
-                        found_a_file=True
-                        file_path_to_load= filepath
-                        file_name_to_load= filename
-                        print('file_to_load=', file_path_to_load)
-                        break
-            else:
-                print(f'The file {filename} does not match the apache file pattern')
+    yield Output(file_name_to_load, 'apache_file_name_to_load')
+    yield Output(file_date, 'apache_file_date')
+    yield Output(final_df, 'final_df')
 
-    context.log.info(f'The following csv file will be loaded: {file_path_to_load }')
+##################################################################################
+#   1d. Parallel mode: write the parsed frame once to a memory-mapped file, the next
+#       solids attach to the columns they read instead of receiving (and unpickling)
+#       the whole apache_df in each worker
+##################################################################################
+
+@solid(
+    config=dict(LOAD_APACHE_CSV_CONFIG, **{
+        'shared_dir': Field(String, is_optional=True, default_value='',
+                            description='Directory of the shared columns, default: /dev/shm or the temp directory'),
+    }),
+    output_defs=[
+        OutputDefinition(dagster_type=String, name='apache_file_name_to_load', is_optional=False),
+        OutputDefinition(dagster_type=String, name='apache_file_date', is_optional=False),
+        OutputDefinition(dagster_type=String, name='shared_path', is_optional=False),
+    ],
+)
+def load_shared_apache_csv(context, file_path: String, filename_pattern):
+    """
+        Load a csv file as load_apache_csv, and write it to a memory-mappable file instead of
+        returning the DataFrame: only the path is passed to the next solids
+        The file is removed by the caller of the pipeline, once the run is over
+        :param context: execution context
+        :param file_path: path to the folder containing the apache csv files
+        :param filename_pattern: the expected format for the apache file names
+        :return: path of the shared frame, 'None' if there is no apache csv file to process
+     """
+    file_name_to_load, file_date, file_path_to_load = find_apache_file_to_load(context, file_path, filename_pattern)
 
     if file_name_to_load == 'None':
-        # Return an empty dataframe if there is no file to load
-        df = pd.DataFrame()
+        shared_path = 'None'
         context.log.info(f'There is no apache csv file to load')
-        context.log.info(f'Exit the load_apache_csv solid')
-    else :
-        # If a file is ready to load , read it into a dataframe
-        df = pd.read_csv (file_path_to_load ,
-                      parse_dates=['@timestamp'],
-                      sep=',',
-                      usecols=["@timestamp","_id","url_path","referer","geoip.ip","cookie",
-                               "user_agent_string","geoip.city_name","geoip.country_code2",
-                               "geoip.country_name","geoip.continent_code","geoip.latitude",
-                               "geoip.longitude","geoip.timezone","http_method","response_code",
-                               "response_size_bytes","response_time_microseconds"])
-
-        df['@timestamp'] = pd.to_datetime (df['@timestamp'])
-        context.log.info(f'Loaded {len(df)} records into the apache data frame')
+        context.log.info(f'Exit the load_shared_apache_csv solid')
+    else:
+        df = parse_apache_file(context, file_path_to_load)
+
+        # Files left over by crashed runs are removed first
+        release_columns(shared_dir=context.solid_config['shared_dir'])
+        shared_path = share_columns(df, shared_frame_path(context.run_id, context.solid_config['shared_dir']))
+        context.log.info(f'Shared the apache data frame in {shared_path}')
 
     yield Output(file_name_to_load, 'apache_file_name_to_load')
     yield Output(file_date, 'apache_file_date')
-    yield Output(df, 'apache_df')
+    yield Output(shared_path, 'shared_path')
+
+
+def derivation_input(apache_df, columns, decode_strings=False):
+    """
+        Input frame of a solid: the apache DataFrame, or the columns shared by load_shared_apache_csv
+        :param apache_df: panda DataFrame, or path of the shared frame
+        :param columns: columns needed by the solid, None for all
+        :param decode_strings: return the shared string columns as object instead of categorical
+        :return: panda DataFrame
+     """
+    if isinstance(apache_df, str):
+        if apache_df == 'None':
+            return pd.DataFrame()
+        return attach_columns(apache_df, columns, decode_strings=decode_strings)
+    return apache_df
 
 # ###############################################################
 # #  2.  Populate a new session column using the 'cookie' column
 # ###############################################################
 
-# This lambda function applies the session_id column to each row in the data frame
+# The session ID is extracted in one vectorized pass over the cookie column
+# The name of the cookie carrying the session ID can be changed in the solid config
 
-@solid
+@solid(
+    config={
+        'cookie_name': Field(String, is_optional=True, default_value=DEFAULT_SESSION_COOKIE,
+                             description='Name of the cookie holding the session ID'),
+        'session_id_length': Field(Int, is_optional=True, default_value=DEFAULT_SESSION_ID_LENGTH,
+                                   description='Number of characters in the session ID'),
+        'idle_timeout_seconds': Field(Int, is_optional=True, default_value=0,
+                                      description='If set, split the entries without session cookie into sessions '
+                                                  'separated by this inactivity gap, instead of one Unknown_<date> '
+                                                  'session per IP address and day'),
+    }
+)
 def create_session_col(context,  apache_df, csv_file_date ) -> DataFrame:
     """
-            Takes the initial panda DataFrame as input
+            Takes the initial panda DataFrame (or the columns shared by load_shared_apache_csv) as input
             The solid will calculate the session_id based on a regular expression on the
             complex cookie column
             :param context: execution context
             :param apache pandas DataFrame
             :return: a dataframe containing one column with the session ID
          """
-
-    # Function takes an element from column cookie and extracts the session_id
-    def session_id(one_cookie):
-        regexp = r'JSESSIONID=\w{32}'
-        if 'JSESSIONID=' in one_cookie:
-            # Take the first occurence of the regexp and then take the ID from the string
-            session_id_list = re.findall(regexp, one_cookie)
-            session_id = session_id_list[0][11:43]
-            return session_id
-        else:
-            # To avoid duplicate issues when loading data for multiple day, unknow values
-            # for each day are given a unique value
-            return ('Unknown_'+csv_file_date)
+    columns = ['cookie']
+    if context.solid_config['idle_timeout_seconds']:
+        columns += ['geoip.ip', 'user_agent_string', '@timestamp']
+    apache_df = derivation_input(apache_df, columns)
 
     if apache_df.empty is False :
-        #  Apply the function to the cookie column for each row
-        fn = lambda row: session_id(row.cookie)
-        session_col = apache_df.apply(fn, axis=1)
+        with logged_run(context, 'Derived the session column'):
+            # Extract the session ID from the cookie column in a single pass
+            session_col = extract_session_ids(apache_df['cookie'], csv_file_date,
+                                              cookie_name=context.solid_config['cookie_name'],
+                                              id_length=context.solid_config['session_id_length'])
+
+            # Optionally split the cookie-less entries into sessions of activity
+            if context.solid_config['idle_timeout_seconds']:
+                session_col = sessionize_by_inactivity(apache_df, session_col, csv_file_date,
+                                                       context.solid_config['idle_timeout_seconds'])
 
-        session_col_df = session_col.to_frame()
+            session_col_df = session_col.to_frame()
 
         # Return a  dataframe with only the additional session column
         return session_col_df
@@ -215,161 +446,59 @@ def create_session_col(context,  apache_df, csv_file_date ) -> DataFrame:
 
 
 ###################################################################################
-#   3.  Populate a new accessed_step column using the 'url_path' column
-#       This maps the step number with the step in the flow (valid for CUI and mobile)
+#   3.  Classify the 'url_path' column: accessed page, accessed_step and channel
+#       The step number maps the page to the step in the flow (valid for CUI and mobile)
+#       The rules are declared once in Apache_logs.engine.url_rules.URL_RULES
 # ###################################################################################
 
 @solid
-def create_accessed_step_col(context, apache_df) -> DataFrame:
-    """
-            Takes the initial panda DataFrame as input
-            The solid will calculate the step of the Booking flow (Mobile or CUI channel)
-            corresponding to the URL path of each log entry.
-            This is done in 2 steps : calculate the accessed page then the step
-            :param context: execution context
-            :param apache pandas DataFrame
-            :return: a dataframe containing one column the accessed step (1 to 6)
-         """
-    def accessed_page(one_url_path):
-        if ('ApplicationStartAction.do' in one_url_path):
-            return 'CUI-Start'
-        elif ('AirFareFamiliesForward.do' in one_url_path):
-            return 'CUI-AirFareFamilies'
-        elif ('AirFareFamiliesFlexibleForward.do' in one_url_path):
-            return 'CUI-AirFareFamilies'
-        elif ('ItinerarySummary.do' in one_url_path):
-            return 'CUI-ItinerarySummary'
-        elif ('TravelersDetailsForwardAction.do' in one_url_path):
-            return 'CUI-TravelersDetails'
-        elif ('PaymentExternal.do' in one_url_path):
-            return 'CUI-Payment'
-        elif ('PaymentForward.do' in one_url_path):
-            return 'CUI-Payment'
-        elif ('ConfirmationForward.do' in one_url_path):
-            return 'CUI-Confirmation'
-        elif ('palmobile/air-shopping/' in one_url_path):
-            return 'Mobile-AirFareFamilies'
-        elif ('palmobile/cart/' in one_url_path):
-            return 'Mobile-ItinerarySummary'
-        elif ('palmobile/reservations/' in one_url_path):
-            if ('/payment' in one_url_path):
-                return 'Mobile-Payment'
-            elif ('/confirmation' in one_url_path):
-                return 'Mobile-Confirmation'
-            else:
-                return 'na'
-        else:
-            return 'na'
-
-    def accessed_step(accessed_page):
-        switcher = {
-            "CUI-Start": 1,
-            "CUI-AirFareFamilies": 2,
-            "CUI-ItinerarySummary": 3,
-            "CUI-TravelersDetails": 4,
-            "CUI-Payment": 5,
-            "CUI-Confirmation": 6,
-            "Mobile-AirFareFamilies": 2,
-            "Mobile-ItinerarySummary": 3,
-            "Mobile-Payment": 5,
-            "Mobile-Confirmation": 6
-        }
-        return switcher.get(accessed_page, 0)
-
-    if apache_df.empty is False:
-        fn = lambda row: accessed_step(accessed_page(row.url_path))
-        accessed_step_col = apache_df.apply(fn, axis=1)
-        accessed_step_df = accessed_step_col.to_frame('accessed_step')
-        accessed_step_df.reset_index()
-
-        return accessed_step_df
-
-    else:
-
-        context.log.info(f'There is no apache csv file to process')
-        context.log.info(f'Exit the create_accessed_step_col solid')
-        return pd.DataFrame()
-
-
-
-# ########################################################################
-# #  4.  Populate a channel column using the 'url_path' column
-# ########################################################################
-
-@solid
-def create_channel_col (context, apache_df) -> DataFrame:
+def classify_url_path(context, apache_df) -> DataFrame:
     """
-            Takes the initial panda DataFrame as input
-            The solid will calculate the channel (Mobile or CUI )
-            corresponding to the URL path of each log entry.
+            Takes the initial panda DataFrame (or the columns shared by load_shared_apache_csv) as input
+            The solid will calculate the page, the step of the Booking flow and the channel
+            (Mobile or CUI) corresponding to the URL path of each log entry, in a single pass
             :param context: execution context
             :param apache pandas DataFrame
-            :return: a dataframe containing one column: the channel
+            :return: a dataframe containing 3 columns: page, accessed_step (1 to 6) and channel
          """
-
-    def channel(one_url_path):
-        if ('ApplicationStartAction.do' in one_url_path):
-            return 'CUI'
-        elif ('AirFareFamiliesForward.do' in one_url_path):
-            return 'CUI'
-        elif ('AirFareFamiliesFlexibleForward.do' in one_url_path):
-            return 'CUI'
-        elif ('ItinerarySummary.do' in one_url_path):
-            return 'CUI'
-        elif ('TravelersDetailsForwardAction.do' in one_url_path):
-            return 'CUI'
-        elif ('PaymentExternal.do' in one_url_path):
-            return 'CUI'
-        elif ('PaymentForward.do' in one_url_path):
-            return 'CUI'
-        elif ('ConfirmationForward.do' in one_url_path):
-            return 'CUI'
-        elif ('palmobile/air-shopping/' in one_url_path):
-            return 'Mobile'
-        elif ('palmobile/cart/' in one_url_path):
-            return 'Mobile'
-        elif ('palmobile/reservations/' in one_url_path):
-            if ('/payment' in one_url_path):
-                return 'Mobile'
-            elif ('/confirmation' in one_url_path):
-                return 'Mobile'
-            else:
-                return 'na'
-        else:
-            return 'Unknown'
+    apache_df = derivation_input(apache_df, ['url_path'])
 
     if apache_df.empty is False:
 
-        fn = lambda row: channel(row.url_path)
-        channel_col = apache_df.apply(fn, axis=1)
-        channel_col_df = channel_col.to_frame()
+        with logged_run(context, 'Classified the url paths'):
+            url_class_df = classify_url_paths(apache_df['url_path'])
 
-        return channel_col_df
+        return url_class_df
 
     else:
+
         context.log.info(f'There is no apache csv file to process')
-        context.log.info(f'Exit the create_channel_col solid')
+        context.log.info(f'Exit the classify_url_path solid')
         return pd.DataFrame()
 
 # ######################################################################################
-# #  5.  Add the 3 calculated columns (accessed page not needed) to the Dataframe
+# #  5.  Add the calculated columns (accessed page not needed) to the Dataframe
 # ######################################################################################
 
 @solid
-def add_cols_to_df (context, apache_df, session_col_df, channel_col_df, accessed_step_df)-> DataFrame:
+def add_cols_to_df (context, apache_df, session_col_df, url_class_df)-> DataFrame:
     """
-            Takes as input the initial panda DataFrame and the 3 dataframes corresponding
-            to the derived columns calculated above
+            Takes as input the initial panda DataFrame (or the frame shared by load_shared_apache_csv)
+            and the 2 dataframes corresponding to the derived columns calculated above
             The solid will return the aggregated dataframe
             :param context: execution context
             :param apache pandas DataFrame
             :return: a dataframe containing one column the accessed step (1 to 6)
          """
+    # The shared frame is read with the dtypes of the parsed frame, as in the other pipelines
+    apache_df = derivation_input(apache_df, None, decode_strings=True)
+
     if apache_df.empty is False:
 
-        apache_df = apache_df.assign(session=session_col_df.values)
-        apache_df = apache_df.assign(channel=channel_col_df.values)
-        apache_df = apache_df.assign(accessed_step=accessed_step_df.values)
+        with logged_run(context, 'Added the derived columns'):
+            apache_df = apache_df.assign(session=session_col_df['session'].values,
+                                         channel=url_class_df['channel'].values,
+                                         accessed_step=url_class_df['accessed_step'].values)
 
         return apache_df
 
@@ -382,36 +511,26 @@ def add_cols_to_df (context, apache_df, session_col_df, channel_col_df, accessed
 # ###################################################################################
 #   6.  Aggregate the data by session into a new Dataframe
 # ###################################################################################
-@solid
+@solid(
+    config={
+        'aggregation_engine': Field(String, is_optional=True, default_value=AGGREGATION_ENGINE_REDUCEAT,
+                                    description='reduceat (sort once and reduce the NumPy arrays, also computes '
+                                                'session_duration) or groupby (pandas named aggregation)'),
+    }
+)
 def aggregate_df_by_session (context, apache_df)-> DataFrame:
 
     if apache_df.empty is False:
         # Aggregate data per ip_address , session_id
-        agg_df = apache_df.groupby(['geoip.ip', 'session'], as_index=True).agg(
-        # Keep the group by columns
-        ip_address =('geoip.ip', 'first'),
-        session_id=('session', 'first'),
-        # Get channel for each session
-        channel=('channel', 'first'),
-        # Get minimum session time for the session
-        session_start_time=('@timestamp', min),
-        # Get maximum session time for the session
-        session_end_time=('@timestamp', max),
-        # Get first step reached for the session
-        first_step=('accessed_step', min),
-        # Get max step reached for the session
-        last_step=('accessed_step', max),
-        # Total number of pages reached for the session
-        num_pages_accessed=('accessed_step', len),
-        # Get geographical columns for the session
-        continent_code=('geoip.continent_code', 'first'),
-        country_code=('geoip.country_code2', 'first'),
-        country_name=('geoip.country_name', 'first'),
-        city_name=('geoip.city_name', 'first'),
-        latitude=('geoip.latitude', 'first'),
-        longitude=('geoip.longitude', 'first'),
-        timezone=('geoip.timezone', 'first')
-        )
+        # The aggregates are declared in Apache_logs.engine.aggregate.SESSION_AGGREGATES
+        engine = context.solid_config['aggregation_engine']
+        with logged_run(context, f'Aggregated the sessions with {engine}'):
+            if engine == AGGREGATION_ENGINE_REDUCEAT:
+                agg_df = aggregate_sessions_reduceat(apache_df)
+            elif engine == AGGREGATION_ENGINE_GROUPBY:
+                agg_df = aggregate_sessions(apache_df)
+            else:
+                raise ValueError(f'Invalid aggregation_engine: {engine}, expected one of {AGGREGATION_ENGINES}')
 
         return agg_df
 
@@ -427,10 +546,10 @@ def aggregate_df_by_session (context, apache_df)-> DataFrame:
 def add_session_duration_col (context, agg_df)-> DataFrame:
 
     if agg_df.empty is False:
-        # Calculate session duration
-        fn = lambda row: (row.session_end_time -  row.session_start_time).seconds
-        col = agg_df.apply(fn, axis=1)
-        agg_df = agg_df.assign(session_duration=col.values)
+        # Calculate session duration, unless the aggregation engine already did
+        if 'session_duration' not in agg_df.columns:
+            with logged_run(context, 'Added the session duration'):
+                agg_df = add_session_duration(agg_df)
 
         return (agg_df)
     else:
@@ -446,33 +565,9 @@ def create_final_df (context, apache_df):
 
     if apache_df.empty is False:
 
-        # First step, eliminate rows without an IP address as they cannot be used
-        apache_df=apache_df [apache_df['ip_address'] != 'NaN']
-
-        # If session_id is Unknown, we will assume that all Unknown session Ids for a day
-        # are for the same IP address and correspond to the same session
-        # A more sophiosticated approach could be used ( check the timestamp and group
-        # in the same sessiion all entries around the same time
-
-        columnsTitles = [
-        'ip_address',
-        'session_id',
-        'channel',
-        'session_start_time',
-        'session_end_time',
-        'session_duration',
-        'first_step',
-        'last_step',
-        'num_pages_accessed',
-        'continent_code',
-        'country_code',
-        'country_name',
-        'city_name',
-        'latitude',
-        'longitude',
-        'timezone']
-        apache_df.reset_index()
-        apache_df = apache_df.reindex(columns=columnsTitles)
+        # Eliminate rows without an IP address and re-order the columns as in the apache_session table
+        with logged_run(context, 'Created the final data frame'):
+            apache_df = final_session_frame(apache_df)
         return apache_df
 
     else:
@@ -480,7 +575,85 @@ def create_final_df (context, apache_df):
         context.log.info(f'Exit the create_final_df solid')
         return pd.DataFrame()
 
-@solid(required_resource_keys={'postgres_warehouse'})
+def insert_tracking_row(cursor, csv_file_name):
+    """
+    Insert an entry in the tracking table to mark the csv file as loaded, the caller commits
+    :param cursor: postgres cursor
+    :param csv_file_name: name of the loaded csv file
+    :return: False if the file is already loaded (or being loaded by another run)
+    """
+    insert_apache_tracking_sql = """ INSERT INTO apache_tracking
+                        (loaded_file, 
+                        loaded_date
+                        ) VALUES (%s, %s)
+                        ON CONFLICT (loaded_file) DO NOTHING
+                   """
+
+    cursor.execute(insert_apache_tracking_sql, (csv_file_name, datetime.now()))
+    return cursor.rowcount > 0
+
+
+def insert_sessions(context, client, final_df, csv_file_name, load_method=LOAD_METHOD_COPY,
+                    batch_rows=DEFAULT_BATCH_ROWS, stitch_sessions=False):
+    """
+    Insert the final data frame into the apache_session table and mark the csv file as loaded
+    Both are committed in one transaction, so a failed load can be retried without duplicates
+    :param context: execution context
+    :param client: postgres connection
+    :param final_df: DataFrame with the apache_session columns
+    :param csv_file_name: name of the loaded csv file
+    :param load_method: 'copy' (COPY FROM STDIN) or 'values' (execute_values)
+    :param batch_rows: maximum number of rows sent per batch
+    :param stitch_sessions: merge the sessions into the sessions with the same (ip_address, session_id)
+                            loaded from previous files, requires the session_stitching table option
+    :return: number of records inserted (or merged) in the apache_session table
+    """
+    cursor = client.cursor()
+
+    try:
+        # Insert an entry in the tracking table to mark the csv file as loaded
+        # This is done first: if the file is already loaded (or being loaded by another run)
+        # nothing is inserted
+        if not insert_tracking_row(cursor, csv_file_name):
+            client.rollback()
+            context.log.info(f'The file {csv_file_name} is already loaded, no records inserted')
+            return 0
+
+        # Insert the final data frame, result of the ETL pipeline, into the apache_session table
+        # The number of records comes from the insert itself, no need to count the table
+        if stitch_sessions:
+            # Sessions across midnight are merged with the part loaded from the previous file
+            inserted = upsert_sessions(cursor, final_df, method=load_method, batch_rows=batch_rows, log=context.log)
+        else:
+            inserted = load_sessions(cursor, final_df, method=load_method, batch_rows=batch_rows, log=context.log)
+
+        # Sessions and tracking entry are committed together
+        client.commit()
+
+        context.log.info(f'Inserted {inserted} records in the apache_session table')
+        return inserted
+
+    except Exception:
+        client.rollback()
+        raise
+
+    finally:
+        # tidy up
+        cursor.close()
+
+
+@solid(
+    required_resource_keys={'postgres_warehouse'},
+    config={
+        'load_method': Field(String, is_optional=True, default_value=LOAD_METHOD_COPY,
+                             description='copy (COPY FROM STDIN) or values (INSERT with execute_values)'),
+        'batch_rows': Field(Int, is_optional=True, default_value=DEFAULT_BATCH_ROWS,
+                            description='Maximum number of rows sent per batch'),
+        'stitch_sessions': Field(Bool, is_optional=True, default_value=False,
+                                 description='Merge sessions across days on (ip_address, session_id), '
+                                             'the tables must be created with session_stitching'),
+    }
+)
 def upload_to_postgres(context, final_df, csv_file_name):
     """
     Upload panda DataFrame to Postgres server and update the tracking table
@@ -496,65 +669,14 @@ def upload_to_postgres(context, final_df, csv_file_name):
 
         if client is not None:
             try:
-                # Insert the final data frame, result of the ETL pipeline, into the apache_session table
-                cursor = client.cursor()
-
-                insert_query = """ INSERT INTO apache_session (
-                            ip_address,
-                            session_id,
-                            channel,
-                            session_start_time,
-                            session_end_time,
-                            session_duration,
-                            first_step, 
-                            last_step, 
-                            num_pages_accessed, 
-                            continent_code,
-                            country_code,
-                            country_name, 
-                            city_name, 
-                            latitude, 
-                            longitude, 
-                            timezone         
-                            ) VALUES %s"""
-                tuples = [tuple(x) for x in final_df.values]
-
-                cursor.execute(count_sql('apache_session'))
-                result = cursor.fetchone()
-                pre_len = result[0]
-
-                execute_values(cursor, insert_query, tuples)
-                client.commit()
-
-                cursor.execute(count_sql('apache_session'))
-                result = cursor.fetchone()
-                post_len = result[0]
-
-                context.log.info(f'Inserted {post_len - pre_len} records in the apache_session table')
-                cursor.close()
-
-                # Insert an entry in the tracking table to mark the csv file as loaded
-                cursor = client.cursor()
-
-                insert_apache_tracking_sql = """ INSERT INTO apache_tracking
-                                    (loaded_file, 
-                                    loaded_date
-                                    ) VALUES %s
-                               """
-
-                dt = datetime.now()
-                tracking_tuple = (csv_file_name, dt)
-
-                cursor.execute(insert_apache_tracking_sql , (tracking_tuple,))
-                client.commit()
+                insert_sessions(context, client, final_df, csv_file_name,
+                                load_method=context.solid_config['load_method'],
+                                batch_rows=context.solid_config['batch_rows'],
+                                stitch_sessions=context.solid_config['stitch_sessions'])
 
             finally:
                 # tidy up
-                cursor.close()
                 client.close_connection()
         else:
             context.log.info(f'There is no apache csv file to process')
             context.log.info(f'Exit the upload_to_postgres solid')
-
-
-
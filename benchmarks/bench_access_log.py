@@ -0,0 +1,120 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+    Throughput of the raw access log parser (read_access_log), in lines/sec, with and without
+    the geo lookup, and of read_apache_csv on the same log entries exported as csv for reference
+    Usage (from the project root): PYTHONPATH=. python benchmarks/bench_access_log.py [number_of_lines]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from Apache_logs.engine.access_log import GeoLookup, read_access_log
+from Apache_logs.engine.reader import APACHE_CSV_COLUMNS, read_apache_csv
+
+URLS = ['/cui/ApplicationController', '/palmobile/search/flights', '/palmobile/select/flight',
+        '/cui/summary.html', '/cui/travelerdetails.html', '/cui/payment.html', '/cui/confirmation.html',
+        '/static/img/logo.png']
+
+REFERER = 'https://www.example.com/'
+
+AGENTS = ['Mozilla/5.0 (Linux; Android 9) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/78.0 Mobile',
+          'Mozilla/5.0 (compatible; "Monitor" bot/1.0)']
+
+
+def synthetic_log(directory, lines, seed=0):
+    """
+        Write an access log, the same entries as a csv export and a geo table of the addresses
+        :param directory: output directory
+        :param lines: number of log entries
+        :param seed: random seed
+        :return: tuple (access log path, csv path, geo table path)
+     """
+    rnd = random.Random(seed)
+    sessions = [f'{i:032X}' for i in range(max(lines // 20, 1))]
+    ips = [f'10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}' for i in range(max(lines // 40, 1))]
+
+    log_path = os.path.join(directory, 'apache_access-p-pal-2019.11.25.log')
+    csv_rows = []
+    with open(log_path, 'w') as log:
+        for _ in range(lines):
+            second = rnd.randrange(86400)
+            ip, url, session = rnd.choice(ips), rnd.choice(URLS), rnd.choice(sessions)
+            cookie = f'_ga=GA1.2.1234; JSESSIONID={session}' if rnd.random() < 0.9 else '-'
+            agent = rnd.choice(AGENTS)
+            # Some requests without response time, logged as '-'
+            size, micros = rnd.randrange(100000), rnd.randrange(10, 5000000) if rnd.random() < 0.99 else None
+            # apache escapes the quotes of the quoted fields
+            logged_agent = agent.replace('"', '\\"')
+            logged_micros = micros if micros is not None else '-'
+            log.write(f'{ip} - - [25/Nov/2019:{second // 3600:02d}:{second // 60 % 60:02d}:{second % 60:02d} +0000] '
+                      f'"GET {url}?lang=en HTTP/1.1" 200 {size} "{REFERER}" "{logged_agent}" "{cookie}" '
+                      f'{logged_micros}\n')
+            csv_rows.append({'@timestamp': f'2019-11-25T{second // 3600:02d}:{second // 60 % 60:02d}:'
+                                           f'{second % 60:02d}.000Z',
+                             'geoip.ip': ip, 'url_path': url, 'referer': REFERER,
+                             'cookie': cookie if cookie != '-' else None, 'user_agent_string': agent,
+                             'http_method': 'GET', 'response_code': 200, 'response_size_bytes': size,
+                             'response_time_microseconds': micros})
+
+    csv_path = os.path.join(directory, 'apache_access-p-pal-2019.11.25.csv')
+    pd.DataFrame(csv_rows).reindex(columns=APACHE_CSV_COLUMNS).to_csv(csv_path, index=False)
+
+    geo_path = os.path.join(directory, 'geo_ranges.csv')
+    pd.DataFrame({'ip_from': ['10.0.0.0', '10.1.0.0'], 'ip_to': ['10.0.255.255', '10.255.255.255'],
+                  'city_name': ['Manila', 'Sydney'], 'country_code2': ['PH', 'AU'],
+                  'country_name': ['Philippines', 'Australia'], 'continent_code': ['AS', 'OC'],
+                  'latitude': [14.6, -33.8], 'longitude': [121.0, 151.2],
+                  'timezone': ['Asia/Manila', 'Australia/Sydney']}).to_csv(geo_path, index=False)
+    return log_path, csv_path, geo_path
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    with tempfile.TemporaryDirectory() as directory:
+        log_path, csv_path, geo_path = synthetic_log(directory, lines)
+
+        stats = {}
+        access_df, access_secs = timed(read_access_log, log_path, stats=stats)
+        geo_df, geo_secs = timed(read_access_log, log_path, geo_lookup=GeoLookup.from_csv(geo_path))
+        csv_df, csv_secs = timed(read_apache_csv, csv_path)
+
+        assert stats['unmatched'] == 0 and len(access_df) == len(csv_df) == lines
+        # Same frame as the csv export, apart from the _id and geo columns set by the export
+        pd.testing.assert_frame_equal(access_df.drop(columns=['_id']), csv_df.drop(columns=['_id']))
+        assert geo_df['geoip.city_name'].notna().all()
+
+    print(f'lines: {lines}')
+    print(f'read_access_log:             {access_secs:8.3f} s  {lines / access_secs:12,.0f} lines/s')
+    print(f'read_access_log + geo:       {geo_secs:8.3f} s  {lines / geo_secs:12,.0f} lines/s')
+    print(f'read_apache_csv (reference): {csv_secs:8.3f} s  {lines / csv_secs:12,.0f} lines/s')
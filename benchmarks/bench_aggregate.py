@@ -0,0 +1,107 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+    Benchmark of the session aggregation: pandas named groupby aggregation (aggregate_sessions
+    followed by add_session_duration) against the NumPy sort-and-reduceat engine
+    The two results are checked to be identical
+    Usage (from the project root): PYTHONPATH=. python benchmarks/bench_aggregate.py [number_of_rows]
+"""
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from Apache_logs.engine.aggregate import aggregate_sessions, aggregate_sessions_reduceat
+from Apache_logs.engine.finalize import add_session_duration
+
+
+def synthetic_entries(rows, seed=0):
+    """
+        Build log entries with the derived session columns, resembling a day of DCP UI logs:
+        a few entries per session, some entries without IP address or geo location,
+        some sessions spanning more than one day
+        :param rows: number of log entries
+        :param seed: random seed
+        :return: pandas DataFrame of log entries
+     """
+    rnd = np.random.RandomState(seed)
+    sessions = max(rows // 15, 1)
+    ips = np.array([f'10.{i // 65536}.{i // 256 % 256}.{i % 256}' for i in range(max(sessions // 2, 1))],
+                   dtype=object)
+    session_ids = np.array([f'{i:032X}' for i in range(sessions)], dtype=object)
+
+    session = rnd.randint(0, sessions, rows)
+    ip = ips[session % len(ips)].copy()
+    ip[rnd.random_sample(rows) < 0.01] = np.nan
+
+    # A third of the entries have no geo location, the first entry of a session may be one of them
+    located = rnd.random_sample(rows) >= 0.33
+    cities = np.array(['Dublin', 'Cork', 'London', 'Paris'], dtype=object)
+
+    def geo(values):
+        return pd.Series(values, dtype=object).where(located)
+
+    start = pd.Timestamp('2019-11-25', tz='UTC')
+    offsets = rnd.randint(0, 2 * 86400, rows).astype('int64') * 1000000000
+
+    return pd.DataFrame({
+        'geoip.ip': ip,
+        'session': session_ids[session],
+        'channel': pd.Categorical(np.array(['CUI', 'Mobile', 'na', 'Unknown'])[session % 4],
+                                  categories=['CUI', 'Mobile', 'na', 'Unknown']),
+        '@timestamp': start + pd.to_timedelta(offsets),
+        'accessed_step': rnd.randint(0, 7, rows).astype('int8'),
+        'geoip.continent_code': geo(np.full(rows, 'EU', dtype=object)),
+        'geoip.country_code2': geo(np.full(rows, 'IE', dtype=object)),
+        'geoip.country_name': geo(np.full(rows, 'Ireland', dtype=object)),
+        'geoip.city_name': geo(cities[session % len(cities)]),
+        'geoip.latitude': np.where(located, 53.35, np.nan).astype('float32'),
+        'geoip.longitude': np.where(located, -6.26, np.nan).astype('float32'),
+        'geoip.timezone': geo(np.full(rows, 'Europe/Dublin', dtype=object)),
+    })
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    df = synthetic_entries(rows)
+
+    groupby, groupby_secs = timed(lambda frame: add_session_duration(aggregate_sessions(frame)), df)
+    reduceat, reduceat_secs = timed(aggregate_sessions_reduceat, df)
+
+    # groupby returns None for an object column without any value in a session, reduceat returns NaN
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        pd.testing.assert_frame_equal(groupby, reduceat)
+    assert (reduceat['session_duration'] > 86400).any(), 'no session longer than one day'
+
+    print(f'rows: {rows}  sessions: {len(reduceat)}')
+    print(f'groupby + add_session_duration: {groupby_secs:8.3f} s  {rows / groupby_secs:12,.0f} rows/s')
+    print(f'reduceat:                       {reduceat_secs:8.3f} s  {rows / reduceat_secs:12,.0f} rows/s')
+    print(f'speed-up:                       {groupby_secs / reduceat_secs:8.1f} x')
@@ -0,0 +1,73 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+    Wall time and peak memory, per file, of the fine-grained csv_to_postgres_pipeline steps
+    (load_apache_csv to create_final_df) against the fused single-solid mode
+    The two results are checked to be identical
+    Each mode runs twice per file: once for the wall time, once with tracemalloc for the peak memory
+    Usage (from the project root): PYTHONPATH=. python benchmarks/bench_fused.py apache_access-p-pal-2019.11.25.csv [more csv files]
+"""
+import os
+import sys
+
+import pandas as pd
+
+from Apache_logs.engine.aggregate import aggregate_sessions_reduceat
+from Apache_logs.engine.discovery import apache_file_date
+from Apache_logs.engine.finalize import final_session_frame
+from Apache_logs.engine.fused import fused_session_frame, measure_run
+from Apache_logs.engine.reader import read_apache_csv
+from Apache_logs.engine.sessions import extract_session_ids
+from Apache_logs.engine.url_rules import classify_url_paths
+
+
+def fine_grained_session_frame(file_path, csv_file_date):
+    """ The csv_to_postgres_pipeline solids, one frame handed to the next """
+    apache_df = read_apache_csv(file_path)
+    session_col_df = extract_session_ids(apache_df['cookie'], csv_file_date).to_frame()
+    url_class_df = classify_url_paths(apache_df['url_path'])
+    extended_df = apache_df.assign(session=session_col_df['session'].values,
+                                   channel=url_class_df['channel'].values,
+                                   accessed_step=url_class_df['accessed_step'].values)
+    agg_df = aggregate_sessions_reduceat(extended_df)
+    return final_session_frame(agg_df)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+
+    print(f'{"file":40} {"mode":>12} {"seconds":>9} {"peak MB":>9}')
+    for file_path in sys.argv[1:]:
+        csv_file_date = apache_file_date(os.path.basename(file_path))
+
+        results = {}
+        for mode, run_mode in [('fine-grained', lambda: fine_grained_session_frame(file_path, csv_file_date)),
+                               ('fused', lambda: fused_session_frame(file_path, csv_file_date)[0])]:
+            with measure_run(trace_memory=False) as timed_run:
+                results[mode] = run_mode()
+            with measure_run(trace_memory=True) as traced_run:
+                run_mode()
+            print(f'{os.path.basename(file_path):40} {mode:>12} {timed_run["seconds"]:9.3f} '
+                  f'{traced_run["peak_bytes"] / 1024 ** 2:9.1f}')
+
+        pd.testing.assert_frame_equal(results['fine-grained'], results['fused'])
@@ -0,0 +1,102 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+    Benchmark of the session ID extraction: per-row apply (previous create_session_col logic)
+    against the vectorized str.extract engine
+    Usage (from the project root): PYTHONPATH=. python benchmarks/bench_session_col.py [number_of_rows]
+"""
+import random
+import re
+import string
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from Apache_logs.engine.sessions import extract_session_ids
+
+
+def synthetic_cookies(rows, seed=0):
+    """
+        Build a cookie column resembling the DCP UI logs: mostly JSESSIONID cookies,
+        some cookie-less entries and some NaN values
+        :param rows: number of log entries
+        :param seed: random seed
+        :return: pandas DataFrame with a cookie column
+     """
+    rnd = random.Random(seed)
+    alphabet = string.ascii_uppercase + string.digits
+    # A day of logs contains far fewer sessions than log entries
+    sessions = [''.join(rnd.choice(alphabet) for _ in range(32)) for _ in range(max(rows // 20, 1))]
+
+    cookies = []
+    for _ in range(rows):
+        draw = rnd.random()
+        if draw < 0.85:
+            cookies.append('_ga=GA1.2.1234; JSESSIONID=' + rnd.choice(sessions) + '; lang=en')
+        elif draw < 0.95:
+            cookies.append('_ga=GA1.2.1234; lang=en')
+        else:
+            cookies.append(np.nan)
+    return pd.DataFrame({'cookie': cookies})
+
+
+def per_row_session_col(apache_df, csv_file_date):
+    """ The previous implementation: one Python call per row """
+    def session_id(one_cookie):
+        regexp = r'JSESSIONID=\w{32}'
+        if 'JSESSIONID=' in one_cookie:
+            session_id_list = re.findall(regexp, one_cookie)
+            return session_id_list[0][11:43]
+        else:
+            return 'Unknown_' + csv_file_date
+
+    fn = lambda row: session_id(row.cookie)
+    return apache_df.apply(fn, axis=1)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    csv_file_date = '2019.11.25'
+    df = synthetic_cookies(rows)
+
+    # The per-row path crashes on NaN cookies, so it is timed on the string rows only
+    string_df = df[df['cookie'].notna()]
+
+    per_row, per_row_secs = timed(per_row_session_col, string_df, csv_file_date)
+    vectorized, vectorized_secs = timed(extract_session_ids, string_df['cookie'], csv_file_date)
+    assert per_row.tolist() == vectorized.tolist()
+
+    _, all_rows_secs = timed(extract_session_ids, df['cookie'], csv_file_date)
+
+    print(f'rows (string cookies): {len(string_df)}')
+    print(f'per-row apply:         {per_row_secs:8.3f} s  {len(string_df) / per_row_secs:12,.0f} rows/s')
+    print(f'vectorized extract:    {vectorized_secs:8.3f} s  {len(string_df) / vectorized_secs:12,.0f} rows/s')
+    print(f'speed-up:              {per_row_secs / vectorized_secs:8.1f} x')
+    print(f'vectorized, {rows} rows incl. NaN cookies: {all_rows_secs:.3f} s')
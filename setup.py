@@ -18,11 +18,15 @@ setuptools.setup(
       'dagit>=0.6.6',
       'dagster_pandas>=0.6.6',
       'pandas>=0.25.3',
+      'pyarrow>=0.17.0',
       'plotly>=4.3.0',
       'psutil>=5.6.7',
       'Menu>=3.2.2',
       'pycountry>=19.8.18',
     ],
+    extras_require={
+      'zstd': ['zstandard>=0.13.0'],
+    },
     dependency_links=[
         'git+https://github.com/ib-da-ncirl/db_toolkit.git#egg=db_toolkit',
         'git+https://github.com/ib-da-ncirl/dagster_toolkit.git#egg=dagster_toolkit',
@@ -33,5 +37,5 @@ setuptools.setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
 )
\ No newline at end of file
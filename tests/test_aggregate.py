@@ -0,0 +1,127 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from Apache_logs.engine.aggregate import aggregate_sessions, aggregate_sessions_reduceat
+from Apache_logs.engine.finalize import add_session_duration, final_session_frame
+from Apache_logs.engine.sessions import extract_session_ids
+
+##################################################################################
+#   The reduceat aggregation engine returns the sessions of the groupby engine
+##################################################################################
+
+COOKIES = ['JSESSIONID=0123456789ABCDEF0123456789ABCDEF; lang=en',
+           np.nan,
+           'JSESSIONID=FEDCBA9876543210FEDCBA9876543210',
+           'lang=en']
+
+
+def log_entries(tz=None):
+    """
+        Log entries with the derived session columns: NaN cookies (no session ID), entries without
+        timestamp (NaT), without IP address or geo location, and single-entry sessions
+        :param tz: timezone of the @timestamp column, None for naive timestamps
+        :return: pandas DataFrame of log entries
+     """
+    timestamps = pd.to_datetime(['2019-11-25 10:00:00', None, '2019-11-25 10:05:00', '2019-11-25 09:00:00',
+                                 None, '2019-11-25 11:00:00', '2019-11-25 12:00:00', None,
+                                 '2019-11-26 10:00:00', '2019-11-25 08:00:00'])
+    if tz is not None:
+        timestamps = timestamps.tz_localize(tz)
+    cookies = [COOKIES[i] for i in [0, 0, 0, 1, 1, 2, 3, 3, 2, 0]]
+    df = pd.DataFrame({
+        'geoip.ip': ['10.0.0.1', '10.0.0.1', '10.0.0.1', '10.0.0.2', '10.0.0.2', '10.0.0.3', '10.0.0.4',
+                     '10.0.0.5', '10.0.0.3', np.nan],
+        'cookie': cookies,
+        'channel': pd.Categorical(['CUI', 'CUI', 'CUI', 'Mobile', 'Mobile', 'na', 'Unknown', 'CUI', 'na', 'CUI'],
+                                  categories=['CUI', 'Mobile', 'na', 'Unknown']),
+        '@timestamp': timestamps,
+        'accessed_step': np.array([1, 2, 3, 0, 6, 4, 5, 1, 2, 3], dtype='int8'),
+        'geoip.continent_code': ['EU', np.nan, 'EU', np.nan, 'AS', 'OC', 'AS', np.nan, 'OC', 'EU'],
+        'geoip.country_code2': ['IE', np.nan, 'IE', np.nan, 'PH', 'AU', 'PH', np.nan, 'AU', 'IE'],
+        'geoip.country_name': ['Ireland', np.nan, 'Ireland', np.nan, 'Philippines', 'Australia', 'Philippines',
+                               np.nan, 'Australia', 'Ireland'],
+        'geoip.city_name': ['Dublin', np.nan, 'Cork', np.nan, 'Manila', 'Sydney', np.nan, np.nan, 'Sydney',
+                            'Dublin'],
+        'geoip.latitude': np.array([53.35, np.nan, 51.9, np.nan, 14.6, -33.9, 14.6, np.nan, -33.9, 53.35],
+                                   dtype='float32'),
+        'geoip.longitude': np.array([-6.26, np.nan, -8.47, np.nan, 121.0, 151.2, 121.0, np.nan, 151.2, -6.26],
+                                    dtype='float32'),
+        'geoip.timezone': ['Europe/Dublin', np.nan, 'Europe/Dublin', np.nan, 'Asia/Manila', 'Australia/Sydney',
+                           np.nan, np.nan, 'Australia/Sydney', 'Europe/Dublin'],
+    })
+    # The NaN cookies and the cookies without session ID get the Unknown_<date> session
+    return df.assign(session=extract_session_ids(df['cookie'], '2019.11.25.'))
+
+
+@pytest.mark.parametrize('tz', [None, 'UTC'])
+def test_reduceat_matches_groupby(tz):
+    df = log_entries(tz)
+    assert df['cookie'].isna().any()
+
+    expected = aggregate_sessions(df)
+    result = aggregate_sessions_reduceat(df, with_duration=False)
+
+    # One row per (ip, session): the single-entry sessions and the session with a NaT are kept
+    assert (df.groupby(['geoip.ip', 'session']).size() == 1).any()
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_reduceat_skips_nat():
+    df = log_entries()
+    result = aggregate_sessions_reduceat(df, with_duration=False)
+
+    session = result.loc[('10.0.0.1', '0123456789ABCDEF0123456789ABCDEF')]
+    assert session['session_start_time'] == pd.Timestamp('2019-11-25 10:00:00')
+    assert session['session_end_time'] == pd.Timestamp('2019-11-25 10:05:00')
+
+
+def test_reduceat_all_nat_session():
+    df = log_entries()
+    df.loc[df['geoip.ip'] == '10.0.0.4', '@timestamp'] = pd.NaT
+    result = aggregate_sessions_reduceat(df, with_duration=False)
+
+    pd.testing.assert_frame_equal(result, aggregate_sessions(df))
+    # 10.0.0.4 and 10.0.0.5 have no entry with a timestamp
+    assert pd.isna(result['session_start_time']).sum() == 2
+
+
+def test_duration_of_all_nat_session():
+    df = log_entries()
+    result = aggregate_sessions_reduceat(df)
+
+    # The default path computes the duration: missing for 10.0.0.5, which has no timestamp
+    assert result['session_duration'].dtype == 'Int64'
+    assert pd.isna(result.loc[('10.0.0.5', 'Unknown_2019.11.25.'), 'session_duration'])
+    assert result.loc[('10.0.0.1', '0123456789ABCDEF0123456789ABCDEF'), 'session_duration'] == 300
+    pd.testing.assert_series_equal(result['session_duration'],
+                                   add_session_duration(aggregate_sessions(df))['session_duration'])
+
+
+def test_final_frame_drops_all_nat_session():
+    final_df = final_session_frame(aggregate_sessions_reduceat(log_entries()))
+
+    assert final_df['session_start_time'].notna().all()
+    assert final_df['session_duration'].dtype == 'int64'
+    assert '10.0.0.5' not in final_df['ip_address'].tolist()
@@ -0,0 +1,61 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import pandas as pd
+
+from Apache_logs.engine.partitions import PARTITION_BY_DAY, PARTITION_BY_MONTH, ensure_session_partitions
+
+##################################################################################
+#   The partitions are created for the session start times, a NaT start time is ignored
+##################################################################################
+
+
+class RecordingCursor:
+    """ Cursor of a partitioned table without partitions yet, recording the statements executed """
+
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql)
+
+    def fetchall(self):
+        return []
+
+
+def test_partitions_skip_nat_start_time():
+    start_times = pd.Series(pd.to_datetime(['2019-11-25 10:00:00', None, '2019-11-26 23:59:59', '2019-11-25 12:00:00'],
+                                           utc=True))
+    assert start_times.isna().any()
+
+    created = ensure_session_partitions(RecordingCursor(), start_times, PARTITION_BY_DAY)
+    assert len(created) == 2
+
+    created = ensure_session_partitions(RecordingCursor(), start_times, PARTITION_BY_MONTH)
+    assert len(created) == 1
+
+
+def test_partitions_all_nat_start_times():
+    cursor = RecordingCursor()
+    start_times = pd.Series(pd.to_datetime([None, None]))
+
+    assert ensure_session_partitions(cursor, start_times, PARTITION_BY_DAY) == []
+    assert cursor.statements == []
@@ -0,0 +1,72 @@
+# The MIT License (MIT)
+# Copyright (c) 2019 Philippe Tap
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import pandas as pd
+
+from Apache_logs.engine.sessions import extract_session_ids, sessionize_by_inactivity
+
+##################################################################################
+#   A cookie-less session crossing a chunk boundary keeps one session ID
+##################################################################################
+
+IDLE_TIMEOUT = 1800
+
+
+def cookieless_entries():
+    """
+        Cookie-less log entries of two visitors, in file order: 10.0.0.1 is idle for 1 hour after 10:20
+        :return: pandas DataFrame of log entries
+     """
+    return pd.DataFrame({
+        'geoip.ip': ['10.0.0.1', '10.0.0.2', '10.0.0.1', '10.0.0.1', '10.0.0.2', '10.0.0.1'],
+        'user_agent_string': ['Firefox', 'Chrome', 'Firefox', 'Firefox', 'Chrome', 'Firefox'],
+        'cookie': ['lang=en'] * 6,
+        '@timestamp': pd.to_datetime(['2019-11-25 10:00:00', '2019-11-25 10:01:00', '2019-11-25 10:10:00',
+                                      '2019-11-25 10:20:00', '2019-11-25 10:25:00', '2019-11-25 11:20:00'],
+                                     utc=True),
+    })
+
+
+def sessionize(apache_df, open_sessions=None):
+    session = extract_session_ids(apache_df['cookie'], '2019.11.25.')
+    return sessionize_by_inactivity(apache_df, session, '2019.11.25.', IDLE_TIMEOUT, open_sessions)
+
+
+def test_sessions_continue_across_chunks():
+    apache_df = cookieless_entries()
+    expected = sessionize(apache_df)
+    # 10.0.0.1 has 2 sessions split by the idle hour, 10.0.0.2 one
+    assert expected.nunique() == 3
+
+    for boundary in range(1, len(apache_df)):
+        open_sessions = {}
+        chunks = [apache_df.iloc[:boundary], apache_df.iloc[boundary:]]
+        result = pd.concat([sessionize(chunk, open_sessions) for chunk in chunks])
+        pd.testing.assert_series_equal(result, expected)
+
+
+def test_sessions_split_without_open_sessions():
+    apache_df = cookieless_entries()
+    chunks = [apache_df.iloc[:3], apache_df.iloc[3:]]
+    result = pd.concat([sessionize(chunk) for chunk in chunks])
+
+    # Sessionized on its own, the second chunk starts new sessions
+    assert result.nunique() == 5